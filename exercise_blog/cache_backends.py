@@ -0,0 +1,163 @@
+from urllib.parse import urlparse
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Cache backends selected by the scheme of CACHE_URL.
+CACHE_BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "rediss": "django.core.cache.backends.redis.RedisCache",
+    "memcached": "django.core.cache.backends.memcached.PyMemcacheCache",
+    "dummy": "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+def parse_cache_url(url):
+    """
+    Returns a CACHES entry for a cache URL.
+
+    Supported forms are locmem://[name], file:///absolute/path,
+    redis[s]://host:port/db, memcached://host:port[,host:port] and
+    dummy://. The redis and memcached backends need the redis and
+    pymemcache packages respectively.
+
+    Args:
+        url (str): The cache URL, usually from the CACHE_URL variable.
+
+    Returns:
+        dict: The BACKEND and LOCATION for the cache.
+
+    Raises:
+        ValueError: If the scheme is not supported.
+    """
+    parsed = urlparse(url)
+    try:
+        backend = CACHE_BACKENDS[parsed.scheme]
+    except KeyError:
+        raise ValueError(f"Unsupported cache URL scheme: {parsed.scheme!r}")
+
+    if parsed.scheme in ("redis", "rediss"):
+        location = url
+    elif parsed.scheme == "memcached":
+        location = parsed.netloc.split(",")
+    elif parsed.scheme == "file":
+        location = parsed.path
+    else:
+        location = parsed.netloc
+    return {"BACKEND": backend, "LOCATION": location}
+
+
+class TieredCache(BaseCache):
+    """
+    Two-level cache: a small in-process LRU in front of a shared cache.
+
+    Reads are answered from this process's memory when possible and
+    otherwise from the shared cache, whose answer is kept locally for
+    at most LOCAL_TIMEOUT seconds. Writes go to both levels. Keys and
+    versions are passed through untouched; each level applies its own
+    KEY_PREFIX.
+
+    Another process's writes are therefore seen up to LOCAL_TIMEOUT
+    late. add() only ever consults the shared cache, so it can still be
+    used as a lock.
+
+    OPTIONS:
+        SHARED: The alias of the shared cache in CACHES.
+        LOCAL_TIMEOUT: Seconds a value may be served from memory.
+        LOCAL_MAX_ENTRIES: Size of the in-process LRU.
+    """
+
+    def __init__(self, location, params):
+        options = dict(params.get("OPTIONS", {}))
+        self.shared_alias = options.pop("SHARED", "shared")
+        self.local_timeout = options.pop("LOCAL_TIMEOUT", 5)
+        max_entries = options.pop("LOCAL_MAX_ENTRIES", 1000)
+        super().__init__({**params, "OPTIONS": options})
+        self.local = LocMemCache(
+            f"tiered:{location}",
+            {
+                "TIMEOUT": self.local_timeout,
+                "OPTIONS": {"MAX_ENTRIES": max_entries},
+            },
+        )
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.add(key, value, timeout, version=version)
+
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = self.local.get(key, missing, version=version)
+        if value is missing:
+            value = self.shared.get(key, missing, version=version)
+            if value is missing:
+                return default
+            self.local.set(key, value, version=version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.local.set(
+            key, value, self._local_timeout(timeout), version=version
+        )
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.delete(key, version=version)
+
+    def get_many(self, keys, version=None):
+        found = self.local.get_many(keys, version=version)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = self.shared.get_many(missing, version=version)
+            if fetched:
+                self.local.set_many(fetched, version=version)
+            found.update(fetched)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        self.local.set_many(
+            data, self._local_timeout(timeout), version=version
+        )
+        return failed
+
+    def delete_many(self, keys, version=None):
+        self.local.delete_many(keys, version=version)
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(
+            key, version=version
+        ) or self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self.local.set(key, value, version=version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,9 @@
+# Django's database backends and the instrumented subclasses of them
+# that settings.py swaps in.
+INSTRUMENTED_BACKENDS = {
+    "django.db.backends.postgresql": "exercise_blog.db_backends.postgresql",
+    "django.db.backends.postgresql_psycopg2": (
+        "exercise_blog.db_backends.postgresql"
+    ),
+    "django.db.backends.sqlite3": "exercise_blog.db_backends.sqlite3",
+}
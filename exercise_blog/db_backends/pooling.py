@@ -0,0 +1,57 @@
+import time
+
+from exercises.metrics import pool_stats
+
+
+class PoolStatsMixin:
+    """
+    Counts how a database wrapper's connection is handed out, for the
+    pool statistics in exercises.metrics.
+
+    With CONN_MAX_AGE each thread keeps its connection between requests,
+    which makes the thread's wrapper a pool of one. A request checks the
+    connection out on its first query and in again when Django looks at
+    it at the start or end of the next request. A checkout that finds no
+    open connection waits for a new one, and that wait is timed.
+    """
+
+    checked_out = False
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            # A connection that could not be opened was waited for too.
+            pool_stats.add(self.alias, "connects")
+            pool_stats.add(
+                self.alias, "connect_seconds", time.perf_counter() - started
+            )
+
+    def ensure_connection(self):
+        # Runs for every cursor, so the common case is one attribute read.
+        if not self.checked_out:
+            self.checked_out = True
+            pool_stats.add(self.alias, "checkouts")
+            pool_stats.add(self.alias, "checked_out")
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        # Called by Django's request_started and request_finished
+        # handlers, so this is where a request hands the connection back.
+        # The checks Django makes on it here are not a checkout.
+        was_checked_out = self.checked_out
+        self.checked_out = True
+        try:
+            super().close_if_unusable_or_obsolete()
+        finally:
+            self.checked_out = False
+            if was_checked_out:
+                pool_stats.add(self.alias, "checked_out", -1)
+
+    def close(self):
+        was_open = self.connection is not None
+        super().close()
+        # In-memory SQLite databases are never really closed.
+        if was_open and self.connection is None:
+            pool_stats.add(self.alias, "closes")
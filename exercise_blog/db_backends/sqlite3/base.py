@@ -0,0 +1,7 @@
+from django.db.backends.sqlite3 import base
+
+from exercise_blog.db_backends.pooling import PoolStatsMixin
+
+
+class DatabaseWrapper(PoolStatsMixin, base.DatabaseWrapper):
+    pass
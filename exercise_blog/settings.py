@@ -14,6 +14,9 @@ from pathlib import Path
 import os
 import dj_database_url
 
+from .cache_backends import parse_cache_url
+from .db_backends import INSTRUMENTED_BACKENDS
+
 if os.path.isfile("env.py"):
     import env
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -102,15 +105,51 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 SITE_ID = 1
 
+# Page the public exercise list by (title, id) cursors instead of
+# ?page=N offsets. Old page-number links keep working either way.
+EXERCISE_LIST_CURSOR_PAGINATION = (
+    os.environ.get("EXERCISE_LIST_CURSOR_PAGINATION", "") == "1"
+)
+
+# Approved comments shipped with an exercise page. The rest are fetched
+# a page at a time by static/js/comments.js as the reader scrolls.
+EXERCISE_COMMENTS_PER_PAGE = 10
+
+# Transformed Cloudinary URLs are pure functions of their arguments, so
+# they are kept in a per-process LRU of this many entries and, behind
+# it, in the Django cache for IMAGE_URL_CACHE_TIMEOUT (None = forever).
+IMAGE_URL_LRU_SIZE = 4096
+IMAGE_URL_CACHE_TIMEOUT = None
+
+# The {% picture %} tag serves each image at every width in this ladder,
+# in each of these formats (the last one is the <img> fallback), cropped
+# to RESPONSIVE_IMAGE_RATIO so the width/height attributes always hold.
+RESPONSIVE_IMAGE_WIDTHS = (320, 480, 640, 960, 1280)
+RESPONSIVE_IMAGE_FORMATS = ("avif", "webp", "jpg")
+RESPONSIVE_IMAGE_RATIO = "4:3"
+
+# Mixed into the ETags of the exercise pages so that a deploy changing
+# their templates also changes the tags. Heroku sets SOURCE_VERSION to
+# the commit being built.
+CONTENT_ETAG_VERSION = os.environ.get("SOURCE_VERSION", "")
+
 
 ACCOUNT_FORMS = {
     "signup": "exercises.forms.CustomSignupForm",
 }
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the rest of the stack.
+    "exercises.middleware.MetricsMiddleware",
     'django.middleware.gzip.GZipMiddleware', 
     "django.middleware.security.SecurityMiddleware",
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, able to run on the event loop when served over ASGI.
+    "exercises.middleware.AsyncWhiteNoiseMiddleware",
+    # Decides which database the rest of the stack reads from.
+    "exercises.middleware.ReplicaMiddleware",
+    # Ahead of the session and auth middleware, so cached anonymous
+    # pages skip them entirely.
+    "exercises.middleware.AnonymousPageCacheMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -155,9 +194,150 @@ WSGI_APPLICATION = "exercise_blog.wsgi.application"
 # }
 
 
-DATABASES = {
-    "default": dj_database_url.parse(os.environ.get("DATABASE_URL"))
+# Connections are opened per request unless DATABASE_CONN_MAX_AGE is
+# set, in seconds, or "none" to keep them for good. Each thread then
+# keeps its connection between requests, and with health checks on it is
+# pinged before the first query of a request rather than failing it.
+# Under ASGI every request runs queries in a different thread, so leave
+# persistent connections off there.
+DATABASE_CONN_MAX_AGE = os.environ.get("DATABASE_CONN_MAX_AGE", "0")
+
+
+def database(url):
+    """
+    Returns a DATABASES entry for a database URL, with the connection
+    settings above and a backend that counts connections for /metrics.
+    """
+    config = dj_database_url.parse(
+        url,
+        conn_max_age=(
+            None
+            if DATABASE_CONN_MAX_AGE.lower() == "none"
+            else int(DATABASE_CONN_MAX_AGE)
+        ),
+    )
+    config["CONN_HEALTH_CHECKS"] = (
+        os.environ.get("DATABASE_CONN_HEALTH_CHECKS", "1") == "1"
+    )
+    config["ENGINE"] = INSTRUMENTED_BACKENDS.get(
+        config["ENGINE"], config["ENGINE"]
+    )
+    return config
+
+
+DATABASES = {"default": database(os.environ.get("DATABASE_URL"))}
+
+# Read replicas of the default database, as comma separated URLs. GET
+# requests to the public pages read from them in turn; a replica that
+# cannot be reached is skipped for REPLICA_RETRY_SECONDS. Visitors who
+# have just written read from the primary for REPLICA_PIN_SECONDS, which
+# should exceed the usual replication lag, and pages rendered from a
+# replica stay cached for REPLICA_CACHE_TIMEOUT seconds at most.
+DATABASE_REPLICAS = []
+for number, url in enumerate(
+    os.environ.get("DATABASE_REPLICA_URLS", "").split(","), start=1
+):
+    if url.strip():
+        DATABASES[f"replica{number}"] = {
+            **database(url.strip()),
+            "TEST": {"MIRROR": "default"},
+        }
+        DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = (
+    ["exercises.routers.ReplicaRouter"] if DATABASE_REPLICAS else []
+)
+REPLICA_PIN_SECONDS = 10
+REPLICA_RETRY_SECONDS = 30
+REPLICA_CACHE_TIMEOUT = 60
+
+# Caching is two-tier: a small LRU in each process in front of a shared
+# cache chosen by CACHE_URL (redis://, memcached://, file:///path or
+# locmem://). Without CACHE_URL the "shared" tier is only per-process
+# memory, so the cache versions that edits bump are not seen by the
+# other gunicorn workers, and whatever depends on them has to expire
+# quickly instead (see SHARED_CACHE).
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHES = {
+    "default": {
+        "BACKEND": "exercise_blog.cache_backends.TieredCache",
+        "LOCATION": "default",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_TIMEOUT": int(os.environ.get("CACHE_LOCAL_TIMEOUT", 5)),
+            "LOCAL_MAX_ENTRIES": int(
+                os.environ.get("CACHE_LOCAL_MAX_ENTRIES", 1000)
+            ),
+        },
+    },
+    "shared": parse_cache_url(CACHE_URL or "locmem://shared"),
+}
+
+# Sessions are read from the shared cache and only fall back to the
+# database on a miss. They skip the in-process tier, as a logout must
+# take effect in every worker at once, and without a real shared cache
+# they stay database-only for the same reason.
+SESSION_ENGINE = os.environ.get(
+    "SESSION_ENGINE",
+    "django.contrib.sessions.backends.cached_db"
+    if CACHE_URL
+    else "django.contrib.sessions.backends.db",
+)
+SESSION_CACHE_ALIAS = "shared"
+
+# Whether every web process sees the same cache, and so the same cache
+# versions. locmem:// and dummy:// are private to each process.
+SHARED_CACHE = bool(CACHE_URL) and not CACHE_URL.startswith(
+    ("locmem:", "dummy:")
+)
+
+# How long rendered exercise bodies and comment lists stay cached. Edits
+# invalidate them through signals, so with a shared cache this only
+# bounds how long superseded versions linger. Without one, the other
+# workers never see the invalidation, so fragments are only kept for a
+# few seconds.
+EXERCISE_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24 if SHARED_CACHE else 5
+
+# Seconds anonymous visitors are served home/detail pages from the page
+# cache (0 turns it off). Signals purge entries as soon as the content
+# changes, so this only bounds how long an unchanged page is reused. The
+# purge only reaches every worker through a shared cache, so without
+# one the page cache stays off.
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 10 if SHARED_CACHE else 0
+
+# Rate limits, as token buckets of (burst, seconds to earn back one
+# request) per signed-in user and per client address. Buckets live in
+# the shared tier so that every worker spends from the same one.
+THROTTLE_RATES = {
+    "report_comment": {"user": (5, 60), "ip": (20, 15)},
 }
+THROTTLE_CACHE_ALIAS = "shared"
+
+# Directory of the contact message spool. When set, contact form
+# submissions are queued there and stored in batches by
+# "manage.py run_contact_worker", which must run on the same machine
+# (and, on Heroku, in the same dyno) as the web processes.
+CONTACT_MESSAGE_SPOOL_DIR = os.environ.get("CONTACT_MESSAGE_SPOOL_DIR")
+
+# Reverse proxies in front of the app that append to X-Forwarded-For.
+# Heroku's router is one; leave at 0 when serving clients directly.
+NUM_PROXIES = int(os.environ.get("NUM_PROXIES", 0))
+
+# Directory shared by the web processes on one machine for their request
+# metrics, so that /metrics reports on every gunicorn worker. Without it
+# each worker only reports its own. Each worker rewrites its file every
+# METRICS_EXPORT_INTERVAL seconds and removes it when it exits.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_EXPORT_INTERVAL = float(
+    os.environ.get("METRICS_EXPORT_INTERVAL", 5)
+)
+
+# Queries slower than this many milliseconds are logged as warnings on
+# "exercises.slow_queries", with their fingerprint and the lines of the
+# app that ran them. An empty value turns the log off.
+SLOW_QUERY_THRESHOLD_MS = os.environ.get("SLOW_QUERY_THRESHOLD_MS", "500")
+SLOW_QUERY_THRESHOLD_MS = (
+    float(SLOW_QUERY_THRESHOLD_MS) if SLOW_QUERY_THRESHOLD_MS else None
+)
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
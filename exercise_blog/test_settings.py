@@ -2,11 +2,29 @@ from .settings import *
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'exercise_blog.db_backends.sqlite3',
         'NAME': ':memory:',
-    }
+    },
+    # A separate database standing in for a read replica, so the router
+    # tests can tell which one a page was read from. Only they use it.
+    'replica': {
+        'ENGINE': 'exercise_blog.db_backends.sqlite3',
+        'NAME': ':memory:',
+    },
 }
 
+# Tests change rows behind the signals' back and count queries, so the
+# page cache is only switched on by the tests that exercise it.
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 0
+
+# Every test client shares one address, so rate limits would leak from
+# one test into the next; the throttle tests set their own.
+THROTTLE_RATES = {}
+
+# The bulk data tests are slow on purpose; the query log tests set a
+# threshold of their own.
+SLOW_QUERY_THRESHOLD_MS = None
+
 """
 Database configuration for Django using an in-memory SQLite database.
 
@@ -14,7 +32,8 @@ The database is created in memory and will not persist after the testing session
 
 Settings:
 - ENGINE: Specifies the backend to use. 
-  'django.db.backends.sqlite3' for SQLite.
+  'exercise_blog.db_backends.sqlite3' for SQLite, with the
+  connection statistics the site records.
 - NAME: The name of the database. ':memory:' so that the database 
   will be created in RAM and not saved to disk.
 
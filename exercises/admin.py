@@ -1,9 +1,17 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django import forms
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 from django_summernote.widgets import SummernoteWidget
 from .models import Exercise, Comment, ContactMessage, CommentReport
-from cloudinary import CloudinaryImage
-from django.utils.html import format_html
+from .images import image_url
+from .export import export_response
+from django.utils.html import format_html, strip_tags
+from django.db import transaction
 
 
 class ExerciseAdminForm(forms.ModelForm):
@@ -50,6 +58,19 @@ class CommentAdminForm(forms.ModelForm):
         }
 
 
+class ExerciseChangeList(ChangeList):
+    """
+    Changelist that loads summary columns and SQL-cut previews instead
+    of the full detailed descriptions of every row.
+    """
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.summaries().with_previews(
+            self.model_admin.preview_length
+        )
+
+
 @admin.register(Exercise)
 class ExerciseAdmin(admin.ModelAdmin):
     """
@@ -60,8 +81,11 @@ class ExerciseAdmin(admin.ModelAdmin):
 
     Attributes:
         form: The custom form used for editing Exercise instances.
-        list_display: Fields to display in the list view.
-        search_fields: Fields to include in the search functionality.
+        list_display: Fields to display in the list view; the detailed
+        descriptions appear as short previews.
+        preview_length: Number of characters in each preview.
+        search_fields: Fields covered by the search box, which queries
+        the full-text index rather than these columns.
         list_filter: Fields to filter by in the list view.
     """
 
@@ -69,11 +93,12 @@ class ExerciseAdmin(admin.ModelAdmin):
     list_display = (
         "title",
         "description",
-        "detailed_description1",
-        "detailed_description2",
+        "description1_preview",
+        "description2_preview",
         "created_at",
         "image_tag",
     )
+    preview_length = 100
     search_fields = (
         "title",
         "description",
@@ -82,6 +107,45 @@ class ExerciseAdmin(admin.ModelAdmin):
     )
     list_filter = ("created_at",)
 
+    def get_changelist(self, request, **kwargs):
+        return ExerciseChangeList
+
+    def preview(self, value):
+        """
+        Returns the plain text of a preview annotated by with_previews(),
+        with an ellipsis if the description was longer.
+        """
+        text = strip_tags(value[: self.preview_length])
+        if len(value) > self.preview_length:
+            text += "\u2026"
+        return text
+
+    @admin.display(description="Detailed description1")
+    def description1_preview(self, obj):
+        return self.preview(obj.detailed_description1_preview)
+
+    @admin.display(description="Detailed description2")
+    def description2_preview(self, obj):
+        return self.preview(obj.detailed_description2_preview)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches through the full-text index instead of running an
+        icontains scan over every column in search_fields.
+
+        Args:
+            request: The current HttpRequest.
+            queryset: The changelist queryset.
+            search_term: The text typed into the search box.
+
+        Returns:
+            tuple: The filtered queryset and False, as the search never
+            produces duplicate rows.
+        """
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
     def image_tag(self, obj):
         """
         Returns an HTML image tag for displaying the Exercise's image.
@@ -94,9 +158,7 @@ class ExerciseAdmin(admin.ModelAdmin):
             tag or a message if no image is present.
         """
         if obj.image:
-            webp_url = CloudinaryImage(obj.image.public_id).build_url(
-                format="webp"
-            )
+            webp_url = image_url(obj.image, format="webp")
             return format_html(
                 '<img src="{}" width="100" height="100" />', webp_url
             )
@@ -116,25 +178,185 @@ class CommentAdmin(admin.ModelAdmin):
     Attributes:
         form: The custom form used for editing Comment instances.
         list_display: Fields to display in the list view.
+        list_select_related: Relations joined into the changelist query
+        so list_display does not load them row by row.
         search_fields: Fields to include in the search functionality.
         list_filter: Fields to filter by in the list view.
+        actions: Set-based bulk moderation actions.
+        moderation_queue_size: Number of pending comments shown at once
+        in the moderation queue.
     """
 
     form = CommentAdminForm  # Use the custom form with Summernote
+    change_list_template = "admin/exercises/comment/change_list.html"
     list_display = ("exercise", "user", "created_on", "approved")
+    list_select_related = ("exercise", "user")
     search_fields = ("exercise__title", "user__username", "body")
     list_filter = (
         "approved",
         "created_on",
     )
+    actions = ("approve_comments", "unapprove_comments")
+    moderation_queue_size = 50
+
+    @admin.action(
+        description="Approve selected comments", permissions=["change"]
+    )
+    def approve_comments(self, request, queryset):
+        """
+        Approves the selected comments with a single UPDATE.
+        """
+        updated = queryset.set_approved(True)
+        self.message_user(request, f"Approved {updated} comment(s).")
+
+    @admin.action(
+        description="Unapprove selected comments", permissions=["change"]
+    )
+    def unapprove_comments(self, request, queryset):
+        """
+        Withdraws approval from the selected comments with one UPDATE.
+        """
+        updated = queryset.set_approved(False)
+        self.message_user(request, f"Unapproved {updated} comment(s).")
+
+    def get_urls(self):
+        urls = [
+            path(
+                "moderation/",
+                self.admin_site.admin_view(self.moderation_queue_view),
+                name="exercises_comment_moderation",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def moderation_queue_view(self, request):
+        """
+        Shows the oldest pending comments across all exercises and
+        applies approve/delete decisions posted back from the page.
+
+        The page is one joined query over the pending-comments index,
+        however many comments it lists, and each decision is a fixed
+        number of set-based statements.
+
+        Args:
+            request: The current HttpRequest.
+
+        Returns:
+            HttpResponse: The queue, or a redirect back to it.
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        if request.method == "POST":
+            action = request.POST.get("action")
+            ids = request.POST.getlist("comment")
+            # Checked here, as the lookup raises ValueError on a bad id.
+            if not all(pk.isascii() and pk.isdigit() for pk in ids):
+                return HttpResponseBadRequest("Invalid comment id.")
+            selected = Comment.objects.filter(pk__in=ids)
+            if action == "approve":
+                done = selected.set_approved(True)
+                self.message_user(request, f"Approved {done} comment(s).")
+            elif action == "delete":
+                if not self.has_delete_permission(request):
+                    raise PermissionDenied
+                done = selected.bulk_delete()
+                self.message_user(request, f"Deleted {done} comment(s).")
+            else:
+                return HttpResponseBadRequest("Unknown moderation action.")
+            return redirect("admin:exercises_comment_moderation")
+
+        pending = (
+            Comment.objects.filter(approved=False)
+            .select_related("exercise", "user")
+            .order_by("created_on")[: self.moderation_queue_size]
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Moderation queue",
+            "opts": self.model._meta,
+            "comments": pending,
+            "can_delete": self.has_delete_permission(request),
+        }
+        return TemplateResponse(
+            request, "admin/exercises/comment/moderation_queue.html", context
+        )
+
+    def save_model(self, request, obj, form, change):
+        """
+        Saves the comment and shifts the exercise comment counters to
+        match any change of exercise or approval.
+        """
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if not change:
+                Exercise.objects.filter(
+                    pk=obj.exercise_id
+                ).adjust_comment_counts(
+                    comments=1, approved=int(obj.approved)
+                )
+            elif {"exercise", "approved"} & set(form.changed_data):
+                was_approved = int(form.initial["approved"])
+                Exercise.objects.filter(
+                    pk=form.initial["exercise"]
+                ).adjust_comment_counts(comments=-1, approved=-was_approved)
+                Exercise.objects.filter(
+                    pk=obj.exercise_id
+                ).adjust_comment_counts(
+                    comments=1, approved=int(obj.approved)
+                )
+
+    def delete_model(self, request, obj):
+        """
+        Deletes the comment and takes it off its exercise's counters.
+        """
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            Exercise.objects.filter(
+                pk=obj.exercise_id
+            ).adjust_comment_counts(comments=-1, approved=-int(obj.approved))
+
+    def delete_queryset(self, request, queryset):
+        """
+        Deletes the selected comments with one DELETE per table and
+        recounts the exercises they belonged to.
+        """
+        queryset.bulk_delete()
+
+
+class ExportActionsMixin:
+    """
+    Adds actions that download the selected rows as CSV or NDJSON.
+
+    The file is streamed as the rows are read, so selecting every row of
+    a large table ("Select all") is as cheap in memory as selecting one.
+    """
+
+    actions = ("export_csv", "export_ndjson")
+
+    def export(self, request, queryset, format):
+        return export_response(
+            request, queryset, format, self.model._meta.model_name
+        )
+
+    @admin.action(description="Export selected as CSV", permissions=["view"])
+    def export_csv(self, request, queryset):
+        return self.export(request, queryset, "csv")
+
+    @admin.action(
+        description="Export selected as NDJSON", permissions=["view"]
+    )
+    def export_ndjson(self, request, queryset):
+        return self.export(request, queryset, "ndjson")
 
 
 @admin.register(ContactMessage)
-class ContactMessageAdmin(admin.ModelAdmin):
+class ContactMessageAdmin(ExportActionsMixin, admin.ModelAdmin):
     """
     Admin interface for managing ContactMessage instances.
 
-    This customization allows for viewing contact messages submitted by users.
+    This customization allows for viewing contact messages submitted by users
+    and exporting them as CSV or NDJSON.
 
     Attributes:
         readonly_fields: Fields that cannot be edited in the admin interface.
@@ -150,12 +372,12 @@ class ContactMessageAdmin(admin.ModelAdmin):
 
 
 @admin.register(CommentReport)
-class CommentReportAdmin(admin.ModelAdmin):
+class CommentReportAdmin(ExportActionsMixin, admin.ModelAdmin):
     """
     Admin interface for managing CommentReport instances.
 
     This customization allows for reviewing reports submitted by users
-    regarding specific comments.
+    regarding specific comments and exporting them as CSV or NDJSON.
 
     Attributes:
         readonly_fields: Fields that cannot be edited in the admin interface.
@@ -0,0 +1,214 @@
+import hashlib
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from .pagination import CursorPaginator
+from .routers import cache_timeout
+
+# Matches the placeholder comment_list.html leaves where the owner's
+# Edit and Delete buttons go: <!--owner-controls:<comment>:<user>-->
+OWNER_CONTROLS = re.compile(r"<!--owner-controls:(\d+):(\d+)-->")
+
+
+def fragment_timeout():
+    return cache_timeout(
+        getattr(settings, "EXERCISE_FRAGMENT_CACHE_TIMEOUT", 60 * 60 * 24)
+    )
+
+
+def comments_per_page():
+    return getattr(settings, "EXERCISE_COMMENTS_PER_PAGE", 10)
+
+
+def _version_key(exercise_pk):
+    return f"exercises:exercise:{exercise_pk}:version"
+
+
+# Version of everything that lists exercises, such as the home page.
+LIST_VERSION_KEY = "exercises:list:version"
+
+
+def _new_version():
+    # Seeded from the clock so a version lost to eviction can never come
+    # back with a number that still has fragments cached against it.
+    return time.time_ns()
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def get_exercise_version(exercise_pk):
+    """
+    Returns the current cache version for an exercise's fragments.
+    """
+    return _get_version(_version_key(exercise_pk))
+
+
+def get_list_version():
+    """
+    Returns the current cache version for pages listing exercises.
+    """
+    return _get_version(LIST_VERSION_KEY)
+
+
+def invalidate_exercise(exercise_pk):
+    """
+    Bumps an exercise's cache version so that every fragment and page
+    cached for it is ignored from now on.
+
+    The exercise list version is bumped as well, as its cards show the
+    exercise's title, description and comment count.
+
+    Args:
+        exercise_pk: The primary key of the exercise that changed.
+    """
+    _bump_version(_version_key(exercise_pk))
+    _bump_version(LIST_VERSION_KEY)
+
+
+def _fragment_key(exercise_pk, version, name):
+    return f"exercises:exercise:{exercise_pk}:{version}:{name}"
+
+
+def render_comment_page(exercise, cursor=None):
+    """
+    Renders one page of an exercise's approved comments, oldest first.
+
+    Pages are keyset paginated on (created_on, id), so each one is a
+    single range scan of the approved-thread index however long the
+    thread is. A page with more after it ends in a "load more" link to
+    the exercise_comments endpoint.
+
+    Args:
+        exercise: The Exercise whose comments are listed.
+        cursor: A token from the previous page, or None for page one.
+
+    Raises:
+        InvalidCursor: If the token cannot be decoded.
+    """
+    paginator = CursorPaginator(
+        exercise.comments.filter(approved=True).select_related("user"),
+        comments_per_page(),
+        ordering=("created_on", "id"),
+    )
+    page = paginator.page(cursor)
+    next_url = None
+    if page.has_next():
+        next_url = "{}?{}".format(
+            reverse("exercise_comments", args=[exercise.pk]),
+            urlencode({"cursor": page.next_cursor}),
+        )
+    return render_to_string(
+        "exercises/comment_list.html",
+        {"exercise": exercise, "comments": page, "next_url": next_url},
+    )
+
+
+def _comment_page_name(cursor):
+    if cursor is None:
+        return "comments"
+    return f"comments:{hashlib.md5(cursor.encode()).hexdigest()}"
+
+
+def get_comment_page(exercise, cursor=None):
+    """
+    Returns a page of approved comments from the fragment cache,
+    rendering it on a miss.
+
+    Raises:
+        InvalidCursor: If the token cannot be decoded.
+    """
+    version = get_exercise_version(exercise.pk)
+    key = _fragment_key(exercise.pk, version, _comment_page_name(cursor))
+    html = cache.get(key)
+    if html is None:
+        html = render_comment_page(exercise, cursor)
+        cache.set(key, html, fragment_timeout())
+    return html
+
+
+def get_exercise_fragments(exercise):
+    """
+    Returns the rendered exercise body and first page of comments for an
+    exercise.
+
+    Both fragments are looked up in one round trip and rendered without
+    a request, so the cached HTML is the same for every visitor. Only a
+    miss touches the comments table, and then only for one page.
+
+    Args:
+        exercise: The Exercise being displayed.
+
+    Returns:
+        dict: The "body" and "comments" HTML.
+    """
+    version = get_exercise_version(exercise.pk)
+    body_key = _fragment_key(exercise.pk, version, "body")
+    comments_key = _fragment_key(
+        exercise.pk, version, _comment_page_name(None)
+    )
+    cached = cache.get_many([body_key, comments_key])
+    missing = {}
+
+    body = cached.get(body_key)
+    if body is None:
+        body = render_to_string(
+            "exercises/exercise_body.html", {"exercise": exercise}
+        )
+        missing[body_key] = body
+
+    comments = cached.get(comments_key)
+    if comments is None:
+        comments = render_comment_page(exercise)
+        missing[comments_key] = comments
+
+    if missing:
+        cache.set_many(missing, fragment_timeout())
+
+    return {"body": mark_safe(body), "comments": comments}
+
+
+def fill_owner_controls(html, exercise_pk, user):
+    """
+    Swaps the owner placeholders in a cached comment list for the Edit
+    and Delete buttons of the viewer's own comments.
+
+    Args:
+        html: The shared comment list HTML.
+        exercise_pk: The primary key of the exercise being displayed.
+        user: The user viewing the page.
+
+    Returns:
+        str: The comment list HTML for this viewer.
+    """
+    viewer_pk = str(user.pk) if user.is_authenticated else None
+
+    def controls(match):
+        comment_pk, owner_pk = match.groups()
+        if owner_pk != viewer_pk:
+            return ""
+        return render_to_string(
+            "exercises/comment_owner_controls.html",
+            {"exercise_pk": exercise_pk, "comment_pk": comment_pk},
+        )
+
+    return mark_safe(OWNER_CONTROLS.sub(controls, html))
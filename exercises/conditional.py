@@ -0,0 +1,167 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import Exercise
+
+
+def viewer_key(request):
+    """
+    Returns a fingerprint of the per-visitor parts of a page, or None
+    if the page must be rendered afresh.
+
+    Pages show the viewer's own comment controls and login links and
+    carry a CSRF token, so validators are keyed on the user and the
+    CSRF secret. Pages with messages waiting are never revalidated,
+    as rendering them is what marks the messages as read.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    user_pk = request.user.pk if request.user.is_authenticated else ""
+    return hashlib.md5(
+        "|".join(
+            (
+                str(user_pk),
+                request.META.get("CSRF_COOKIE", ""),
+                getattr(settings, "CONTENT_ETAG_VERSION", ""),
+            )
+        ).encode()
+    ).hexdigest()
+
+
+def _etag(request, *parts):
+    key = viewer_key(request)
+    if key is None or None in parts:
+        return None
+    return hashlib.md5(
+        "|".join([key, *(str(part) for part in parts)]).encode()
+    ).hexdigest()
+
+
+def _exercise_state(request, pk):
+    # condition() asks for the ETag and Last-Modified separately; look
+    # the exercise up once per request.
+    if not hasattr(request, "_exercise_state"):
+        request._exercise_state = (
+            Exercise.published.filter(pk=pk)
+            .last_changed()
+            .values_list("last_changed", flat=True)
+            .first()
+        )
+    return request._exercise_state
+
+
+def _list_state(request):
+    if not hasattr(request, "_exercise_list_state"):
+        request._exercise_list_state = Exercise.published.aggregate(
+            last_changed=Max("updated_at"), total=Count("pk")
+        )
+    return request._exercise_list_state
+
+
+def exercise_last_modified(request, pk):
+    if viewer_key(request) is None:
+        return None
+    return _exercise_state(request, pk)
+
+
+def exercise_etag(request, pk):
+    last_changed = _exercise_state(request, pk)
+    return _etag(request, pk, last_changed and last_changed.isoformat())
+
+
+def exercise_list_last_modified(request):
+    if viewer_key(request) is None:
+        return None
+    return _list_state(request)["last_changed"]
+
+
+def exercise_list_etag(request):
+    state = _list_state(request)
+    last_changed = state["last_changed"]
+    return _etag(
+        request,
+        last_changed and last_changed.isoformat(),
+        state["total"],
+        request.GET.urlencode(),
+    )
+
+
+def _validators(request, etag_func, last_modified_func, args, kwargs):
+    etag = etag_func(request, *args, **kwargs)
+    last_modified = last_modified_func(request, *args, **kwargs)
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+    return (
+        quote_etag(etag) if etag is not None else None,
+        last_modified,
+    )
+
+
+def _finish(request, response, etag, last_modified):
+    if request.method in ("GET", "HEAD"):
+        if last_modified and not response.has_header("Last-Modified"):
+            response.headers["Last-Modified"] = http_date(last_modified)
+        if etag:
+            response.headers.setdefault("ETag", etag)
+    patch_cache_control(response, no_cache=True)
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True)
+    return response
+
+
+def conditional_page(etag_func, last_modified_func):
+    """
+    Decorator that answers revalidation requests with 304 Not Modified
+    from a cheap lookup, before the view renders anything.
+
+    Responses are marked no-cache, so browsers and shared caches always
+    revalidate rather than guess at freshness, and private for signed
+    in users, whose pages must never be shared.
+
+    This is Django's condition() with the cache headers added, and it
+    accepts async views as well: their validators, which read the
+    session and the database, are worked out in a thread.
+
+    Args:
+        etag_func: Returns the ETag for a request, or None.
+        last_modified_func: Returns the Last-Modified datetime, or None.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(_validators)(
+                    request, etag_func, last_modified_func, args, kwargs
+                )
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified
+                )
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(request, response, etag, last_modified)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag, last_modified = _validators(
+                request, etag_func, last_modified_func, args, kwargs
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return _finish(request, response, etag, last_modified)
+
+        return wrapper
+
+    return decorator
@@ -1,4 +1,34 @@
+from functools import lru_cache
+
+from django.utils.functional import SimpleLazyObject
+
 from .forms import ContactMessageForm
 
+
+@lru_cache(maxsize=1)
+def _unbound_contact_form_html():
+    # An unbound form renders to the same markup on every request, so
+    # render it once per process.
+    return str(ContactMessageForm())
+
+
+class LazyContactForm(SimpleLazyObject):
+    """
+    A ContactMessageForm that is only built when a template uses it.
+
+    Rendering it whole ({{ contact_form }}) reuses the cached markup of
+    an unbound form; touching a field or attribute builds a real form.
+    """
+
+    def __init__(self):
+        super().__init__(ContactMessageForm)
+
+    def __html__(self):
+        return _unbound_contact_form_html()
+
+    def __str__(self):
+        return _unbound_contact_form_html()
+
+
 def contact_form_processor(request):
-    return {'contact_form': ContactMessageForm()}
+    return {'contact_form': LazyContactForm()}
@@ -0,0 +1,84 @@
+import hashlib
+from functools import lru_cache
+
+from cloudinary import CloudinaryImage
+from django.conf import settings
+from django.core.cache import cache
+
+
+def public_id_from_url(cloudinary_url):
+    """
+    Returns the public id at the end of a Cloudinary delivery URL.
+    """
+    return cloudinary_url.split("/")[-1].split(".")[0]
+
+
+def public_id_for(image):
+    """
+    Returns the public id of a Cloudinary resource or delivery URL.
+
+    Accepting the CloudinaryField value itself saves templates from
+    building its full-size .url only to have it parsed apart again.
+    """
+    if not image:
+        return ""
+    public_id = getattr(image, "public_id", None)
+    if public_id is not None:
+        return public_id
+    return public_id_from_url(str(image))
+
+
+def _cache_key(public_id, format, width, height, crop):
+    digest = hashlib.md5(
+        repr((public_id, format, width, height, crop)).encode()
+    ).hexdigest()
+    return f"exercises:image-url:{digest}"
+
+
+@lru_cache(maxsize=getattr(settings, "IMAGE_URL_LRU_SIZE", 4096))
+def _build_url(public_id, format, width, height, crop):
+    key = _cache_key(public_id, format, width, height, crop)
+    url = cache.get(key)
+    if url is None:
+        transformation = {"format": format}
+        if width:
+            transformation["width"] = width
+        if height:
+            transformation["height"] = height
+        if crop and (width or height):
+            transformation["crop"] = crop
+        url = CloudinaryImage(public_id).build_url(**transformation)
+        cache.set(key, url, getattr(settings, "IMAGE_URL_CACHE_TIMEOUT", None))
+    return url
+
+
+def image_url(image, format="webp", width=None, height=None, crop="fit"):
+    """
+    Returns a transformed Cloudinary delivery URL for an image.
+
+    URLs are built locally, without calling Cloudinary, and memoised in
+    a bounded per-process LRU in front of the Django cache, keyed on
+    (public_id, format, width, height, crop). The template tags and the
+    admin share it, so each distinct URL is built once per cache.
+
+    Args:
+        image: A CloudinaryField value, a delivery URL or a public id.
+        format (str): The delivery format, e.g. "webp".
+        width (int, optional): The target width in pixels.
+        height (int, optional): The target height in pixels.
+        crop (str): The Cloudinary crop mode used when resizing.
+
+    Returns:
+        str: The delivery URL, or an empty string if there is no image.
+    """
+    public_id = public_id_for(image)
+    if not public_id:
+        return ""
+    return _build_url(public_id, format, width, height, crop)
+
+
+def clear_image_url_cache():
+    """
+    Empties this process's LRU (the shared Django cache is left alone).
+    """
+    _build_url.cache_clear()
@@ -0,0 +1,236 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from exercises.management.commands.bench_requests import (
+    HOST,
+    PERCENTILES,
+    percentile,
+)
+from exercises.metrics import merge_pool_stats
+from exercises.models import Exercise
+
+# How long a server may take to start answering.
+STARTUP_TIMEOUT = 30
+
+# How often the servers' workers write out their statistics. Workers
+# remove their files as they exit, so they are read before shutdown.
+EXPORT_INTERVAL = 0.2
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_pool_stats(directory):
+    """
+    Returns the connection statistics the server's processes have
+    written to their METRICS_DIR, summed over the processes.
+    """
+    collections = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".json"):
+            with open(entry.path, encoding="utf-8") as file:
+                pool = json.load(file)["pool"]
+            collections.append({tuple(key): value for key, value in pool})
+    totals = merge_pool_stats(collections)
+    return {
+        stat: totals.get(("default", stat), 0)
+        for stat in ("checkouts", "connects", "connect_seconds", "closes")
+    }
+
+
+class Command(BaseCommand):
+    """
+    Compares opening a database connection per request with keeping
+    connections open between requests.
+
+    The site is served by gunicorn twice, once with DATABASE_CONN_MAX_AGE
+    set to 0 and once to --max-age, with the rest of the environment as
+    this command was given it. Each server gets --requests GETs of one
+    route from --concurrency clients, after --warmup requests that are
+    not timed. Real servers are needed because Django's test client keeps
+    the connection open between requests whatever CONN_MAX_AGE says.
+
+    For each mode the command reports the throughput, the p50, p95 and
+    p99 latency and, from the connection statistics the workers export
+    to a temporary METRICS_DIR, how many connections were opened and the
+    time requests spent waiting for them. Those counts include the
+    warm-up requests.
+
+    The route defaults to the comments of the most commented exercise
+    from seed_bullfit, which runs two queries and is never page cached.
+    """
+
+    help = (
+        "Benchmark connect-per-request against persistent database "
+        "connections under gunicorn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--warmup", type=int, default=20)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument(
+            "--max-age",
+            default="600",
+            help="DATABASE_CONN_MAX_AGE of the persistent run.",
+        )
+        parser.add_argument(
+            "--path", help="Route to request. Defaults to a comment page."
+        )
+        parser.add_argument("--output", help="Write the results as JSON.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        path = options["path"] or self.default_path()
+        self.stdout.write(f"GET {path}")
+        self.stdout.write(
+            f"{'mode':<14}{'req/s':>8}"
+            + "".join(f"{name + ' ms':>9}" for name in PERCENTILES)
+            + f"{'checkouts':>11}{'connects':>10}{'wait ms':>10}"
+        )
+        results = {}
+        for mode, max_age in (
+            ("per_request", "0"),
+            ("persistent", options["max_age"]),
+        ):
+            results[mode] = self.run_mode(path, max_age)
+            self.stdout.write(self.format_row(mode, results[mode]))
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(
+                    {"path": path, "modes": results},
+                    file,
+                    indent=2,
+                    sort_keys=True,
+                )
+
+    def default_path(self):
+        exercise = (
+            Exercise.published.filter(comment_count__gt=0)
+            .order_by("-comment_count", "pk")
+            .first()
+        )
+        if exercise is None:
+            raise CommandError(
+                "No published exercise has comments; run seed_bullfit "
+                "first, or give --path."
+            )
+        return reverse("exercise_comments", args=[exercise.pk])
+
+    def run_mode(self, path, max_age):
+        """
+        Serves the site with the given DATABASE_CONN_MAX_AGE, loads it and
+        returns the results.
+        """
+        options = self.options
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            port = free_port()
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "gunicorn",
+                    "exercise_blog.wsgi",
+                    "--bind",
+                    f"127.0.0.1:{port}",
+                    "--workers",
+                    str(options["workers"]),
+                    "--log-level",
+                    "warning",
+                ],
+                env={
+                    **os.environ,
+                    "DATABASE_CONN_MAX_AGE": max_age,
+                    "METRICS_DIR": metrics_dir,
+                    "METRICS_EXPORT_INTERVAL": str(EXPORT_INTERVAL),
+                },
+            )
+            try:
+                self.wait_until_up(server, port, path)
+                self.load(port, path, options["warmup"])
+                started = time.perf_counter()
+                timings = self.load(port, path, options["requests"])
+                elapsed = time.perf_counter() - started
+                time.sleep(EXPORT_INTERVAL * 3)
+                pool = read_pool_stats(metrics_dir)
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=STARTUP_TIMEOUT)
+
+        timings.sort()
+        result = {
+            name: round(percentile(timings, fraction), 3)
+            for name, fraction in zip(PERCENTILES, (0.5, 0.95, 0.99))
+        }
+        result.update(
+            max_age=max_age,
+            requests_per_second=round(len(timings) / elapsed, 1),
+            mean=round(statistics.fmean(timings), 3),
+            checkouts=pool["checkouts"],
+            connects=pool["connects"],
+            connect_ms=round(pool["connect_seconds"] * 1000, 3),
+            closes=pool["closes"],
+        )
+        return result
+
+    def wait_until_up(self, server, port, path):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("gunicorn exited before it was ready.")
+            try:
+                self.get(port, path)
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(
+            f"gunicorn did not answer within {STARTUP_TIMEOUT} seconds."
+        )
+
+    def get(self, port, path):
+        """
+        Requests the path on a fresh connection, as a new visitor would,
+        and returns the time taken in milliseconds.
+        """
+        client = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        try:
+            started = time.perf_counter()
+            client.request("GET", path, headers={"Host": HOST})
+            response = client.getresponse()
+            response.read()
+            elapsed = (time.perf_counter() - started) * 1000
+        finally:
+            client.close()
+        if response.status != 200:
+            raise CommandError(f"GET {path} returned {response.status}.")
+        return elapsed
+
+    def load(self, port, path, total):
+        with ThreadPoolExecutor(self.options["concurrency"]) as pool:
+            return list(pool.map(lambda _: self.get(port, path), range(total)))
+
+    def format_row(self, mode, result):
+        connects = result["connects"]
+        wait = result["connect_ms"] / connects if connects else 0.0
+        return (
+            f"{mode:<14}{result['requests_per_second']:>8.1f}"
+            + "".join(f"{result[name]:>9.2f}" for name in PERCENTILES)
+            + f"{result['checkouts']:>11}{connects:>10}{wait:>10.3f}"
+        )
@@ -0,0 +1,141 @@
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from exercises.forms import ContactMessageForm
+from exercises.models import Exercise, Comment
+
+LAZY = "exercises.context_processors.contact_form_processor"
+EAGER = (
+    "exercises.management.commands.bench_context_processors."
+    "eager_contact_form_processor"
+)
+
+
+def eager_contact_form_processor(request):
+    """
+    The previous processor, which built a form for every render.
+    """
+    return {"contact_form": ContactMessageForm()}
+
+
+class Command(BaseCommand):
+    """
+    Profiles each page with the eager and the lazy contact form context
+    processor and reports the allocations and time saved per request.
+
+    Every page renders through a RequestContext, so the numbers cover
+    the exercise pages, the allauth pages, the AJAX report fragment and
+    the 404 page. Sample data is created in a transaction that is
+    rolled back at the end.
+    """
+
+    help = (
+        "Compare per-request allocations and render time of the eager "
+        "and lazy contact_form context processors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        self.total = options["requests"]
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username="bench_context_user", password="password"
+            )
+            exercise = Exercise.objects.create(
+                title="Benchmark Exercise",
+                description="Benchmark",
+                author=user,
+                status=1,
+            )
+            comment = Comment.objects.create(
+                exercise=exercise, user=user, body="Benchmark comment"
+            )
+            pages = {
+                "home": (None, reverse("home")),
+                "exercise_detail": (
+                    None,
+                    reverse("exercise_detail", args=[exercise.pk]),
+                ),
+                "contact_form": (None, reverse("contact_form")),
+                "account_login": (None, reverse("account_login")),
+                "account_signup": (None, reverse("account_signup")),
+                "report_comment": (
+                    user,
+                    reverse("report_comment", args=[comment.pk]),
+                ),
+                "404": (None, "/no-such-page/"),
+            }
+            self.report(pages)
+            transaction.set_rollback(True)
+
+    def profile(self, processor, user, url):
+        templates = self.templates_with(processor)
+        with override_settings(TEMPLATES=templates, ALLOWED_HOSTS=["*"]):
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            client.get(url)  # warm the template and URL caches
+
+            # Time and trace in separate passes; tracing slows every
+            # allocation down and would swamp the difference in time.
+            timings, peaks = [], []
+            for _ in range(self.total):
+                started = time.perf_counter()
+                client.get(url)
+                timings.append(time.perf_counter() - started)
+
+            tracemalloc.start()
+            try:
+                for _ in range(self.total):
+                    tracemalloc.reset_peak()
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    client.get(url)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            finally:
+                tracemalloc.stop()
+        return statistics.mean(timings) * 1000, statistics.mean(peaks) / 1024
+
+    def templates_with(self, processor):
+        templates = []
+        for engine in settings.TEMPLATES:
+            engine = {**engine, "OPTIONS": dict(engine.get("OPTIONS", {}))}
+            engine["OPTIONS"]["context_processors"] = [
+                processor if path == LAZY else path
+                for path in engine["OPTIONS"].get("context_processors", [])
+            ]
+            templates.append(engine)
+        return templates
+
+    def report(self, pages):
+        self.stdout.write(
+            f"{'page':<18}{'eager ms':>10}{'lazy ms':>10}"
+            f"{'eager KiB':>12}{'lazy KiB':>11}{'saved KiB':>11}"
+        )
+        saved_ms = saved_kib = 0
+        for name, (user, url) in pages.items():
+            eager_ms, eager_kib = self.profile(EAGER, user, url)
+            lazy_ms, lazy_kib = self.profile(LAZY, user, url)
+            saved_ms += eager_ms - lazy_ms
+            saved_kib += eager_kib - lazy_kib
+            self.stdout.write(
+                f"{name:<18}{eager_ms:>10.2f}{lazy_ms:>10.2f}"
+                f"{eager_kib:>12.1f}{lazy_kib:>11.1f}"
+                f"{eager_kib - lazy_kib:>11.1f}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Mean saving per request: {saved_ms / len(pages):.2f} ms, "
+                f"{saved_kib / len(pages):.1f} KiB peak allocation"
+            )
+        )
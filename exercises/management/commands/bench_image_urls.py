@@ -0,0 +1,92 @@
+import statistics
+import time
+
+from cloudinary import CloudinaryImage
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from exercises.images import image_url, clear_image_url_cache
+
+
+def uncached_webp(cloudinary_url, width=250):
+    """
+    The previous webp tag, which parsed and rebuilt every URL.
+    """
+    public_id = cloudinary_url.split("/")[-1].split(".")[0]
+    return CloudinaryImage(public_id).build_url(
+        format="webp", width=width, crop="fit"
+    )
+
+
+class Command(BaseCommand):
+    """
+    Measures the cost of building the card image URLs for 1,000 cards
+    with the old per-render CloudinaryImage.build_url calls and with the
+    memoised image URL service, cold and warm.
+
+    The cards cycle through --images distinct public ids, as a listing
+    does when the same exercises are rendered for many visitors.
+    """
+
+    help = "Time card image URL building per 1,000 cards, before/after."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cards", type=int, default=1000)
+        parser.add_argument("--images", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        cards = [
+            CloudinaryImage(f"bullfit/exercise_{i % options['images']}")
+            for i in range(options["cards"])
+        ]
+        per_thousand = 1000 / len(cards)
+
+        def before():
+            # The list template passed exercise.image.url to the tag,
+            # so the full-size URL was built as well.
+            for image in cards:
+                uncached_webp(image.url, 250)
+
+        def cold():
+            clear_image_url_cache()
+            cache.clear()
+            for image in cards:
+                image_url(image, width=250)
+
+        def warm():
+            for image in cards:
+                image_url(image, width=250)
+
+        def shared_cache_only():
+            # A fresh worker: empty LRU, but the Django cache is warm.
+            clear_image_url_cache()
+            for image in cards:
+                image_url(image, width=250)
+
+        results = {}
+        for name, run in (
+            ("before (build_url per card)", before),
+            ("after, cold caches", cold),
+            ("after, Django cache only", shared_cache_only),
+            ("after, warm LRU", warm),
+        ):
+            run()
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings) * per_thousand
+            self.stdout.write(
+                f"{name:<30}{results[name]:>10.2f} ms per 1,000 cards"
+            )
+
+        before_ms = results["before (build_url per card)"]
+        after_ms = results["after, warm LRU"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Warm cost is {after_ms / before_ms:.1%} of before "
+                f"({before_ms - after_ms:.2f} ms saved per 1,000 cards)."
+            )
+        )
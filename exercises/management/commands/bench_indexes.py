@@ -0,0 +1,155 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from exercises.models import Exercise, Comment
+from exercises.pagination import CursorPaginator
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the exercise and comment read paths with and without the
+    composite indexes added for them.
+
+    Builds a throwaway dataset inside a transaction, prints the query
+    plan and the median timing of each read path, drops the indexes,
+    measures again and finally rolls everything back, so the database is
+    left exactly as it was found.
+    """
+
+    help = (
+        "Show query plans and timings for the exercise/comment read "
+        "paths with and without their indexes (changes are rolled back)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--exercises", type=int, default=100_000)
+        parser.add_argument("--comments", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        self.batch_size = options["batch_size"]
+        random.seed(options["seed"])
+
+        # SQLite cannot alter tables inside a transaction while foreign
+        # key checks are on, so switch them off before it starts.
+        disabled = connection.disable_constraint_checking()
+        try:
+            with transaction.atomic():
+                self.build_dataset(options["exercises"], options["comments"])
+                self.run_suite("with indexes")
+                self.drop_indexes()
+                self.run_suite("without indexes")
+                transaction.set_rollback(True)
+        finally:
+            if disabled:
+                connection.enable_constraint_checking()
+        self.stdout.write(self.style.SUCCESS("Dataset rolled back."))
+
+    def build_dataset(self, exercise_total, comment_total):
+        started = time.perf_counter()
+        users = User.objects.bulk_create(
+            User(username=f"bench_user_{i}") for i in range(100)
+        )
+        if not users[0].pk:
+            users = list(User.objects.filter(username__startswith="bench_"))
+
+        Exercise.objects.bulk_create(
+            (
+                Exercise(
+                    title=f"Exercise {random.randrange(exercise_total):07d}",
+                    description="Benchmark exercise",
+                    author=random.choice(users),
+                    status=1 if random.random() < 0.8 else 0,
+                )
+                for _ in range(exercise_total)
+            ),
+            batch_size=self.batch_size,
+        )
+        exercise_ids = list(Exercise.objects.values_list("id", flat=True))
+        self.hot_exercise_id = exercise_ids[0]
+
+        # A handful of exercises attract most of the discussion.
+        now = timezone.now()
+        Comment.objects.bulk_create(
+            (
+                Comment(
+                    exercise_id=(
+                        self.hot_exercise_id
+                        if random.random() < 0.05
+                        else exercise_ids[
+                            int(random.paretovariate(1.2)) % len(exercise_ids)
+                        ]
+                    ),
+                    user=random.choice(users),
+                    body="Benchmark comment",
+                    approved=random.random() < 0.9,
+                    created_on=now - timedelta(seconds=i),
+                )
+                for i in range(comment_total)
+            ),
+            batch_size=self.batch_size,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.stdout.write(
+            f"Built {exercise_total} exercises and {comment_total} comments "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+    def read_paths(self):
+        published = Exercise.published.order_by("title", "id")
+        middle = published[published.count() // 2]
+        paginator = CursorPaginator(published, 6)
+        token = paginator.encode_cursor(middle, "n")
+        thread = Comment.objects.filter(
+            exercise_id=self.hot_exercise_id, approved=True
+        ).select_related("user")
+        return {
+            "list: first page": published[:6],
+            "list: count": published,
+            "list: deep offset page": published[50_000:50_006],
+            "list: deep cursor page": paginator.seek(token)[1][:7],
+            "detail: approved thread": thread[:200],
+            "moderation: pending queue": Comment.objects.filter(
+                approved=False
+            ).order_by("created_on")[:50],
+        }
+
+    def run_suite(self, label):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label} =="))
+        for name, queryset in self.read_paths().items():
+            evaluate = QuerySet.count if name.endswith("count") else list
+            timings = []
+            for _ in range(self.repeat):
+                # Clone the queryset each time so that nothing is served
+                # from its result cache.
+                clone = queryset.all()
+                started = time.perf_counter()
+                evaluate(clone)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                self.style.SQL_FIELD(name)
+                + f"  median {statistics.median(timings):.2f} ms"
+                + f"  (min {min(timings):.2f} ms)"
+            )
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"    {line}")
+
+    def drop_indexes(self):
+        with connection.schema_editor(atomic=False) as editor:
+            for model in (Exercise, Comment):
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
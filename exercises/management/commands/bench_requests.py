@@ -0,0 +1,381 @@
+import json
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from html import unescape
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from exercises.models import Comment, Exercise
+
+# Matches ALLOWED_HOSTS, so requests reach the views.
+HOST = "bench.herokuapp.com"
+
+# The last pagination link on an exercise list page is "Next".
+PAGE_LINK = re.compile(r'href="(\?(?:cursor|page)=[^"]+)"')
+
+PERCENTILES = ("p50", "p95", "p99")
+
+
+def percentile(ordered, fraction):
+    """
+    Returns the value below which `fraction` of the sorted timings fall.
+    """
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+@contextmanager
+def count_queries(counter):
+    """
+    Counts the statements run on the default connection, leaving out
+    the savepoints that only exist because the run is rolled back.
+    """
+    def wrapper(execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(("SAVEPOINT", "RELEASE")):
+            counter["queries"] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+class Command(BaseCommand):
+    """
+    Measures what each route in exercises/urls.py costs to serve.
+
+    Requests go through Django's test Client, so the whole middleware
+    stack and every view run in this process, without a server or
+    network in the way. Each route is requested anonymously and as a
+    signed-in commenter, first a few times to warm the caches and then
+    --requests times for the record. For every route the command
+    reports the p50, p95 and p99 latency, the queries and bytes per
+    request and the peak memory allocated while serving one. Memory is
+    traced in extra requests of its own, as tracing slows Python down.
+
+    It reads the dataset from seed_bullfit: the most commented exercise,
+    one of its commenters and their comments. Everything the requests
+    write is rolled back at the end. Rate limits are switched off and a
+    configured contact spool is replaced by a temporary one, so repeated
+    submissions are measured rather than refused or queued for real.
+
+    --output writes the results as JSON. Given the JSON of an earlier
+    run, --baseline fails the command when a route has become slower by
+    more than --threshold, or runs more queries than it did.
+    """
+
+    help = (
+        "Benchmark latency, queries, bytes and allocations of every "
+        "route (changes are rolled back)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument(
+            "--alloc-samples",
+            type=int,
+            default=5,
+            help="Requests per route made with tracemalloc running.",
+        )
+        parser.add_argument(
+            "--pages",
+            type=int,
+            default=3,
+            help="Number of exercise list pages to follow.",
+        )
+        parser.add_argument("--output", help="Write the results as JSON.")
+        parser.add_argument(
+            "--baseline", help="JSON results of an earlier run to compare."
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Allowed latency increase over the baseline, as a "
+            "fraction.",
+        )
+        parser.add_argument(
+            "--percentile",
+            choices=PERCENTILES,
+            default="p50",
+            help="Latency compared against the baseline.",
+        )
+        parser.add_argument(
+            "--min-delta-ms",
+            type=float,
+            default=0.5,
+            help="Latency increases smaller than this are never "
+            "regressions.",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as file:
+                baseline = json.load(file)
+
+        self.exercise = (
+            Exercise.published.filter(comment_count__gt=0)
+            .order_by("-comment_count", "pk")
+            .first()
+        )
+        if self.exercise is None:
+            raise CommandError(
+                "No published exercise has comments; run seed_bullfit "
+                "first."
+            )
+        self.comment = (
+            self.exercise.comments.filter(approved=True)
+            .select_related("user")
+            .order_by("pk")
+            .first()
+        )
+        self.user = self.comment.user
+        self.other_comment = (
+            self.exercise.comments.exclude(user=self.user)
+            .order_by("pk")
+            .first()
+        ) or self.comment
+
+        self.stdout.write(
+            f"{'route':<45}"
+            + "".join(f"{name + ' ms':>9}" for name in PERCENTILES)
+            + f"{'queries':>8}{'bytes':>9}{'peak alloc':>13}"
+        )
+        results = {}
+        with ExitStack() as stack:
+            stack.enter_context(transaction.atomic())
+            stack.enter_context(self.isolated_settings(stack))
+            for who in ("anonymous", "authenticated"):
+                client = Client(HTTP_HOST=HOST)
+                if who == "authenticated":
+                    client.force_login(self.user)
+                for name, method, url, data in self.routes(client, who):
+                    key = f"{who}:{name}:{method}"
+                    results[key] = self.measure(client, method, url, data)
+                    self.stdout.write(self.format_row(key, results[key]))
+            transaction.set_rollback(True)
+
+        report = {
+            "meta": {
+                "database": connection.vendor,
+                "python": sys.version.split()[0],
+                "requests": options["requests"],
+                "exercise": self.exercise.pk,
+                "exercise_comments": self.exercise.comment_count,
+            },
+            "routes": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+        if baseline is not None:
+            self.compare(baseline["routes"], results)
+
+    def isolated_settings(self, stack):
+        overrides = {"THROTTLE_RATES": {}}
+        if getattr(settings, "CONTACT_MESSAGE_SPOOL_DIR", None):
+            overrides["CONTACT_MESSAGE_SPOOL_DIR"] = stack.enter_context(
+                tempfile.TemporaryDirectory()
+            )
+        return override_settings(**overrides)
+
+    def home_pages(self, client):
+        url = reverse("home")
+        for number in range(1, self.options["pages"] + 1):
+            yield (f"home_page_{number}", "GET", url, None)
+            links = PAGE_LINK.findall(client.get(url).content.decode())
+            if not links:
+                break
+            url = reverse("home") + unescape(links[-1])
+
+    def routes(self, client, who):
+        """
+        Yields (name, method, url, data) for each request to measure.
+
+        The url may be a callable, called before each request outside
+        the timing, for requests that use up what they act on.
+        """
+        exercise = self.exercise.pk
+        yield from self.home_pages(client)
+        yield (
+            "search",
+            "GET",
+            reverse("search") + "?q=" + self.exercise.title.split()[0],
+            None,
+        )
+        yield (
+            "exercise_detail",
+            "GET",
+            reverse("exercise_detail", args=[exercise]),
+            None,
+        )
+        yield (
+            "exercise_comments",
+            "GET",
+            reverse("exercise_comments", args=[exercise]),
+            None,
+        )
+        add_url = reverse("add_comment", args=[exercise])
+        yield ("add_comment", "GET", add_url, None)
+        yield ("add_comment", "POST", add_url, {"body": "Benchmark comment"})
+        edit_url = reverse("edit_comment", args=[exercise, self.comment.pk])
+        yield ("edit_comment", "GET", edit_url, None)
+        yield (
+            "edit_comment",
+            "POST",
+            edit_url,
+            {"body": self.comment.body},
+        )
+        # An anonymous visitor is sent to log in before anything is
+        # deleted, so there is no need to make them a comment each time.
+        yield (
+            "delete_comment",
+            "POST",
+            (
+                self.new_comment_url
+                if who == "authenticated"
+                else reverse(
+                    "delete_comment", args=[exercise, self.comment.pk]
+                )
+            ),
+            None,
+        )
+        report_url = reverse("report_comment", args=[self.other_comment.pk])
+        yield ("report_comment", "GET", report_url, None)
+        yield (
+            "report_comment",
+            "POST",
+            report_url,
+            {
+                "comment_id": self.other_comment.pk,
+                "comment_text": self.other_comment.body,
+                "reason": "Benchmark report",
+            },
+        )
+        contact_url = reverse("contact_form")
+        yield ("contact_form", "GET", contact_url, None)
+        yield (
+            "contact_form",
+            "POST",
+            contact_url,
+            {
+                "name": "Benchmark",
+                "email": "benchmark@example.com",
+                "message": "Benchmark message",
+            },
+        )
+        yield ("login", "GET", reverse("login"), None)
+
+    def new_comment_url(self):
+        comment = Comment.objects.create(
+            exercise=self.exercise, user=self.user, body="To be deleted"
+        )
+        return reverse(
+            "delete_comment", args=[self.exercise.pk, comment.pk]
+        )
+
+    def request(self, client, method, url, data):
+        if callable(url):
+            url = url()
+        send = client.post if method == "POST" else client.get
+        counter = Counter()
+        with count_queries(counter):
+            started = time.perf_counter()
+            response = send(url, data) if data is not None else send(url)
+            if response.streaming:
+                body = b"".join(response.streaming_content)
+            else:
+                body = response.content
+            elapsed = (time.perf_counter() - started) * 1000
+        return response.status_code, elapsed, counter["queries"], len(body)
+
+    def measure(self, client, method, url, data):
+        for _ in range(self.options["warmup"]):
+            self.request(client, method, url, data)
+
+        timings, queries, sizes, statuses = [], [], [], Counter()
+        for _ in range(self.options["requests"]):
+            status, elapsed, executed, size = self.request(
+                client, method, url, data
+            )
+            timings.append(elapsed)
+            queries.append(executed)
+            sizes.append(size)
+            statuses[str(status)] += 1
+
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(self.options["alloc_samples"]):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                self.request(client, method, url, data)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+        timings.sort()
+        result = {
+            name: round(percentile(timings, fraction), 3)
+            for name, fraction in zip(PERCENTILES, (0.5, 0.95, 0.99))
+        }
+        result.update(
+            mean=round(statistics.fmean(timings), 3),
+            queries=max(queries),
+            bytes=round(statistics.median(sizes)),
+            peak_alloc_kib=(
+                round(statistics.median(peaks) / 1024, 1) if peaks else None
+            ),
+            status=dict(statuses),
+        )
+        return result
+
+    def format_row(self, key, result):
+        allocated = result["peak_alloc_kib"]
+        return (
+            f"{key:<45}"
+            + "".join(f"{result[name]:>9.2f}" for name in PERCENTILES)
+            + f"{result['queries']:>8}{result['bytes']:>9}"
+            + (f"{allocated:>9.1f} KiB" if allocated is not None else "")
+        )
+
+    def compare(self, before, after):
+        options = self.options
+        metric = options["percentile"]
+        failures = []
+        for key, now in after.items():
+            then = before.get(key)
+            if then is None:
+                continue
+            slower = now[metric] - then[metric]
+            if (
+                slower > options["min_delta_ms"]
+                and now[metric] > then[metric] * (1 + options["threshold"])
+            ):
+                failures.append(
+                    f"{key}: {metric} {then[metric]:.2f} -> "
+                    f"{now[metric]:.2f} ms"
+                )
+            if now["queries"] > then["queries"]:
+                failures.append(
+                    f"{key}: queries {then['queries']} -> {now['queries']}"
+                )
+        if failures:
+            raise CommandError(
+                "Regressions against the baseline:\n" + "\n".join(failures)
+            )
+        self.stdout.write(
+            self.style.SUCCESS("No regressions against the baseline.")
+        )
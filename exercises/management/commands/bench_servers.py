@@ -0,0 +1,190 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+
+from django.core.management.base import BaseCommand, CommandError
+
+SERVERS = {
+    "wsgi": ["exercise_blog.wsgi"],
+    "asgi": [
+        "exercise_blog.asgi:application",
+        "--worker-class",
+        "uvicorn.workers.UvicornWorker",
+    ],
+}
+
+# Matches ALLOWED_HOSTS, so requests reach the views.
+HOST = "bench.herokuapp.com"
+
+# How long a slow client waits between the bytes it sends.
+SLOW_INTERVAL = 0.5
+
+
+class SlowClient(threading.Thread):
+    """
+    A client on a poor connection: it starts a request, then trickles
+    the rest of its headers a byte at a time, holding the connection
+    open without ever finishing the request.
+    """
+
+    def __init__(self, port, path):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.sendall(
+            f"POST {path} HTTP/1.1\r\nHost: {HOST}\r\nX-Slow: ".encode()
+        )
+
+    def run(self):
+        try:
+            while not self.stopped.wait(SLOW_INTERVAL):
+                self.sock.sendall(b"x")
+        except OSError:
+            pass
+
+    def stop(self):
+        self.stopped.set()
+        self.sock.close()
+
+
+class Command(BaseCommand):
+    """
+    Compares how many concurrent connections the site can hold under
+    gunicorn's sync (WSGI) workers and uvicorn (ASGI) workers.
+
+    Each server is started with the same number of workers. A growing
+    number of slow clients then trickle requests at it, as phones on
+    poor connections do when submitting the comment and report forms,
+    while a probe requests a page over and over. A sync worker is held
+    for as long as its client takes to send the request, so once the
+    slow clients outnumber the workers the probe waits or times out.
+    Under ASGI requests are read on the event loop and the probe is
+    unaffected.
+
+    The servers use the current environment, so DATABASE_URL must point
+    at a migrated database that other processes can open (not an
+    in-memory SQLite database). uvicorn must be installed.
+    """
+
+    help = (
+        "Compare concurrent connection capacity of gunicorn sync (WSGI) "
+        "and uvicorn (ASGI) workers with slow clients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument(
+            "--slow-clients",
+            type=int,
+            nargs="+",
+            default=[0, 1, 2, 8, 32],
+            help="Numbers of slow clients to hold open in turn.",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=5.0,
+            help="Seconds to probe for at each step.",
+        )
+        parser.add_argument("--timeout", type=float, default=2.0)
+        parser.add_argument("--path", default="/")
+        parser.add_argument("--slow-path", default="/contact/")
+        parser.add_argument("--port", type=int, default=8701)
+        parser.add_argument(
+            "--modes", nargs="+", choices=SERVERS, default=list(SERVERS)
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stdout.write(
+            f"{'mode':<6}{'slow':>6}{'probes':>8}{'timeouts':>10}"
+            f"{'p50 ms':>9}{'p95 ms':>9}"
+        )
+        for offset, mode in enumerate(options["modes"]):
+            port = options["port"] + offset
+            server = self.start(mode, port)
+            try:
+                for slow in options["slow_clients"]:
+                    self.stdout.write(self.step(mode, port, slow))
+            finally:
+                server.terminate()
+                server.wait(10)
+
+    def start(self, mode, port):
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            *SERVERS[mode],
+            "--workers",
+            str(self.options["workers"]),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--log-level",
+            "warning",
+        ]
+        server = subprocess.Popen(command, env=os.environ.copy())
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"The {mode} server failed to start.")
+            try:
+                self.probe(port)
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"The {mode} server did not answer in 30s.")
+
+    def probe(self, port):
+        connection = HTTPConnection(
+            "127.0.0.1", port, timeout=self.options["timeout"]
+        )
+        try:
+            connection.request(
+                "GET", self.options["path"], headers={"Host": HOST}
+            )
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                raise OSError(f"HTTP {response.status}")
+        finally:
+            connection.close()
+
+    def step(self, mode, port, slow):
+        clients = [
+            SlowClient(port, self.options["slow_path"]) for _ in range(slow)
+        ]
+        for client in clients:
+            client.start()
+        time.sleep(SLOW_INTERVAL)
+
+        timings, timeouts = [], 0
+        deadline = time.monotonic() + self.options["duration"]
+        try:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    self.probe(port)
+                except OSError:
+                    timeouts += 1
+                    continue
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            for client in clients:
+                client.stop()
+
+        if timings:
+            timings.sort()
+            p50 = f"{statistics.median(timings):>9.1f}"
+            p95 = f"{timings[max(0, int(len(timings) * 0.95) - 1)]:>9.1f}"
+        else:
+            p50 = p95 = f"{'-':>9}"
+        return (
+            f"{mode:<6}{slow:>6}{len(timings):>8}{timeouts:>10}{p50}{p95}"
+        )
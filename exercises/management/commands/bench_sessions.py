@@ -0,0 +1,110 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from exercises.models import Exercise
+
+ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "cache": "django.contrib.sessions.backends.cache",
+}
+
+
+class Command(BaseCommand):
+    """
+    Measures authenticated request latency and queries per request with
+    database-backed and cache-backed sessions.
+
+    Signed in visitors load their session on every request and write it
+    on login and logout, so the benchmark covers the home and detail
+    pages as well as a login/logout cycle. Sessions are cached in the
+    "shared" cache alias, i.e. whatever CACHE_URL points at. Sample data
+    is created in a transaction that is rolled back at the end.
+    """
+
+    help = (
+        "Compare authenticated request latency with db, cached_db and "
+        "cache session engines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+
+    def handle(self, *args, **options):
+        self.total = options["requests"]
+        self.stdout.write(
+            "Shared cache: "
+            f"{settings.CACHES['shared']['BACKEND'].rsplit('.', 1)[-1]}"
+        )
+        with transaction.atomic():
+            self.user = User.objects.create_user(
+                username="bench_session_user", password="password"
+            )
+            exercise = Exercise.objects.create(
+                title="Benchmark Exercise",
+                description="Benchmark",
+                author=self.user,
+                status=1,
+            )
+            self.pages = {
+                "home": reverse("home"),
+                "exercise_detail": reverse(
+                    "exercise_detail", args=[exercise.pk]
+                ),
+            }
+            self.report()
+            transaction.set_rollback(True)
+
+    def timed(self, action):
+        timings, queries = [], []
+        for _ in range(self.total):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                action()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+        timings.sort()
+        return (
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+            statistics.mean(queries),
+        )
+
+    def profile(self, engine):
+        results = {}
+        with override_settings(SESSION_ENGINE=engine, ALLOWED_HOSTS=["*"]):
+            client = Client()
+            client.force_login(self.user)
+            for name, url in self.pages.items():
+                client.get(url)  # warm the template and URL caches
+                results[name] = self.timed(lambda: client.get(url))
+
+            def login_logout():
+                client.login(
+                    username="bench_session_user", password="password"
+                )
+                client.logout()
+
+            results["login + logout"] = self.timed(login_logout)
+        return results
+
+    def report(self):
+        self.stdout.write(
+            f"{'engine':<11}{'path':<17}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'queries':>9}"
+        )
+        for label, engine in ENGINES.items():
+            for path, (p50, p95, queries) in self.profile(engine).items():
+                self.stdout.write(
+                    f"{label:<11}{path:<17}{p50:>9.2f}{p95:>9.2f}"
+                    f"{queries:>9.1f}"
+                )
+        self.stdout.write(self.style.SUCCESS("Dataset rolled back."))
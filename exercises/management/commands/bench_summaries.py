@@ -0,0 +1,103 @@
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from exercises.models import Exercise
+
+
+class Command(BaseCommand):
+    """
+    Compares loading full Exercise rows with the summary projection on
+    exercises whose detailed descriptions are large HTML documents.
+
+    Reports the median latency and the peak Python allocation of each
+    read path with and without the projection. The sample exercises
+    are created in a transaction that is rolled back at the end.
+    """
+
+    help = (
+        "Measure latency and memory of full vs summary exercise loading "
+        "with large descriptions (changes are rolled back)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--exercises", type=int, default=1000)
+        parser.add_argument("--description-kb", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        paragraph = "<p>Keep your back straight and breathe out. </p>"
+        body = paragraph * (options["description_kb"] * 1024 // len(paragraph))
+
+        with transaction.atomic():
+            user = User.objects.create_user(username="bench_summary_user")
+            Exercise.objects.bulk_create(
+                (
+                    Exercise(
+                        title=f"Exercise {i:05d}",
+                        description="Benchmark exercise",
+                        detailed_description1=body,
+                        detailed_description2=body,
+                        author=user,
+                        status=1,
+                    )
+                    for i in range(options["exercises"])
+                ),
+                batch_size=500,
+            )
+            published = Exercise.published.order_by("title", "id")
+            admin_rows = Exercise.objects.order_by("-pk")
+            paths = {
+                "list page (6 rows)": (
+                    published[:7],
+                    published.summaries()[:7],
+                ),
+                "admin changelist (100 rows)": (
+                    admin_rows[:100],
+                    admin_rows.summaries().with_previews()[:100],
+                ),
+                "all published rows": (
+                    published,
+                    published.summaries(),
+                ),
+            }
+            self.report(paths)
+            transaction.set_rollback(True)
+
+    def measure(self, queryset):
+        timings, peaks = [], []
+        for _ in range(self.repeat):
+            # Clone so that nothing is served from the result cache.
+            clone = queryset.all()
+            started = time.perf_counter()
+            list(clone)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        for _ in range(self.repeat):
+            clone = queryset.all()
+            tracemalloc.start()
+            try:
+                list(clone)
+                peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            finally:
+                tracemalloc.stop()
+        return statistics.median(timings), statistics.median(peaks)
+
+    def report(self, paths):
+        self.stdout.write(
+            f"{'read path':<30}{'full ms':>10}{'summary ms':>12}"
+            f"{'full KiB':>12}{'summary KiB':>13}"
+        )
+        for name, (full, summary) in paths.items():
+            full_ms, full_kib = self.measure(full)
+            summary_ms, summary_kib = self.measure(summary)
+            self.stdout.write(
+                f"{name:<30}{full_ms:>10.2f}{summary_ms:>12.2f}"
+                f"{full_kib:>12.1f}{summary_kib:>13.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS("Dataset rolled back."))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from exercises.models import Exercise
+from exercises.search import clear_search_index, index_exercises
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the exercise search index from scratch.
+
+    Saves keep the index current through a signal, so this is only
+    needed after writes that bypass signals, such as bulk_create() or
+    queryset.update() in data imports.
+    """
+
+    help = "Reindex every exercise for full-text search."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of exercises indexed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        indexed = 0
+
+        clear_search_index()
+        while True:
+            batch = list(
+                Exercise.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only(
+                    "pk",
+                    "title",
+                    "description",
+                    "detailed_description1",
+                    "detailed_description2",
+                )[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                index_exercises(batch)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} exercises."))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from exercises.models import Exercise
+
+
+class Command(BaseCommand):
+    """
+    Repairs the denormalised comment counters on Exercise.
+
+    Walks the exercises in primary key order, one batch per transaction,
+    and recounts each batch with a single UPDATE that only touches rows
+    whose counters drifted (for example after comments were removed by
+    cascading user deletes or bulk imports).
+    """
+
+    help = "Recount comment_count/approved_comment_count in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of exercises recounted per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_pk = 0
+        checked = corrected = 0
+
+        while True:
+            batch = list(
+                Exercise.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                corrected += Exercise.objects.filter(
+                    pk__in=batch
+                ).recount_comments()
+            checked += len(batch)
+            last_pk = batch[-1]
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} exercises, corrected {corrected}."
+            )
+        )
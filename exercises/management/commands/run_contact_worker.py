@@ -0,0 +1,75 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exercises.spool import contact_spool, flush_contact_messages
+
+
+class Command(BaseCommand):
+    """
+    Stores queued contact form submissions in the database.
+
+    Drains CONTACT_MESSAGE_SPOOL_DIR in batches of one bulk INSERT each,
+    then polls for more. Claims abandoned by a worker that died are put
+    back on the queue at start-up and every --recover-after seconds, so
+    no submission is lost; the dedup key on ContactMessage keeps the
+    redelivered ones from being stored twice. SIGTERM and SIGINT finish
+    the current batch before exiting.
+    """
+
+    help = "Flush the contact message spool into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--recover-after",
+            type=float,
+            default=300.0,
+            help="Seconds after which another worker's claim is stale.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue and exit instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        spool = contact_spool()
+        if spool is None:
+            raise CommandError("CONTACT_MESSAGE_SPOOL_DIR is not set.")
+
+        self.stopping = False
+        if not options["once"]:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        recovered = spool.recover(options["recover_after"])
+        next_recovery = time.monotonic() + options["recover_after"]
+        stored = 0
+        while not self.stopping:
+            flushed = flush_contact_messages(spool, options["batch_size"])
+            stored += flushed
+            if flushed:
+                continue
+            if options["once"]:
+                break
+            if time.monotonic() >= next_recovery:
+                recovered += spool.recover(options["recover_after"])
+                next_recovery = time.monotonic() + options["recover_after"]
+            time.sleep(options["interval"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {stored} submissions, recovered {recovered}."
+            )
+        )
+
+    def stop(self, signum, frame):
+        self.stopping = True
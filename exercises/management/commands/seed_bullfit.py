@@ -0,0 +1,371 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from exercises.cache import invalidate_exercise
+from exercises.models import Comment, CommentReport, ContactMessage, Exercise
+from exercises.search import index_exercises
+
+# Everything is dated within DAYS days of START, rather than of today,
+# so that the same seed always produces the same rows.
+START = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+DAYS = 365
+
+USERNAME_PREFIX = "seed_"
+
+WORDS = (
+    "squat deadlift press bench row lunge plank curl pull push hold "
+    "tempo brace hinge core glutes hamstrings quads shoulders chest back "
+    "grip stance knees hips spine breathe slowly control range motion "
+    "rest sets reps warm cool stretch load weight bar dumbbell kettlebell "
+    "band mat form depth pause drive lockout steady strong light heavy "
+    "great helpful tried today week progress sore easier harder again"
+).split()
+
+MOVES = (
+    "Squat", "Deadlift", "Bench Press", "Overhead Press", "Row", "Lunge",
+    "Plank", "Curl", "Pull-up", "Push-up", "Hip Thrust", "Dip", "Step-up",
+    "Swing", "Carry", "Crunch", "Bridge", "Raise", "Extension", "Fly",
+)
+VARIANTS = (
+    "Goblet", "Romanian", "Bulgarian", "Incline", "Decline", "Single-arm",
+    "Paused", "Tempo", "Banded", "Kettlebell", "Dumbbell", "Barbell",
+    "Cable", "Seated", "Standing", "Wide-grip", "Close-grip", "Sumo",
+)
+
+REPORT_REASONS = (
+    "Spam or advertising.",
+    "Offensive language.",
+    "Dangerous advice.",
+    "Off topic.",
+    "Harassment of another user.",
+)
+
+# Zipf exponents: how strongly comments concentrate on the most popular
+# exercises and on the most active commenters.
+EXERCISE_SKEW = 1.1
+USER_SKEW = 0.8
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """
+    Lets the given auto_now/auto_now_add fields be set by hand.
+
+    Django overwrites them on every insert, bulk_create() included, so
+    without this every seeded row would be dated the moment it was made.
+    """
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def zipf_weights(total, skew):
+    """
+    Returns cumulative weights for random.choices() under which the
+    item at rank r is picked in proportion to 1 / r ** skew.
+    """
+    return list(accumulate(1 / rank**skew for rank in range(1, total + 1)))
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with a realistically sized, reproducible dataset.
+
+    Generates users, exercises with Summernote-style HTML descriptions
+    and placeholder Cloudinary image ids, comments, reports and contact
+    messages. A few exercises attract most of the comments and a few
+    users write most of them, as on the live site. Rows are written with
+    bulk_create() in batches inside one transaction, and everything is
+    drawn from a single random.Random(seed), so the same options always
+    produce the same data.
+
+    bulk_create() skips the save signals, so the comment counters, the
+    search index and the cache versions are brought up to date
+    afterwards, and the tables are analysed for the query planner.
+
+    Seeded usernames start with "seed_"; the command refuses to run if
+    any already exist. Use "manage.py flush" to start again.
+    """
+
+    help = "Generate a large, deterministic dataset for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--exercises", type=int, default=1_000)
+        parser.add_argument("--comments", type=int, default=1_000_000)
+        parser.add_argument("--reports", type=int, default=10_000)
+        parser.add_argument("--contact-messages", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument(
+            "--password",
+            help="Password for every seeded user. By default they cannot "
+            "log in.",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["exercises"] < 1:
+            raise CommandError("At least one user and exercise are needed.")
+        if options["reports"] > options["comments"]:
+            raise CommandError("There cannot be more reports than comments.")
+        if User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).exists():
+            raise CommandError(
+                "The database already holds seeded users; run "
+                "'manage.py flush' first."
+            )
+
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.perf_counter()
+
+        with transaction.atomic(), explicit_timestamps(
+            Exercise._meta.get_field("created_at"),
+            Exercise._meta.get_field("updated_at"),
+            Comment._meta.get_field("created_on"),
+            CommentReport._meta.get_field("created_at"),
+        ):
+            self.step("users", self.create_users, options)
+            self.step("exercises", self.create_exercises, options)
+            self.step("comments", self.create_comments, options)
+            self.step("reports", self.create_reports, options)
+            self.step("contact messages", self.create_messages, options)
+            self.step("counters and search index", self.derive, options)
+
+        # SQLite reuses the primary keys of deleted rows, so fragments
+        # cached for an exercise from before a flush could come back.
+        for pk, _ in self.exercises:
+            invalidate_exercise(pk)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded in {time.perf_counter() - started:.1f}s."
+            )
+        )
+
+    def step(self, label, create, options):
+        started = time.perf_counter()
+        total = create(options)
+        self.stdout.write(
+            f"{total:>10} {label} in {time.perf_counter() - started:.1f}s"
+        )
+
+    def moment(self, after=START):
+        """
+        Returns a random time between `after` and the end of the period.
+        """
+        end = START + timedelta(days=DAYS)
+        seconds = (end - after).total_seconds()
+        return after + timedelta(seconds=int(self.rng.random() * seconds))
+
+    def sentence(self, low=6, high=18):
+        words = self.rng.choices(WORDS, k=self.rng.randint(low, high))
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self, sentences=3):
+        return " ".join(self.sentence() for _ in range(sentences))
+
+    def html_body(self):
+        """
+        Returns a description marked up the way Summernote saves it.
+        """
+        rng = self.rng
+        steps = "".join(
+            f"<li>{self.sentence(4, 10)}</li>"
+            for _ in range(rng.randint(3, 6))
+        )
+        return (
+            f"<p>{self.paragraph(rng.randint(2, 4))}</p>"
+            f"<p><b>How to do it</b></p><ol>{steps}</ol>"
+            f'<p style="text-align: center;"><i>{self.sentence()}</i></p>'
+            f"<p>{self.paragraph(rng.randint(1, 3))}<br></p>"
+        )
+
+    def create_users(self, options):
+        # Hashed once: hashing is deliberately slow. None is unusable.
+        password = make_password(options["password"])
+        total = options["users"]
+        for first in range(0, total, self.batch_size):
+            User.objects.bulk_create(
+                [
+                    User(
+                        username=f"{USERNAME_PREFIX}{i:07d}",
+                        email=f"{USERNAME_PREFIX}{i:07d}@example.com",
+                        password=password,
+                        date_joined=self.moment(),
+                    )
+                    for i in range(first, min(first + self.batch_size, total))
+                ]
+            )
+        # Primary keys in insertion order, which is the order above.
+        self.users = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        # Activity is independent of sign-up order.
+        self.active_users = self.users[:]
+        self.rng.shuffle(self.active_users)
+        self.user_weights = zipf_weights(total, USER_SKEW)
+        return total
+
+    def create_exercises(self, options):
+        rng = self.rng
+        total = options["exercises"]
+        authors = self.users[: max(1, len(self.users) // 100)]
+        for first in range(0, total, self.batch_size):
+            batch = []
+            for i in range(first, min(first + self.batch_size, total)):
+                created_at = self.moment()
+                batch.append(
+                    Exercise(
+                        title=(
+                            f"{rng.choice(VARIANTS)} {rng.choice(MOVES)} "
+                            f"#{i + 1}"
+                        ),
+                        description=self.paragraph(2)[:500],
+                        detailed_description1=self.html_body(),
+                        detailed_description2=self.html_body(),
+                        author_id=rng.choice(authors),
+                        image=f"bullfit/seed/exercise-{i % 50:02d}",
+                        top_row_image=f"bullfit/seed/top-{i % 50:02d}",
+                        bottom_row_image=f"bullfit/seed/bottom-{i % 50:02d}",
+                        created_at=created_at,
+                        updated_at=created_at,
+                        status=1 if rng.random() < 0.9 else 0,
+                    )
+                )
+            Exercise.objects.bulk_create(batch)
+        self.exercises = list(
+            Exercise.objects.filter(
+                author__username__startswith=USERNAME_PREFIX
+            )
+            .order_by("pk")
+            .values_list("pk", "created_at")
+        )
+        # Popularity is independent of age.
+        self.popular_exercises = self.exercises[:]
+        rng.shuffle(self.popular_exercises)
+        self.exercise_weights = zipf_weights(total, EXERCISE_SKEW)
+        return total
+
+    def create_comments(self, options):
+        rng = self.rng
+        total = options["comments"]
+        for first in range(0, total, self.batch_size):
+            size = min(self.batch_size, total - first)
+            exercises = rng.choices(
+                self.popular_exercises,
+                cum_weights=self.exercise_weights,
+                k=size,
+            )
+            users = rng.choices(
+                self.active_users, cum_weights=self.user_weights, k=size
+            )
+            Comment.objects.bulk_create(
+                [
+                    Comment(
+                        exercise_id=exercise_pk,
+                        user_id=user_pk,
+                        body=self.sentence(3, 30),
+                        created_on=self.moment(after=exercise_created),
+                        approved=rng.random() < 0.9,
+                    )
+                    for (exercise_pk, exercise_created), user_pk in zip(
+                        exercises, users
+                    )
+                ]
+            )
+        return total
+
+    def create_reports(self, options):
+        rng = self.rng
+        total = options["reports"]
+        if not total:
+            return 0
+        # Pick comments by their position in insertion order, then walk
+        # the seeded comments once to find them.
+        positions = sorted(rng.sample(range(options["comments"]), total))
+        comments = (
+            Comment.objects.filter(
+                user__username__startswith=USERNAME_PREFIX
+            )
+            .order_by("pk")
+            .values_list("pk", "user_id", "created_on")
+            .iterator(chunk_size=self.batch_size)
+        )
+        chosen = []
+        wanted = iter(positions)
+        next_position = next(wanted)
+        for position, comment in enumerate(comments):
+            if position == next_position:
+                chosen.append(comment)
+                next_position = next(wanted, None)
+                if next_position is None:
+                    break
+
+        reports = []
+        for comment_pk, author_pk, created_on in chosen:
+            reporter = rng.choice(self.users)
+            if reporter == author_pk and len(self.users) > 1:
+                reporter = self.users[
+                    (self.users.index(reporter) + 1) % len(self.users)
+                ]
+            reports.append(
+                CommentReport(
+                    user_id=reporter,
+                    comment_id=comment_pk,
+                    reason=rng.choice(REPORT_REASONS),
+                    created_at=self.moment(after=created_on),
+                )
+            )
+        CommentReport.objects.bulk_create(reports, batch_size=self.batch_size)
+        return total
+
+    def create_messages(self, options):
+        total = options["contact_messages"]
+        for first in range(0, total, self.batch_size):
+            ContactMessage.objects.bulk_create(
+                [
+                    ContactMessage.from_submission(
+                        name=f"Visitor {i}",
+                        email=f"visitor{i}@example.com",
+                        message=self.paragraph(self.rng.randint(1, 4)),
+                        created_at=self.moment(),
+                    )
+                    for i in range(first, min(first + self.batch_size, total))
+                ]
+            )
+        return total
+
+    def derive(self, options):
+        pks = [pk for pk, _ in self.exercises]
+        for first in range(0, len(pks), self.batch_size):
+            batch = pks[first : first + self.batch_size]
+            Exercise.objects.filter(pk__in=batch).recount_comments()
+            index_exercises(
+                Exercise.objects.filter(pk__in=batch).only(
+                    "pk",
+                    "title",
+                    "description",
+                    "detailed_description1",
+                    "detailed_description2",
+                )
+            )
+        return len(pks)
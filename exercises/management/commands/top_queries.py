@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from exercises.metrics import collect_query_stats, metrics_dir
+from exercises.querylog import fingerprint_id
+
+ORDERINGS = {
+    "total": lambda stats: stats[1],
+    "count": lambda stats: stats[0],
+    "mean": lambda stats: stats[1] / stats[0],
+    "max": lambda stats: stats[2],
+}
+
+
+class Command(BaseCommand):
+    """
+    Lists the query fingerprints that cost the most, by view.
+
+    Every query the web processes run is timed and grouped by the view
+    it ran for and its fingerprint, the SQL with its literals stripped.
+    The processes write their totals to METRICS_DIR, which this command
+    reads, so it must be set to the same directory as theirs. The ids
+    match the ones in the slow query log.
+    """
+
+    help = "Show the most expensive SQL fingerprints per view."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument(
+            "--sort", choices=ORDERINGS, default="total"
+        )
+        parser.add_argument("--view", help="Only show queries of this view.")
+        parser.add_argument(
+            "--width",
+            type=int,
+            default=120,
+            help="Characters of SQL to show; 0 shows all of it.",
+        )
+
+    def handle(self, *args, **options):
+        if not metrics_dir():
+            raise CommandError(
+                "METRICS_DIR is not set, so there are no query statistics "
+                "from the web processes to read."
+            )
+        stats = collect_query_stats()
+        if options["view"]:
+            stats = {
+                key: value
+                for key, value in stats.items()
+                if key[0] == options["view"]
+            }
+        ranked = sorted(
+            stats.items(),
+            key=lambda item: ORDERINGS[options["sort"]](item[1]),
+            reverse=True,
+        )[: options["limit"]]
+
+        self.stdout.write(
+            f"{'id':<13}{'view':<28}{'count':>9}{'total ms':>11}"
+            f"{'mean ms':>10}{'max ms':>10}"
+        )
+        for (view, normalised), (count, total, slowest) in ranked:
+            sql = normalised
+            if options["width"] and len(sql) > options["width"]:
+                sql = sql[: options["width"] - 3] + "..."
+            self.stdout.write(
+                f"{fingerprint_id(normalised):<13}{view:<28}{count:>9}"
+                f"{total * 1000:>11.1f}{total / count * 1000:>10.2f}"
+                f"{slowest * 1000:>10.2f}\n    {sql}"
+            )
@@ -0,0 +1,581 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .querylog import fingerprint, log_slow_query, slow_query_threshold
+
+# Histograms recorded for every request, by view and method: the name
+# they are exported under, their help text and their bucket bounds.
+HISTOGRAMS = {
+    "duration": (
+        "bullfit_request_duration_seconds",
+        "Wall time spent on requests, middleware included.",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    ),
+    "db_duration": (
+        "bullfit_request_db_duration_seconds",
+        "Time spent waiting on database queries during requests.",
+        (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    ),
+    "queries": (
+        "bullfit_request_queries",
+        "Database queries run per request.",
+        (0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+    ),
+    "response_size": (
+        "bullfit_response_size_bytes",
+        "Size of response bodies, after compression.",
+        (512, 2048, 8192, 32768, 131072, 524288, 2097152),
+    ),
+}
+
+_BOUNDS = tuple(bounds for _, _, bounds in HISTOGRAMS.values())
+
+METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+# Database connection statistics, by connection alias: the name they
+# are exported under, their type and their help text.
+POOL_STATS = {
+    "checkouts": (
+        "bullfit_db_checkouts_total",
+        "counter",
+        "Times a request started using a database connection.",
+    ),
+    "checked_out": (
+        "bullfit_db_connections_checked_out",
+        "gauge",
+        "Database connections in use by a request.",
+    ),
+    "connects": (
+        "bullfit_db_connects_total",
+        "counter",
+        "Times a new connection was opened, or failed to open.",
+    ),
+    "connect_seconds": (
+        "bullfit_db_connect_seconds_total",
+        "counter",
+        "Time spent waiting for new connections to open.",
+    ),
+    "closes": (
+        "bullfit_db_closes_total",
+        "counter",
+        "Connections closed for their age, a failed health check or an "
+        "error.",
+    ),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestTotals:
+    """
+    The database time and query count of the request being served.
+    """
+
+    __slots__ = ("request", "db_time", "queries")
+
+    def __init__(self, request):
+        self.request = request
+        self.db_time = 0.0
+        self.queries = 0
+
+    def view_name(self):
+        match = getattr(self.request, "resolver_match", None)
+        # Queries run before URL resolution come from the middleware.
+        return match.view_name if match is not None else "<middleware>"
+
+
+# Set by the middleware and copied into the threads sync_to_async()
+# runs queries in, so queries from async views are counted as well.
+current_queries = contextvars.ContextVar("current_queries", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    A database execute wrapper that times every query.
+
+    The time is added to the request being served, if any, and to the
+    statistics of the query's fingerprint for its view. Queries slower
+    than SLOW_QUERY_THRESHOLD_MS are logged.
+    """
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        totals = current_queries.get()
+        if totals is not None:
+            totals.db_time += elapsed
+            totals.queries += 1
+            view = totals.view_name()
+        else:
+            view = "<no request>"
+        query_stats.record(view, fingerprint(sql), elapsed)
+        threshold = slow_query_threshold()
+        if threshold is not None and elapsed >= threshold:
+            log_slow_query(sql, elapsed, view)
+
+
+class ThreadShards:
+    """
+    Per-process statistics, sharded by thread so that recording takes
+    no lock.
+
+    Each thread writes only to its own shard, a dict. Readers add the
+    shards up, which is rare next to writes.
+
+    Under ASGI every request runs its queries in a new thread, so the
+    shards of threads that have exited are folded into one retired
+    shard whenever a thread takes a shard or the statistics are read.
+    Only the live threads keep a shard of their own.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.retired = {}
+        self.shards_lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            # Taken once per thread, not per observation.
+            with self.shards_lock:
+                self.retire()
+                shard = self.local.shard = {}
+                self.shards.append((threading.current_thread(), shard))
+            return shard
+
+    def retire(self):
+        """
+        Folds the shards of threads that have exited into the retired
+        shard. Called with shards_lock held.
+        """
+        live, dead = [], []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                dead.append(shard)
+        if dead:
+            # A thread that has exited no longer writes to its shard.
+            self.retired = self.fold([self.retired, *dead])
+            self.shards = live
+
+    def fold(self, shards):
+        """
+        Returns a new shard holding the sum of the given ones.
+        """
+        raise NotImplementedError
+
+    def snapshot(self):
+        """
+        Returns a copy of the retired shard and of each live thread's.
+        """
+        with self.shards_lock:
+            self.retire()
+            shards = [self.retired, *(shard for _, shard in self.shards)]
+        return [dict(shard) for shard in shards]
+
+
+class Registry(ThreadShards):
+    """
+    Per-process request histograms.
+
+    Each shard maps (view, method) to one list per histogram of bucket
+    counts followed by the sum of the observed values.
+    """
+
+    def observe(self, view, method, values):
+        """
+        Records one request.
+
+        Args:
+            view (str): The resolved view name.
+            method (str): The request method.
+            values (tuple): One observed value per histogram, in the
+                order of HISTOGRAMS. None skips a histogram, e.g. the
+                size of a streamed response.
+        """
+        shard = self.shard()
+        series = shard.get((view, method))
+        if series is None:
+            series = shard[(view, method)] = [
+                [0] * (len(bounds) + 2) for bounds in _BOUNDS
+            ]
+        for counts, bounds, value in zip(series, _BOUNDS, values):
+            if value is not None:
+                counts[bisect_left(bounds, value)] += 1
+                counts[-1] += value
+
+    def fold(self, shards):
+        totals = {}
+        for shard in shards:
+            for key, series in shard.items():
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [list(counts) for counts in series]
+                else:
+                    for counts, more in zip(total, series):
+                        for index, value in enumerate(more):
+                            counts[index] += value
+        return totals
+
+    def collect(self):
+        """
+        Returns the process's histograms as {(histogram, view, method):
+        [bucket counts..., sum]}.
+        """
+        return merge(
+            {
+                (histogram, view, method): counts
+                for (view, method), series in shard.items()
+                for histogram, counts in zip(HISTOGRAMS, series)
+            }
+            for shard in self.snapshot()
+        )
+
+
+def merge(collections):
+    totals = {}
+    for collection in collections:
+        for key, series in collection.items():
+            total = totals.get(key)
+            if total is None:
+                totals[key] = list(series)
+            else:
+                for index, value in enumerate(series):
+                    total[index] += value
+    return totals
+
+
+class QueryStats(ThreadShards):
+    """
+    Per-process query statistics by view and fingerprint.
+
+    Each shard maps (view, fingerprint) to [count, total seconds,
+    slowest seconds].
+    """
+
+    def record(self, view, normalised, elapsed):
+        shard = self.shard()
+        stats = shard.get((view, normalised))
+        if stats is None:
+            shard[(view, normalised)] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    def fold(self, shards):
+        return merge_query_stats(shards)
+
+    def collect(self):
+        """
+        Returns {(view, fingerprint): [count, total, slowest]}.
+        """
+        return merge_query_stats(self.snapshot())
+
+
+def merge_query_stats(collections):
+    totals = {}
+    for collection in collections:
+        for key, (count, total, slowest) in collection.items():
+            stats = totals.get(key)
+            if stats is None:
+                totals[key] = [count, total, slowest]
+            else:
+                stats[0] += count
+                stats[1] += total
+                stats[2] = max(stats[2], slowest)
+    return totals
+
+
+class PoolStats(ThreadShards):
+    """
+    Per-process database connection statistics.
+
+    Each shard maps (alias, statistic) to a number. A connection is only
+    used by the thread that opened it, so a gauge such as checked_out
+    goes up and down in the same shard.
+    """
+
+    def add(self, alias, stat, amount=1):
+        shard = self.shard()
+        shard[(alias, stat)] = shard.get((alias, stat), 0) + amount
+
+    def fold(self, shards):
+        return merge_pool_stats(shards)
+
+    def collect(self):
+        """
+        Returns {(alias, statistic): value}.
+        """
+        return merge_pool_stats(self.snapshot())
+
+
+def merge_pool_stats(collections):
+    totals = {}
+    for collection in collections:
+        for key, value in collection.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+registry = Registry()
+query_stats = QueryStats()
+pool_stats = PoolStats()
+
+
+def metrics_dir():
+    return getattr(settings, "METRICS_DIR", None)
+
+
+class Exporter:
+    """
+    Writes this process's statistics to METRICS_DIR every few seconds,
+    from a background thread, so that whichever gunicorn worker serves
+    /metrics can report on all of them.
+
+    Each process writes one file, named after its pid and a random
+    token so that a new worker reusing a pid never overwrites another
+    worker's totals. Files are replaced with an atomic rename, so a
+    reader never sees half of one. A process removes its file as it
+    exits, and readers remove the files of processes that died without
+    doing so, so the directory only holds live workers' totals.
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.pid = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def ensure_started(self):
+        # Checked on every request, as a fork leaves the parent's thread
+        # behind; only the first request in a process starts one.
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.path = os.path.join(
+                self.directory, f"{self.pid}-{uuid.uuid4().hex}.json"
+            )
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self.run, daemon=True).start()
+            atexit.register(self.remove)
+
+    def run(self):
+        # Stops once METRICS_DIR changes and another exporter takes over.
+        while _exporter is self:
+            time.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        with self.lock:
+            if self.pid == os.getpid() and not self.closed:
+                self._write()
+
+    def remove(self):
+        """
+        Removes this process's file, for good.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.closed = True
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _write(self):
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "histograms": [
+                            [list(key), series]
+                            for key, series in registry.collect().items()
+                        ],
+                        "queries": [
+                            [list(key), stats]
+                            for key, stats in query_stats.collect().items()
+                        ],
+                        "pool": [
+                            [list(key), value]
+                            for key, value in pool_stats.collect().items()
+                        ],
+                    },
+                    file,
+                )
+            os.replace(temporary, self.path)
+        except OSError:
+            # Metrics must never take the site down; the totals are
+            # cumulative, so the next write catches up.
+            pass
+
+
+_exporter = None
+
+
+def exporter():
+    """
+    Returns the exporter for METRICS_DIR, or None when metrics are kept
+    in this process only.
+    """
+    global _exporter
+    directory = metrics_dir()
+    if not directory:
+        return None
+    if _exporter is None or _exporter.directory != directory:
+        _exporter = Exporter(
+            directory, getattr(settings, "METRICS_EXPORT_INTERVAL", 5.0)
+        )
+    return _exporter
+
+
+def _process_alive(name):
+    """
+    Returns whether the process that wrote a metrics file, named
+    "{pid}-{token}.json", is still running.
+    """
+    try:
+        pid = int(name.split("-", 1)[0])
+    except ValueError:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running, as another user.
+    return True
+
+
+def _exported(section):
+    """
+    Returns one section of every process's file in METRICS_DIR, with
+    this process's brought up to date first, or None when it is not set.
+    """
+    current = exporter()
+    if current is None:
+        return None
+    current.ensure_started()
+    current.write()
+    collections = []
+    for entry in os.scandir(current.directory):
+        if not entry.name.endswith((".json", ".json.tmp")):
+            continue
+        if not _process_alive(entry.name):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+            continue
+        if not entry.name.endswith(".json"):
+            continue  # Being written.
+        try:
+            with open(entry.path, encoding="utf-8") as file:
+                collections.append(
+                    {
+                        tuple(key): values
+                        for key, values in json.load(file)[section]
+                    }
+                )
+        except (OSError, ValueError, KeyError):
+            continue  # Removed or replaced while being read.
+    return collections
+
+
+def collect_all():
+    """
+    Returns the histograms of every process writing to METRICS_DIR, or
+    of this process alone when it is not set.
+    """
+    collections = _exported("histograms")
+    if collections is None:
+        return registry.collect()
+    return merge(collections)
+
+
+def collect_query_stats():
+    """
+    Returns the query statistics of every process writing to METRICS_DIR,
+    or of this process alone when it is not set.
+    """
+    collections = _exported("queries")
+    if collections is None:
+        return query_stats.collect()
+    return merge_query_stats(collections)
+
+
+def collect_pool_stats():
+    """
+    Returns the connection statistics of every process writing to
+    METRICS_DIR, or of this process alone when it is not set.
+    """
+    collections = _exported("pool")
+    if collections is None:
+        return pool_stats.collect()
+    return merge_pool_stats(collections)
+
+
+def _label(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(collection, pool=None):
+    """
+    Formats histograms, and connection statistics if given, in the
+    Prometheus text exposition format.
+    """
+    lines = []
+    for histogram, (name, description, bounds) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for key in sorted(k for k in collection if k[0] == histogram):
+            _, view, method = key
+            series = collection[key]
+            labels = f'view="{_label(view)}",method="{_label(method)}"'
+            cumulative = 0
+            for bound, count in zip(bounds + (float("inf"),), series):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{{labels},le="{_number(bound)}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(f"{name}_sum{{{labels}}} {_number(series[-1])}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+    for stat, (name, kind, description) in POOL_STATS.items():
+        if pool is not None:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for alias, _ in sorted(k for k in pool if k[1] == stat):
+                value = _number(pool[(alias, stat)])
+                lines.append(f'{name}{{alias="{_label(alias)}"}} {value}')
+    return "\n".join(lines) + "\n"
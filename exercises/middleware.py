@@ -0,0 +1,467 @@
+import asyncio
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .cache import get_exercise_version, get_list_version
+from .metrics import (
+    METHODS,
+    RequestTotals,
+    current_queries,
+    exporter,
+    registry,
+)
+from .routers import (
+    PIN_COOKIE,
+    REPLICA_VIEWS,
+    RequestRouting,
+    cache_timeout,
+    current_routing,
+    replicas,
+)
+
+# Query parameters that change what the cached pages show. Anything
+# else, such as campaign tracking parameters, shares the same entry.
+PAGE_PARAMETERS = ("page", "cursor")
+
+# How long a request may hold the right to render a missing page, and
+# how long others wait for it when there is no stale copy to serve.
+LOCK_TIMEOUT = 10
+WAIT_TIMEOUT = 2.0
+WAIT_INTERVAL = 0.05
+
+
+class ReplicaMiddleware:
+    """
+    Lets GET and HEAD requests to the public pages read from the
+    database replicas, through exercises.routers.ReplicaRouter.
+
+    A request that writes, or uses any other method, has its response
+    set a cookie that keeps the visitor's requests on the primary for
+    REPLICA_PIN_SECONDS, so that a visitor redirected after adding a
+    comment sees it even if the replicas have not caught up. The view
+    is only known once the URL is resolved, so queries the middleware
+    below runs before that, such as loading the session, go to the
+    primary.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        routing = RequestRouting()
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        self.pin(request, response, routing)
+        return response
+
+    async def __acall__(self, request):
+        routing = RequestRouting()
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        self.pin(request, response, routing)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = current_routing.get()
+        if (
+            routing is not None
+            and request.method in ("GET", "HEAD")
+            and request.resolver_match.view_name in REPLICA_VIEWS
+            and PIN_COOKIE not in request.COOKIES
+        ):
+            routing.replica_allowed = True
+
+    def pin(self, request, response, routing):
+        if not replicas():
+            return
+        if routing.wrote or request.method not in ("GET", "HEAD", "OPTIONS"):
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 10),
+                httponly=True,
+                samesite="Lax",
+            )
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Serves the home and exercise detail pages to anonymous visitors
+    from the cache, ahead of the session, auth, messages and allauth
+    middleware.
+
+    Only GET and HEAD requests without a session or messages cookie are
+    considered, which covers every logged-out visitor with nothing to be
+    told. Entries are keyed on the path, the page/cursor parameters and
+    the cache version of the exercise (or of the list), so the signals
+    that invalidate the fragment cache purge the pages as well.
+
+    When an entry is missing, only one request renders it. The others
+    are served the page as it was before the purge, or wait briefly for
+    the fresh copy, so a purge on a hot page does not turn into a burst
+    of identical renders.
+
+    The cache is off unless ANONYMOUS_PAGE_CACHE_TIMEOUT is set, which
+    settings.py only does when CACHE_URL is a cache every worker shares.
+    Under ASGI the middleware runs on the event loop, with the same
+    steps awaited in __acall__.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timeout = getattr(settings, "ANONYMOUS_PAGE_CACHE_TIMEOUT", 0)
+        keys = self.cache_keys(request) if timeout else None
+        if keys is None:
+            return self.get_response(request)
+        key, stale_key = keys
+
+        entry = cache.get(key)
+        if entry is not None:
+            return self.replay(request, entry, "hit")
+
+        lock_key = f"{key}:lock"
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            stale = cache.get(stale_key)
+            if stale is not None:
+                return self.replay(request, stale, "stale")
+            entry = self.wait_for(key)
+            if entry is not None:
+                return self.replay(request, entry, "hit")
+            return self.get_response(request)
+
+        try:
+            response = self.get_response(request)
+            if self.is_cacheable(request, response):
+                entry = (
+                    response.status_code,
+                    list(response.items()),
+                    response.content,
+                )
+                timeout = cache_timeout(timeout)
+                # The stale copy outlives the entry, so it is still
+                # there to serve while the next version is rendered.
+                cache.set(key, entry, timeout)
+                cache.set(stale_key, entry, timeout * 2)
+                response["X-Page-Cache"] = "miss"
+            else:
+                cache.delete(stale_key)
+        finally:
+            cache.delete(lock_key)
+        return response
+
+    async def __acall__(self, request):
+        timeout = getattr(settings, "ANONYMOUS_PAGE_CACHE_TIMEOUT", 0)
+        keys = (
+            await sync_to_async(self.cache_keys)(request) if timeout else None
+        )
+        if keys is None:
+            return await self.get_response(request)
+        key, stale_key = keys
+
+        entry = await cache.aget(key)
+        if entry is not None:
+            return self.replay(request, entry, "hit")
+
+        lock_key = f"{key}:lock"
+        if not await cache.aadd(lock_key, 1, LOCK_TIMEOUT):
+            stale = await cache.aget(stale_key)
+            if stale is not None:
+                return self.replay(request, stale, "stale")
+            entry = await self.await_for(key)
+            if entry is not None:
+                return self.replay(request, entry, "hit")
+            return await self.get_response(request)
+
+        try:
+            response = await self.get_response(request)
+            if await sync_to_async(self.is_cacheable)(request, response):
+                entry = (
+                    response.status_code,
+                    list(response.items()),
+                    response.content,
+                )
+                timeout = cache_timeout(timeout)
+                await cache.aset(key, entry, timeout)
+                await cache.aset(stale_key, entry, timeout * 2)
+                response["X-Page-Cache"] = "miss"
+            else:
+                await cache.adelete(stale_key)
+        finally:
+            await cache.adelete(lock_key)
+        return response
+
+    def cache_keys(self, request):
+        """
+        Returns the versioned cache key for a request and the key of its
+        last rendered copy, or None if the request must not be served
+        from the cache.
+        """
+        if request.method not in ("GET", "HEAD"):
+            return None
+        if (
+            settings.SESSION_COOKIE_NAME in request.COOKIES
+            or CookieStorage.cookie_name in request.COOKIES
+        ):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        # Kept for MetricsMiddleware, as a cache hit never gets as far as
+        # Django's own URL resolution.
+        request.resolver_match = match
+
+        if match.url_name == "home":
+            version = get_list_version()
+        elif match.url_name == "exercise_detail":
+            version = get_exercise_version(match.kwargs["pk"])
+        else:
+            return None
+
+        parameters = urlencode(
+            [
+                (name, request.GET[name])
+                for name in PAGE_PARAMETERS
+                if name in request.GET
+            ]
+        )
+        digest = hashlib.md5(
+            f"{request.path}?{parameters}".encode()
+        ).hexdigest()
+        return (
+            f"exercises:page:{version}:{digest}",
+            f"exercises:page:stale:{digest}",
+        )
+
+    def is_cacheable(self, request, response):
+        """
+        Returns whether a freshly rendered response can be shared with
+        every anonymous visitor.
+
+        Responses that set a cookie (a session, messages or a CSRF
+        token) are personal and never stored.
+        """
+        user = getattr(request, "user", None)
+        return (
+            request.method == "GET"
+            and response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not (user is not None and user.is_authenticated)
+            and "private" not in response.get("Cache-Control", "")
+        )
+
+    def wait_for(self, key):
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    async def await_for(self, key):
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(WAIT_INTERVAL)
+            entry = await cache.aget(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def replay(self, request, entry, state):
+        """
+        Rebuilds a cached response, answering revalidation with a 304.
+        """
+        status, headers, content = entry
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        response = get_conditional_response(
+            request,
+            etag=response.get("ETag"),
+            last_modified=parse_http_date_safe(
+                response.get("Last-Modified", "")
+            ),
+            response=response,
+        )
+        response["X-Page-Cache"] = state
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records the wall time, database time, query count and response size
+    of every request in histograms by view name and method, served in
+    the Prometheus format at /metrics.
+
+    It sits at the top of the stack, so the wall time covers all the
+    other middleware and the size is what goes over the wire. Queries
+    are timed by exercises.metrics.record_query, which is installed on
+    every database connection and adds to the current request's totals
+    through a context variable, so queries that async views run in
+    threads are counted too. Requests answered before URL resolution,
+    such as cached pages, are resolved here to find their view. The
+    time taken to stream a response is not included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Decided once here rather than on every request, as the check
+        # costs more than the rest of the middleware put together.
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        totals = RequestTotals(request)
+        token = current_queries.set(totals)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        self.record(request, response, started, totals)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        totals = RequestTotals(request)
+        token = current_queries.set(totals)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        self.record(request, response, started, totals)
+        return response
+
+    def record(self, request, response, started, totals):
+        # CommonMiddleware has usually set the length already, which
+        # saves joining the content up to measure it.
+        if response.has_header("Content-Length"):
+            size = int(response["Content-Length"])
+        elif not response.streaming:
+            size = len(response.content)
+        else:
+            size = None
+        method = request.method if request.method in METHODS else "other"
+        registry.observe(
+            self.view_name(request),
+            method,
+            (
+                time.perf_counter() - started,
+                totals.db_time,
+                totals.queries,
+                size,
+            ),
+        )
+        current = exporter()
+        if current is not None:
+            current.ensure_started()
+
+    def view_name(self, request):
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            return match.view_name
+        if request.path_info.startswith(settings.STATIC_URL):
+            return "static"
+        try:
+            return resolve(request.path_info).view_name
+        except Resolver404:
+            return "<unmatched>"
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also run on the event loop.
+
+    The installed WhiteNoise is sync-only, and one sync middleware at
+    the top of the stack makes Django run everything below it, views
+    included, in a worker thread under ASGI. Static files are looked up
+    in WhiteNoise's in-memory table and only the file is opened in a
+    thread, so other requests pass through without leaving the loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(
+                request.path_info
+            )
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+        response = await sync_to_async(self.serve)(static_file, request)
+        # Django serves a sync iterator over ASGI only by buffering it in
+        # one go; read the file in blocks in a thread instead. HEAD and
+        # 304 responses have no file.
+        response.streaming_content = read_blocks(
+            response.file_to_stream, response.block_size
+        )
+        return response
+
+
+async def read_blocks(file, block_size):
+    if file is None:
+        return
+    try:
+        while block := await sync_to_async(file.read)(block_size):
+            yield block
+    finally:
+        await sync_to_async(file.close)()
@@ -1,6 +1,7 @@
 # Generated by Django 4.2.15 on 2024-09-13 19:57
 
 from django.db import migrations, models
+import django.utils.timezone
 
 
 class Migration(migrations.Migration):
@@ -13,7 +14,7 @@ class Migration(migrations.Migration):
         migrations.AddField(
             model_name='commentreport',
             name='created_at',
-            field=models.DateTimeField(auto_now_add=True, default=2),
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
             preserve_default=False,
         ),
     ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.15 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0006_commentreport_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['exercise', 'created_on', 'id'], name='comment_approved_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('approved', False)), fields=['created_on'], name='comment_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=models.Index(fields=['status', 'title', 'id'], name='exercise_status_title_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comment_counts(apps, schema_editor):
+    Exercise = apps.get_model("exercises", "Exercise")
+    Comment = apps.get_model("exercises", "Comment")
+
+    def counted(**filters):
+        return Coalesce(
+            Subquery(
+                Comment.objects.filter(exercise=OuterRef("pk"), **filters)
+                .order_by()
+                .values("exercise")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+
+    Exercise.objects.update(
+        comment_count=counted(),
+        approved_comment_count=counted(approved=True),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0007_exercise_comment_read_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='exercise',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            backfill_comment_counts, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:11
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+from exercises import search
+
+
+def create_search_index(apps, schema_editor):
+    Exercise = apps.get_model("exercises", "Exercise")
+    search.create_search_index(schema_editor, Exercise)
+    alias = schema_editor.connection.alias
+    search.index_exercises(
+        Exercise.objects.using(alias).iterator(chunk_size=500), using=alias
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    Exercise = apps.get_model("exercises", "Exercise")
+    search.drop_search_index(schema_editor, Exercise)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0008_exercise_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:34
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_reports(apps, schema_editor):
+    # Keep each user's first report on a comment, so the constraint
+    # below can be created over the existing rows.
+    CommentReport = apps.get_model("exercises", "CommentReport")
+    first_reports = (
+        CommentReport.objects.order_by()
+        .values("user", "comment")
+        .annotate(first=Min("pk"))
+        .values("first")
+    )
+    CommentReport.objects.exclude(pk__in=first_reports).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0010_exercise_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_reports, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='commentreport',
+            constraint=models.UniqueConstraint(fields=('user', 'comment'), name='unique_comment_report_per_user'),
+        ),
+    ]
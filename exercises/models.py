@@ -1,16 +1,181 @@
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest, Now, Substr
 from django import forms
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 
 from cloudinary.models import CloudinaryField  # Import CloudinaryField
 
+from .cache import invalidate_exercise
+from .search import search as search_exercises
+
 STATUS = ((0, "Draft"), (1, "Published"))
+COUNTER_FIELDS = ("comment_count", "approved_comment_count")
+# Columns maintained outside of model forms, which save() never writes.
+DERIVED_FIELDS = COUNTER_FIELDS + ("search_vector",)
+# The columns needed to show an exercise as a card or changelist row,
+# leaving out the detailed HTML descriptions and the search vector.
+SUMMARY_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "image",
+    "status",
+    "created_at",
+    "updated_at",
+    "comment_count",
+    "approved_comment_count",
+)
+
+
+class ExerciseQuerySet(models.QuerySet):
+    """
+    Chainable query helpers for Exercise.
+    """
+    def published(self):
+        return self.filter(status=1)
+
+    def summaries(self):
+        """
+        Returns a projection of only the SUMMARY_FIELDS columns.
+
+        The detailed descriptions can run to tens of kilobytes each, so
+        listings load just what a card shows. Touching a deferred field
+        on the results costs an extra query per row.
+        """
+        return self.only(*SUMMARY_FIELDS)
+
+    def touch(self):
+        """
+        Marks the selected exercises as changed now, for changes saved
+        outside Exercise.save(), such as to their comments.
+        """
+        return self.update(updated_at=Now())
+
+    def last_changed(self):
+        """
+        Annotates when each exercise's page last changed: the later of
+        its updated_at and its newest approved comment.
+
+        The comment side is an index-only lookup on the approved thread
+        index, so this stays cheap however long the thread is.
+        """
+        newest_comment = Subquery(
+            Comment.objects.filter(exercise=OuterRef("pk"), approved=True)
+            .order_by("-created_on")
+            .values("created_on")[:1]
+        )
+        return self.annotate(
+            last_changed=Greatest(
+                "updated_at", Coalesce(newest_comment, "updated_at")
+            )
+        )
+
+    def with_previews(self, length=100):
+        """
+        Annotates the first characters of each detailed description, cut
+        in the database so the full text never leaves it.
+
+        One character beyond length is fetched so callers can tell
+        whether the text was truncated.
+
+        Args:
+            length: The number of characters to preview.
+        """
+        return self.annotate(
+            detailed_description1_preview=Substr(
+                "detailed_description1", 1, length + 1
+            ),
+            detailed_description2_preview=Substr(
+                "detailed_description2", 1, length + 1
+            ),
+        )
+
+    def search(self, text):
+        """
+        Returns the exercises matching the search text, best first.
+
+        See exercises.search.search() for how each database does it.
+        """
+        return search_exercises(self, text)
+
+    def adjust_comment_counts(self, comments=0, approved=0):
+        """
+        Atomically shifts the comment counters of the selected exercises.
+
+        The arithmetic happens in the UPDATE itself, so concurrent
+        requests cannot overwrite each other's changes.
+
+        Args:
+            comments: Change to apply to comment_count.
+            approved: Change to apply to approved_comment_count.
+
+        Returns:
+            int: The number of exercises updated.
+        """
+        changes = {}
+        for field, delta in (
+            ("comment_count", comments),
+            ("approved_comment_count", approved),
+        ):
+            if delta > 0:
+                changes[field] = F(field) + delta
+            elif delta < 0:
+                # Never go below zero on a counter that has already
+                # drifted; reconcile_comment_counts puts it right.
+                changes[field] = Greatest(F(field) + delta, 0)
+        return self.update(**changes) if changes else 0
+
+    def recount_comments(self):
+        """
+        Recomputes the comment counters of the selected exercises from
+        the comments table, touching only the rows that drifted.
+
+        Returns:
+            int: The number of exercises corrected.
+        """
+        def counted(**filters):
+            return Coalesce(
+                Subquery(
+                    Comment.objects.filter(exercise=OuterRef("pk"), **filters)
+                    .order_by()
+                    .values("exercise")
+                    .annotate(total=Count("pk"))
+                    .values("total")
+                ),
+                0,
+            )
+
+        drifted = self.alias(
+            actual_comments=counted(), actual_approved=counted(approved=True)
+        ).filter(
+            ~Q(comment_count=F("actual_comments"))
+            | ~Q(approved_comment_count=F("actual_approved"))
+        )
+        return drifted.update(
+            comment_count=counted(),
+            approved_comment_count=counted(approved=True),
+        )
+
+
+class PublishedExerciseManager(models.Manager.from_queryset(ExerciseQuerySet)):
+    """
+    Manager that only returns published exercises, for the public views.
+    """
+    def get_queryset(self):
+        return super().get_queryset().published()
 
 
 class Exercise(models.Model):
     """
     Represents an exercise or blog post in the system.
+
+    ``objects`` stays the default manager so the admin and related
+    lookups still see drafts; public views use ``published``.
 """
     title = models.CharField(max_length=100)
     description = models.CharField(max_length=500)
@@ -26,11 +191,115 @@ class Exercise(models.Model):
     )
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by every save and, through ExerciseQuerySet.touch(), by
+    # changes to the exercise's comments; drives Last-Modified/ETag.
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.IntegerField(choices=STATUS, default=0)
+    # Denormalised counters, only ever changed through F() updates in
+    # ExerciseQuerySet; reconcile_comment_counts repairs any drift.
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    approved_comment_count = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    # Weighted, HTML-free tsvector of the title, description and body,
+    # written by the post_save signal. Only PostgreSQL uses it; SQLite
+    # keeps the same document in an FTS5 table instead.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ExerciseQuerySet.as_manager()
+    published = PublishedExerciseManager()
+
+    class Meta:
+        indexes = [
+            # Serves the published list, ordered and keyset-paged by
+            # (title, id), straight from the index.
+            models.Index(
+                fields=["status", "title", "id"],
+                name="exercise_status_title_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Leave the counters out of updates, so a form loaded before a
+        # comment was posted cannot write back a stale count (the same
+        # goes for the search vector, which the signal rewrites).
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
+class CommentQuerySet(models.QuerySet):
+    """
+    Set-based moderation helpers for Comment.
+
+    Each helper runs a fixed number of statements however many comments
+    are selected, then recounts and invalidates only the exercises they
+    belong to. Neither sends per-object signals.
+    """
+    def _exercise_ids(self):
+        return set(self.order_by().values_list("exercise_id", flat=True))
+
+    def _refresh_exercises(self, exercise_ids):
+        exercises = Exercise.objects.using(self.db).filter(
+            pk__in=exercise_ids
+        )
+        exercises.recount_comments()
+        exercises.touch()
+
+        # After the commit, so that nobody can cache the comments as they
+        # were before it under the new versions.
+        def invalidate():
+            for exercise_id in exercise_ids:
+                invalidate_exercise(exercise_id)
+
+        transaction.on_commit(invalidate, using=self.db)
+
+    def set_approved(self, approved):
+        """
+        Approves (or unapproves) the selected comments in one UPDATE.
+
+        Args:
+            approved: The approval state to set.
+
+        Returns:
+            int: The number of comments whose state changed.
+        """
+        changing = self.filter(approved=not approved)
+        with transaction.atomic(using=self.db):
+            exercise_ids = changing._exercise_ids()
+            updated = changing.update(approved=approved)
+            self._refresh_exercises(exercise_ids)
+        return updated
+
+    def bulk_delete(self):
+        """
+        Deletes the selected comments, and the reports filed against
+        them, with one DELETE per table.
+
+        QuerySet.delete() loads every comment to send post_delete, so
+        the rows are removed directly and their exercises refreshed
+        here instead.
+
+        Returns:
+            int: The number of comments deleted.
+        """
+        with transaction.atomic(using=self.db):
+            exercise_ids = self._exercise_ids()
+            CommentReport.objects.using(self.db).filter(
+                comment__in=self.order_by().values("pk")
+            ).delete()
+            deleted = self.order_by()._raw_delete(self.db)
+            self._refresh_exercises(exercise_ids)
+        return deleted
+
 
 class Comment(models.Model):
     """
@@ -47,8 +316,26 @@ class Comment(models.Model):
     created_on = models.DateTimeField(auto_now_add=True)
     approved = models.BooleanField(default=False)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ["created_on"]
+        indexes = [
+            # A thread's approved comments in display order. Approval is
+            # the index condition rather than a column so that SQLite,
+            # which filters on a bare "approved", can use it as well.
+            models.Index(
+                fields=["exercise", "created_on", "id"],
+                condition=models.Q(approved=True),
+                name="comment_approved_thread_idx",
+            ),
+            # Only the pending comments, oldest first, for moderation.
+            models.Index(
+                fields=["created_on"],
+                condition=models.Q(approved=False),
+                name="comment_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"Comment {self.body} by {self.user.username}"
@@ -57,16 +344,70 @@ class Comment(models.Model):
 class ContactMessage(models.Model):
     """
     Represents a message submitted via a contact form.
+
+    Messages that arrive through the contact spool carry a dedup_key, so
+    the same message from the same address within a minute is stored
+    once however many times it is submitted or delivered.
     """
     name = models.CharField(max_length=100)
     email = models.EmailField()
     message = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    dedup_key = models.CharField(
+        max_length=64, unique=True, null=True, editable=False
+    )
+
+    @classmethod
+    def from_submission(cls, **fields):
+        """
+        Builds a message with its dedup key: a hash of the lower-cased
+        email, a hash of the message and the minute it was sent in.
+        """
+        message = cls(**fields)
+        message_hash = hashlib.sha256(message.message.encode()).hexdigest()
+        minute = message.created_at.strftime("%Y-%m-%dT%H:%M")
+        message.dedup_key = hashlib.sha256(
+            f"{message.email.lower()}|{message_hash}|{minute}".encode()
+        ).hexdigest()
+        return message
 
     def __str__(self):
         return f"Message from {self.name} at {self.created_at}"
 
 
+class CommentReportQuerySet(models.QuerySet):
+    def file(self, user, comment, reason):
+        """
+        Records a user's report on a comment.
+
+        A user has at most one report per comment. Reporting again only
+        replaces the reason, in a single INSERT ... ON CONFLICT DO
+        UPDATE, so repeated and concurrent submissions never add rows.
+
+        Args:
+            user: The user filing the report.
+            comment: The comment being reported.
+            reason (str): Why it is being reported.
+        """
+        self.bulk_create(
+            [CommentReport(user=user, comment=comment, reason=reason)],
+            update_conflicts=True,
+            unique_fields=["user", "comment"],
+            update_fields=["reason"],
+        )
+
+    async def afile(self, user, comment, reason):
+        """
+        Async version of file().
+        """
+        await self.abulk_create(
+            [CommentReport(user=user, comment=comment, reason=reason)],
+            update_conflicts=True,
+            unique_fields=["user", "comment"],
+            update_fields=["reason"],
+        )
+
+
 class CommentReport(models.Model):
     """
     Represents a report filed against a comment.
@@ -75,3 +416,13 @@ class CommentReport(models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
     reason = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = CommentReportQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "comment"],
+                name="unique_comment_report_per_user",
+            ),
+        ]
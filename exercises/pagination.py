@@ -0,0 +1,181 @@
+from collections.abc import Sequence
+from datetime import date
+
+from django.core import signing
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a cursor token cannot be decoded.
+    """
+
+
+class CursorPage(Sequence):
+    """
+    A single page of results produced by the CursorPaginator.
+
+    Mirrors the parts of Django's Page API the templates rely on
+    (has_next, has_previous, has_other_pages, object_list) and adds
+    the opaque tokens needed to build the PREV/NEXT links.
+
+    Attributes:
+        object_list: The items on this page, in display order.
+        next_cursor: Token for the following page, or None.
+        previous_cursor: Token for the preceding page, or None.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f"<CursorPage of {len(self.object_list)} items>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator that seeks on a unique, ordered set of columns.
+
+    Instead of OFFSET/LIMIT and a COUNT(*), each page is fetched with a
+    WHERE clause on the last (or first) row of the page before it, so
+    every page costs the same single indexed query however deep it is.
+    Ordering columns may hold strings, numbers, dates or datetimes.
+
+    Attributes:
+        queryset: The unordered queryset to paginate.
+        per_page: The number of items on each page.
+        ordering: Ascending field names, the last of which must be
+        unique so every row has a distinct position.
+    """
+
+    salt = "exercises.pagination.cursor"
+
+    def __init__(self, queryset, per_page, ordering=("title", "id")):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    def encode_cursor(self, obj, direction):
+        """
+        Returns an opaque token positioned on the given object.
+
+        Args:
+            obj: The boundary object of the current page.
+            direction: "n" to seek forwards, "p" to seek backwards.
+
+        Returns:
+            str: A signed, URL-safe token.
+        """
+        values = [
+            self._dump_value(getattr(obj, field)) for field in self.ordering
+        ]
+        return signing.dumps([direction, values], salt=self.salt)
+
+    @staticmethod
+    def _dump_value(value):
+        # Dates and datetimes travel as full-precision ISO strings, which
+        # the model fields parse back when the cursor is used in a filter.
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    def decode_cursor(self, token):
+        """
+        Returns the direction and key values stored in a token.
+
+        Raises:
+            InvalidCursor: If the token was tampered with or is malformed.
+        """
+        try:
+            direction, values = signing.loads(token, salt=self.salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise InvalidCursor(token)
+        if direction not in ("n", "p") or len(values) != len(self.ordering):
+            raise InvalidCursor(token)
+        return direction, values
+
+    def _seek(self, values, forwards):
+        """
+        Builds the row-value comparison (a, b) > (x, y) as OR'd Q objects.
+        """
+        lookup = "gt" if forwards else "lt"
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            step = Q(**{f"{field}__{lookup}": values[i]})
+            for prior, value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{prior: value})
+            condition |= step
+        # The redundant bound on the leading column lets the database
+        # start an index range scan instead of filtering every row.
+        bound = Q(**{f"{self.ordering[0]}__{lookup}e": values[0]})
+        return bound & condition
+
+    def seek(self, cursor=None):
+        """
+        Returns the direction and the ordered queryset for a cursor.
+
+        Raises:
+            InvalidCursor: If the token cannot be decoded.
+        """
+        ascending = list(self.ordering)
+        if cursor is None:
+            return "n", self.queryset.order_by(*ascending)
+
+        direction, values = self.decode_cursor(cursor)
+        forwards = direction == "n"
+        ordering = ascending if forwards else [
+            f"-{field}" for field in self.ordering
+        ]
+        queryset = self.queryset.filter(self._seek(values, forwards))
+        return direction, queryset.order_by(*ordering)
+
+    def page(self, cursor=None):
+        """
+        Returns the page that follows (or precedes) the given cursor.
+
+        Args:
+            cursor: A token from a previous page, or None for page one.
+
+        Raises:
+            InvalidCursor: If the token cannot be decoded.
+        """
+        direction, queryset = self.seek(cursor)
+        rows = list(queryset[: self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+
+        if direction == "n":
+            has_next, has_previous = has_more, cursor is not None
+        else:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+
+        return self.page_for(rows, has_next, has_previous)
+
+    def page_for(self, rows, has_next, has_previous):
+        """
+        Wraps already fetched rows in a CursorPage with boundary tokens.
+        """
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode_cursor(rows[-1], "n")
+        if rows and has_previous:
+            previous_cursor = self.encode_cursor(rows[0], "p")
+        return CursorPage(rows, next_cursor, previous_cursor)
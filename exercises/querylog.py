@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import os
+import re
+import traceback
+from functools import lru_cache
+
+from django.conf import settings
+
+logger = logging.getLogger("exercises.slow_queries")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%s|\$\d+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+# Frames from these files are left out of the stack logged with a slow
+# query, as they are the instrumentation itself.
+_OWN_FILES = ("metrics.py", "querylog.py")
+_APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """
+    Returns a query with its literals stripped out, so that queries that
+    differ only in their parameters group together.
+
+    String and number literals and placeholders become "?", lists of
+    them "(...)" and rows of a multi-row INSERT a single "(...)". The
+    ORM sends the same SQL text for the same query with different
+    parameters, so results are memoised on the text.
+
+    Args:
+        sql (str): The statement as sent to the database.
+
+    Returns:
+        str: The normalised statement.
+    """
+    normalised = _STRING.sub("?", sql)
+    normalised = _PLACEHOLDER.sub("?", normalised)
+    normalised = _NUMBER.sub("?", normalised)
+    normalised = _LIST.sub("(...)", normalised)
+    normalised = _ROWS.sub("(...)", normalised)
+    return _SPACE.sub(" ", normalised).strip()
+
+
+def fingerprint_id(normalised):
+    """
+    Returns a short, stable id for a fingerprint, for grepping logs.
+    """
+    return hashlib.md5(normalised.encode()).hexdigest()[:12]
+
+
+def slow_query_threshold():
+    """
+    Returns the time in seconds above which queries are logged, or None
+    if slow queries are not logged.
+    """
+    threshold = getattr(settings, "SLOW_QUERY_THRESHOLD_MS", None)
+    return None if threshold is None else threshold / 1000
+
+
+def app_stack(limit=5):
+    """
+    Returns the innermost frames of the current stack that are in this
+    app, such as the line of exercises/views.py or exercises/admin.py
+    that ran the query, formatted one per line.
+    """
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(_APP_DIR)
+        and not frame.filename.endswith(_OWN_FILES)
+    ]
+    # The middleware only passes the request on, unless it is where the
+    # query itself was run.
+    frames = [
+        frame
+        for frame in frames[:-1]
+        if not frame.filename.endswith("middleware.py")
+    ] + frames[-1:]
+    return "".join(
+        f'  File "{os.path.relpath(frame.filename)}", line {frame.lineno}, '
+        f"in {frame.name}\n    {frame.line}\n"
+        for frame in frames[-limit:]
+    )
+
+
+def log_slow_query(sql, elapsed, view):
+    """
+    Logs a query that took longer than SLOW_QUERY_THRESHOLD_MS, with its
+    fingerprint, the view it ran for and where in the app it came from.
+    """
+    normalised = fingerprint(sql)
+    logger.warning(
+        "Slow query: %.1f ms in %s [%s]\n%s\n%s",
+        elapsed * 1000,
+        view,
+        fingerprint_id(normalised),
+        normalised,
+        app_stack() or "  (no frames in exercises)\n",
+    )
@@ -0,0 +1,132 @@
+import contextvars
+import itertools
+import logging
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Views whose GET and HEAD requests may read from a replica: the public
+# pages, which show everyone the same published content.
+REPLICA_VIEWS = frozenset(
+    ("home", "exercise_detail", "exercise_comments", "search")
+)
+
+# Set on the responses to requests that wrote, so that the visitor's
+# next requests read from the primary until the replicas have caught up.
+PIN_COOKIE = "bullfit_primary"
+
+
+class RequestRouting:
+    """
+    Where the request being served reads from.
+    """
+
+    __slots__ = ("replica_allowed", "replica", "wrote")
+
+    def __init__(self):
+        self.replica_allowed = False
+        self.replica = None
+        self.wrote = False
+
+
+# Set by ReplicaMiddleware. The object is shared with the threads that
+# async views run queries in, so a write there pins the request too.
+current_routing = contextvars.ContextVar("current_routing", default=None)
+
+_turn = itertools.count()
+_down_until = {}
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", ())
+
+
+def pick_replica():
+    """
+    Returns the next replica in turn that accepts a connection, or the
+    primary when none does.
+
+    A replica that fails to connect is skipped by every request for
+    REPLICA_RETRY_SECONDS before it is tried again.
+    """
+    aliases = replicas()
+    start = next(_turn)
+    now = time.monotonic()
+    for offset in range(len(aliases)):
+        alias = aliases[(start + offset) % len(aliases)]
+        if _down_until.get(alias, 0) > now:
+            continue
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            _down_until[alias] = now + getattr(
+                settings, "REPLICA_RETRY_SECONDS", 30
+            )
+            logger.warning("Replica %s is unavailable: %s", alias, error)
+            continue
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+def read_from_replica():
+    """
+    Returns whether the current request has read from a replica.
+    """
+    routing = current_routing.get()
+    return (
+        routing is not None
+        and routing.replica is not None
+        and routing.replica != DEFAULT_DB_ALIAS
+    )
+
+
+def cache_timeout(timeout):
+    """
+    Returns how long to cache something the current request rendered.
+
+    A replica may still be behind a write whose signals have already
+    purged the old copy, so what was read from one is only kept for
+    REPLICA_CACHE_TIMEOUT seconds at most.
+    """
+    if not read_from_replica():
+        return timeout
+    return min(timeout, getattr(settings, "REPLICA_CACHE_TIMEOUT", 60))
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of the public pages to the DATABASE_REPLICAS in
+    turn, and everything else to the primary.
+
+    A request reads from one replica throughout, so that a page is
+    consistent with itself. Once it writes, it reads from the primary
+    for the rest of the request, and ReplicaMiddleware keeps the visitor
+    on the primary for a few seconds after, so that they see what they
+    have just written.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        if routing is None or not routing.replica_allowed or routing.wrote:
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            routing.replica = pick_replica()
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        # Explicit, as Django would otherwise write an object read from
+        # a replica back to it.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,224 @@
+import html
+import re
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections
+from django.db.models import F, Q, TextField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+# Text search configuration used to stem both documents and queries.
+SEARCH_CONFIG = "english"
+
+# The GIN index is only created on PostgreSQL, so it lives here rather
+# than in Exercise.Meta.indexes.
+SEARCH_INDEX = GinIndex(fields=["search_vector"], name="exercise_search_idx")
+
+# SQLite has no tsvector; an FTS5 table keyed on the exercise id stands
+# in for the column and its index.
+FTS_TABLE = "exercises_exercise_fts"
+
+# Weights of the title, description and body in FTS5's bm25(), chosen
+# to rank roughly like PostgreSQL's default A/B/C weights.
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+WHITESPACE = re.compile(r"\s+")
+WORD = re.compile(r"\w+")
+
+
+def plain_text(value):
+    """
+    Returns the words of an HTML fragment without tags or entities.
+    """
+    text = html.unescape(strip_tags(value or ""))
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def search_document(exercise):
+    """
+    Returns the (title, description, body) text indexed for an exercise.
+
+    Summernote stores the detailed descriptions as HTML, so the markup
+    is stripped before indexing to keep tag names and attributes out of
+    the results.
+    """
+    body = " ".join(
+        (
+            plain_text(exercise.detailed_description1),
+            plain_text(exercise.detailed_description2),
+        )
+    )
+    return plain_text(exercise.title), plain_text(exercise.description), body
+
+
+def _vendor(using):
+    return connections[using].vendor
+
+
+def create_search_index(schema_editor, model):
+    """
+    Creates the GIN index or, on SQLite, the FTS5 table.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.add_index(model, SEARCH_INDEX)
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, description, body, "
+            "tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+
+
+def drop_search_index(schema_editor, model):
+    """
+    Reverses create_search_index().
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.remove_index(model, SEARCH_INDEX)
+    elif vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def index_exercises(exercises, using="default"):
+    """
+    Writes the search document of each exercise to the search index.
+
+    Args:
+        exercises: An iterable of Exercise instances.
+        using: The database alias to write to.
+    """
+    vendor = _vendor(using)
+    if vendor == "postgresql":
+        for exercise in exercises:
+            title, description, body = search_document(exercise)
+            vector = (
+                SearchVector(
+                    Value(title, output_field=TextField()),
+                    weight="A",
+                    config=SEARCH_CONFIG,
+                )
+                + SearchVector(
+                    Value(description, output_field=TextField()),
+                    weight="B",
+                    config=SEARCH_CONFIG,
+                )
+                + SearchVector(
+                    Value(body, output_field=TextField()),
+                    weight="C",
+                    config=SEARCH_CONFIG,
+                )
+            )
+            # update() does not send post_save, so this cannot recurse.
+            type(exercise)._base_manager.using(using).filter(
+                pk=exercise.pk
+            ).update(search_vector=vector)
+    elif vendor == "sqlite":
+        rows = [
+            (exercise.pk, *search_document(exercise))
+            for exercise in exercises
+        ]
+        with connections[using].cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                [(row[0],) for row in rows],
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, description, body) "
+                "VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+
+def unindex_exercise(exercise_pk, using="default"):
+    """
+    Removes a deleted exercise from the FTS5 table.
+
+    On PostgreSQL the vector is deleted along with its row.
+    """
+    if _vendor(using) == "sqlite":
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [exercise_pk]
+            )
+
+
+def clear_search_index(using="default"):
+    """
+    Empties the FTS5 table before a full rebuild.
+    """
+    if _vendor(using) == "sqlite":
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+
+def fts5_query(text):
+    """
+    Turns free text into a safe FTS5 query of quoted prefix terms, so
+    user input can never be parsed as FTS5 syntax.
+    """
+    return " ".join(f'"{word}"*' for word in WORD.findall(text))
+
+
+def search(queryset, text):
+    """
+    Filters a queryset of exercises to those matching the search text
+    and orders them by relevance.
+
+    PostgreSQL matches the stored search_vector through its GIN index
+    with websearch syntax and ranks with ts_rank. SQLite matches the
+    FTS5 table and ranks with bm25(). Other databases fall back to
+    case-insensitive matching on the title and description.
+
+    Args:
+        queryset: The Exercise queryset to search within.
+        text: The words the user searched for.
+
+    Returns:
+        QuerySet: The matches, annotated with search_rank (higher is
+        better) and ordered by it.
+    """
+    vendor = _vendor(queryset.db)
+    if vendor == "postgresql":
+        query = SearchQuery(
+            text, search_type="websearch", config=SEARCH_CONFIG
+        )
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F("search_vector"), query)
+        )
+    elif vendor == "sqlite":
+        match = fts5_query(text)
+        if not match:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        weights = ", ".join(str(weight) for weight in FTS_WEIGHTS)
+        queryset = queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                [match],
+            )
+        ).annotate(
+            # bm25() scores better matches lower, so negate it.
+            search_rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+                [match],
+            )
+        )
+    else:
+        words = WORD.findall(text)
+        if not words:
+            return queryset.none()
+        condition = Q()
+        for word in words:
+            condition &= Q(title__icontains=word) | Q(
+                description__icontains=word
+            )
+        queryset = queryset.filter(condition).annotate(search_rank=Value(0.0))
+    return queryset.order_by("-search_rank", "title", "id")
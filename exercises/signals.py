@@ -0,0 +1,72 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_exercise
+from .metrics import record_query
+from .models import Comment, Exercise
+from .search import index_exercises, unindex_exercise
+
+
+@receiver([post_save, post_delete], sender=Exercise)
+def exercise_changed(sender, instance, using, **kwargs):
+    """
+    Drops the cached fragments of an exercise that was saved or deleted.
+
+    Only once the change is committed: bumped any earlier, a request
+    still reading the old rows could cache them under the new version.
+    """
+    transaction.on_commit(
+        partial(invalidate_exercise, instance.pk), using=using
+    )
+
+
+@receiver(post_save, sender=Exercise)
+def exercise_saved(sender, instance, using, raw=False, **kwargs):
+    """
+    Rewrites the search document of an exercise that was saved.
+    """
+    if not raw:
+        index_exercises([instance], using=using)
+
+
+@receiver(post_delete, sender=Exercise)
+def exercise_deleted(sender, instance, using, **kwargs):
+    """
+    Drops a deleted exercise from the search index.
+    """
+    unindex_exercise(instance.pk, using=using)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, instance, using, **kwargs):
+    """
+    Drops the cached fragments of the exercise a comment belongs to and
+    touches it, so that its Last-Modified and ETag move on.
+
+    Covers new, edited and deleted comments as well as approval, which
+    is saved through the comment admin. Both happen once the change is
+    committed, as for exercise_changed.
+    """
+    exercise_id = instance.exercise_id
+
+    def refresh():
+        Exercise.objects.using(using).filter(pk=exercise_id).touch()
+        invalidate_exercise(exercise_id)
+
+    transaction.on_commit(refresh, using=using)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """
+    Times every query on a new database connection for the metrics.
+
+    The wrapper goes first in the list, as connection.execute_wrapper()
+    removes the last one when it exits.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+from .models import ContactMessage
+
+logger = logging.getLogger(__name__)
+
+
+class Spool:
+    """
+    A durable first-in, first-out queue of JSON records in a directory.
+
+    Records are laid out like a Maildir: each is written to tmp/,
+    flushed to disk and renamed into new/, so a reader never sees half
+    a record and an acknowledged write survives a crash. A consumer
+    claims records by renaming them into claimed/, which only one
+    process can do for a given file, and deletes them once they are
+    stored. Claims left behind by a consumer that died are moved back
+    into new/ by recover(), so every record is delivered at least once.
+    Records that cannot be read or stored are moved into failed/ and
+    logged, so they do not block the queue; they stay there to be looked
+    at by hand.
+
+    Attributes:
+        path: The spool directory.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        for folder in ("tmp", "new", "claimed", "failed"):
+            os.makedirs(os.path.join(self.path, folder), exist_ok=True)
+
+    def _folder(self, name, *parts):
+        return os.path.join(self.path, name, *parts)
+
+    def put(self, record):
+        """
+        Adds a record to the queue once it is safely on disk.
+
+        Args:
+            record (dict): A JSON-serialisable record.
+
+        Returns:
+            str: The record's file name.
+        """
+        # Names sort in arrival order, which claim() relies on.
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+        temporary = self._folder("tmp", name)
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(record, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(temporary, self._folder("new", name))
+        return name
+
+    def claim(self, limit):
+        """
+        Takes up to `limit` of the oldest records for this process.
+
+        Returns:
+            list: (name, record) pairs, oldest first.
+        """
+        claimed = []
+        for name in sorted(os.listdir(self._folder("new"))):
+            if len(claimed) >= limit:
+                break
+            try:
+                os.rename(
+                    self._folder("new", name), self._folder("claimed", name)
+                )
+            except FileNotFoundError:
+                continue  # Another consumer got there first.
+            # recover() goes by the time of the claim, not of the write.
+            os.utime(self._folder("claimed", name))
+            try:
+                with open(
+                    self._folder("claimed", name), encoding="utf-8"
+                ) as f:
+                    claimed.append((name, json.load(f)))
+            except ValueError as error:
+                self.reject(name, error)
+        return claimed
+
+    def ack(self, names):
+        """
+        Deletes records that have been stored.
+        """
+        for name in names:
+            try:
+                os.remove(self._folder("claimed", name))
+            except FileNotFoundError:
+                pass
+
+    def reject(self, name, error):
+        """
+        Moves a claimed record that can never be stored into failed/.
+        """
+        logger.error("Spool record %s moved to failed/: %r", name, error)
+        try:
+            os.rename(
+                self._folder("claimed", name), self._folder("failed", name)
+            )
+        except FileNotFoundError:
+            pass
+
+    def release(self, names):
+        """
+        Returns claimed records to the queue, e.g. after a failed flush.
+        """
+        for name in names:
+            try:
+                os.rename(
+                    self._folder("claimed", name), self._folder("new", name)
+                )
+            except FileNotFoundError:
+                pass
+
+    def recover(self, older_than):
+        """
+        Returns claims older than `older_than` seconds to the queue.
+
+        Returns:
+            int: The number of records recovered.
+        """
+        cutoff = time.time() - older_than
+        stale = [
+            entry.name
+            for entry in os.scandir(self._folder("claimed"))
+            if entry.stat().st_mtime < cutoff
+        ]
+        self.release(stale)
+        return len(stale)
+
+    def __len__(self):
+        return len(os.listdir(self._folder("new")))
+
+
+def contact_spool():
+    """
+    Returns the spool for contact messages, or None if submissions are
+    saved directly.
+    """
+    path = getattr(settings, "CONTACT_MESSAGE_SPOOL_DIR", None)
+    return Spool(path) if path else None
+
+
+def enqueue_contact_message(spool, form):
+    """
+    Queues a validated contact form for the worker to store.
+
+    The submission time is recorded now, so the stored message keeps it
+    however long the queue takes to drain.
+    """
+    spool.put(
+        {
+            "name": form.cleaned_data["name"],
+            "email": form.cleaned_data["email"],
+            "message": form.cleaned_data["message"],
+            "created_at": form.instance.created_at.isoformat(),
+        }
+    )
+
+
+def flush_contact_messages(spool, batch_size):
+    """
+    Moves up to `batch_size` queued messages into the database.
+
+    The batch is stored with one bulk INSERT that skips rows whose
+    dedup key already exists, so a batch delivered twice, or the same
+    message sent twice within a minute, is only stored once. If the
+    INSERT fails the batch goes back on the queue. A record missing a
+    field, or with a malformed time, is moved aside instead, as it
+    would fail every time.
+
+    Returns:
+        int: The number of queued records processed.
+    """
+    batch = spool.claim(batch_size)
+    if not batch:
+        return 0
+    names, messages = [], []
+    for name, record in batch:
+        try:
+            messages.append(
+                ContactMessage.from_submission(
+                    created_at=datetime.fromisoformat(record["created_at"]),
+                    name=record["name"],
+                    email=record["email"],
+                    message=record["message"],
+                )
+            )
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            spool.reject(name, error)
+            continue
+        names.append(name)
+    try:
+        ContactMessage.objects.bulk_create(messages, ignore_conflicts=True)
+    except Exception:
+        spool.release(names)
+        raise
+    spool.ack(names)
+    return len(batch)
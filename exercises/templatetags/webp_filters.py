@@ -1,5 +1,7 @@
 from django import template
-from cloudinary import CloudinaryImage
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
+from exercises.images import image_url
 
 register = template.Library()
 
@@ -8,11 +10,13 @@ def webp(cloudinary_url, width=250, height=None):
     """
     Generate a Cloudinary URL for an image in WebP format.
 
-    This template tag takes a Cloudinary image URL and transforms it
-    into a WebP format URL with optional resizing.
+    This template tag takes a Cloudinary image (or its URL) and returns
+    a WebP format URL with optional resizing. URLs come from the shared,
+    memoised image URL service.
 
     Args:
-        cloudinary_url (str): The original Cloudinary URL of the image.
+        cloudinary_url: The CloudinaryField value of the image, or its
+            original Cloudinary URL.
         width (int, optional): The desired width of the output image.
             Defaults to 250.
         height (int, optional): The desired height of the output image.
@@ -23,15 +27,104 @@ def webp(cloudinary_url, width=250, height=None):
         str: The transformed WebP image URL, or an empty string if 
         the input URL is invalid.
     """
-    if not cloudinary_url:
+    return image_url(
+        cloudinary_url, format="webp", width=width, height=height, crop="fit"
+    )
+
+
+# MIME types for the <source> elements, in the order browsers should
+# try them. The last format in the setting is also the <img> fallback.
+IMAGE_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+    "png": "image/png",
+}
+
+
+def _ratio(value):
+    """
+    Returns (width, height) from "4:3" or a (4, 3) pair.
+    """
+    if isinstance(value, str):
+        value = value.split(":")
+    width, height = (int(part) for part in value)
+    return width, height
+
+
+@register.simple_tag
+def picture(image, alt="", css_class="", sizes="100vw", ratio=None,
+            widths=None, loading="lazy"):
+    """
+    Render a responsive <picture> element for a Cloudinary image.
+
+    Emits one <source> per format in RESPONSIVE_IMAGE_FORMATS (AVIF and
+    WebP by default), each with a srcset covering the width ladder in
+    RESPONSIVE_IMAGE_WIDTHS, and an <img> fallback in the last format.
+    Every rendition is cropped to the same aspect ratio, so the explicit
+    width and height attributes are true for whichever file the browser
+    picks and the layout does not shift while it loads.
+
+    Args:
+        image: The CloudinaryField value of the image, or its URL.
+        alt (str): The alternative text for the image.
+        css_class (str): CSS classes for the <img> element.
+        sizes (str): The sizes attribute telling the browser how wide
+            the image is displayed.
+        ratio (str, optional): The "width:height" aspect ratio. Defaults
+            to RESPONSIVE_IMAGE_RATIO.
+        widths (str, optional): Comma separated widths overriding the
+            ladder in settings.
+        loading (str): "lazy" or "eager"; use "eager" for images that
+            are visible without scrolling.
+
+    Returns:
+        str: The <picture> markup, or an empty string if there is no
+        image.
+    """
+    if not image:
         return ""
 
-    public_id = cloudinary_url.split('/')[-1].split('.')[0]
+    if widths:
+        ladder = sorted(int(width) for width in str(widths).split(","))
+    else:
+        ladder = sorted(settings.RESPONSIVE_IMAGE_WIDTHS)
+    ratio_width, ratio_height = _ratio(
+        ratio or settings.RESPONSIVE_IMAGE_RATIO
+    )
+    *source_formats, fallback_format = settings.RESPONSIVE_IMAGE_FORMATS
+
+    def rendition(format, width):
+        height = round(width * ratio_height / ratio_width)
+        return image_url(
+            image, format=format, width=width, height=height, crop="fill"
+        )
 
-    transformation = {'format': 'webp', 'width': width, 'crop': 'fit'}
-    if height:
-        transformation['height'] = height
+    def srcset(format):
+        return ", ".join(
+            f"{rendition(format, width)} {width}w" for width in ladder
+        )
 
-    webp_url = CloudinaryImage(public_id).build_url(**transformation)
-    
-    return webp_url
+    largest = ladder[-1]
+    sources = format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (IMAGE_TYPES[format], srcset(format), sizes)
+            for format in source_formats
+        ),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" '
+        'height="{}" class="{}" alt="{}" loading="{}" decoding="async">'
+        "</picture>",
+        sources,
+        rendition(fallback_format, largest),
+        srcset(fallback_format),
+        sizes,
+        largest,
+        round(largest * ratio_height / ratio_width),
+        css_class,
+        alt,
+        loading,
+    )
@@ -0,0 +1,317 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .cache import invalidate_exercise
+from .models import Exercise, Comment
+
+# Maximum number of queries each route in exercises/urls.py may run.
+# Anonymous requests carry no session, authenticated ones pay one query
+# for the session and one for the user on top of the view's own work.
+# The list and detail pages include one ETag/Last-Modified lookup, the
+# detail page one more for a signed-in reader's own pending comments,
+# and comment writes one UPDATE touching the exercise's updated_at.
+# Search counts its matches for the paginator and loads one page, and
+# /metrics only looks up the staff member reading it.
+QUERY_BUDGETS = {
+    "home": 3,
+    "search": 2,
+    "exercise_detail": 3,
+    "exercise_detail_authenticated": 6,
+    "exercise_comments": 2,
+    "add_comment_get": 3,
+    "add_comment_post": 6,
+    "edit_comment_get": 4,
+    "edit_comment_post": 6,
+    "delete_comment": 8,
+    "contact_form_get": 0,
+    "contact_form_post": 1,
+    "report_comment_get": 3,
+    "report_comment_post": 4,
+    "login": 1,
+    "metrics": 2,
+}
+
+# Number of comments on the exercise under test for each budget check.
+COMMENT_COUNTS = (1, 10, 100, 1000)
+
+# Number of exercises matching the search under test for each check.
+MATCH_COUNTS = (1, 10, 100)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Base class for the query budget tests.
+
+    Methods:
+        setUp: Creates a test client, a commenter, an exercise and a
+        second user whose comments make up the bulk of the thread.
+        grow_comments: Tops the exercise up to the requested number
+        of comments.
+        assertQueryBudget: Runs a request and fails if it issues more
+        queries than the budget declared in QUERY_BUDGETS, keeping the
+        number it ran in self.executed.
+    """
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.other_user = User.objects.create_user(
+            username="otheruser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise",
+            description="This is a test exercise.",
+            author=self.user,
+            status=1,
+        )
+        self.comment = Comment.objects.create(
+            exercise=self.exercise,
+            user=self.user,
+            body="This is a test comment.",
+            approved=True,
+        )
+
+    def grow_comments(self, total):
+        missing = total - self.exercise.comments.count()
+        users = (self.user, self.other_user)
+        Comment.objects.bulk_create(
+            Comment(
+                exercise=self.exercise,
+                user=users[i % 2],
+                body=f"Comment number {i}",
+                approved=bool(i % 3),
+            )
+            for i in range(missing)
+        )
+        # bulk_create skips the signals that drop cached fragments and
+        # the views that keep the comment counters up to date.
+        invalidate_exercise(self.exercise.pk)
+        Exercise.objects.filter(pk=self.exercise.pk).recount_comments()
+
+    def assertQueryBudget(self, budget_name, request, *args, **kwargs):
+        budget = QUERY_BUDGETS[budget_name]
+        with CaptureQueriesContext(connection) as captured:
+            response = request(*args, **kwargs)
+        # The savepoints are an artefact of running inside TestCase's
+        # transaction; in production transaction.atomic() begins and
+        # commits without extra statements.
+        statements = [
+            query
+            for query in captured.captured_queries
+            if "SAVEPOINT" not in query["sql"]
+        ]
+        executed = self.executed = len(statements)
+        self.assertLessEqual(
+            executed,
+            budget,
+            f"{budget_name} ran {executed} queries, budget is {budget}:\n"
+            + "\n".join(query["sql"] for query in statements),
+        )
+        return response
+
+
+class ReadQueryBudgetTest(QueryBudgetTestCase):
+    """
+    Query budgets for the read-only routes as the thread grows.
+
+    Methods:
+        test_home_budget: The exercise list stays within budget.
+        test_exercise_detail_budget: The detail page stays within
+        budget for an anonymous visitor.
+        test_exercise_detail_authenticated_budget: The detail page
+        stays within budget for the comment author.
+        test_exercise_comments_budget: A page of comments costs the
+        same however long the thread is.
+        test_contact_form_budget: Rendering the contact form runs
+        no queries.
+        test_login_budget: Rendering the login page only looks up
+        the current site.
+        test_search_budget: Searching costs the same however many
+        exercises match.
+        test_metrics_budget: Serving /metrics to staff only loads the
+        session and the user.
+    """
+    def test_home_budget(self):
+        for total in COMMENT_COUNTS:
+            self.grow_comments(total)
+            with self.subTest(comments=total):
+                response = self.assertQueryBudget(
+                    "home", self.client.get, reverse("home")
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_exercise_detail_budget(self):
+        url = reverse("exercise_detail", args=[self.exercise.pk])
+        for total in COMMENT_COUNTS:
+            self.grow_comments(total)
+            # Anonymous visitors are shown, and told of, approved
+            # comments only.
+            shown = self.exercise.comments.filter(approved=True).count()
+            with self.subTest(comments=total):
+                response = self.assertQueryBudget(
+                    "exercise_detail", self.client.get, url
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, f"Comments ({shown})")
+
+    def test_exercise_detail_authenticated_budget(self):
+        self.client.force_login(self.user)
+        url = reverse("exercise_detail", args=[self.exercise.pk])
+        for total in COMMENT_COUNTS:
+            self.grow_comments(total)
+            # The viewer also sees their own comments awaiting approval.
+            shown = self.exercise.comments.filter(
+                Q(approved=True) | Q(user=self.user)
+            ).count()
+            with self.subTest(comments=total):
+                response = self.assertQueryBudget(
+                    "exercise_detail_authenticated", self.client.get, url
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, f"Comments ({shown})")
+                self.assertContains(
+                    response,
+                    reverse(
+                        "edit_comment",
+                        args=[self.exercise.pk, self.comment.pk],
+                    ),
+                )
+
+    def test_exercise_comments_budget(self):
+        url = reverse("exercise_comments", args=[self.exercise.pk])
+        for total in COMMENT_COUNTS:
+            self.grow_comments(total)
+            with self.subTest(comments=total):
+                response = self.assertQueryBudget(
+                    "exercise_comments", self.client.get, url
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_contact_form_budget(self):
+        response = self.assertQueryBudget(
+            "contact_form_get", self.client.get, reverse("contact_form")
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_budget(self):
+        response = self.assertQueryBudget(
+            "login", self.client.get, reverse("login")
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_budget(self):
+        url = reverse("search")
+        executed = []
+        for total in MATCH_COUNTS:
+            # Created one by one, as the search index is kept up to date
+            # by the save signals.
+            matching = Exercise.objects.filter(title__startswith="Squat")
+            for i in range(matching.count(), total):
+                Exercise.objects.create(
+                    title=f"Squat variation {i}",
+                    description="A squat for the legs.",
+                    author=self.other_user,
+                    status=1,
+                )
+            with self.subTest(matches=total):
+                response = self.assertQueryBudget(
+                    "search", self.client.get, url, {"q": "squat"}
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, f"{total} result")
+            executed.append(self.executed)
+        self.assertEqual(len(set(executed)), 1, executed)
+
+    def test_metrics_budget(self):
+        staff = User.objects.create_user(
+            username="staff", password="password", is_staff=True
+        )
+        self.client.force_login(staff)
+        response = self.assertQueryBudget(
+            "metrics", self.client.get, reverse("metrics")
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class WriteQueryBudgetTest(QueryBudgetTestCase):
+    """
+    Query budgets for the comment, report and contact routes.
+
+    Methods:
+        setUp: Logs the comment author in and fills the thread with
+        the largest comment count.
+        test_add_comment_budget: Showing and posting a comment stays
+        within budget.
+        test_edit_comment_budget: Showing and saving an edit stays
+        within budget.
+        test_delete_comment_budget: Deleting a comment stays
+        within budget.
+        test_report_comment_budget: Loading and submitting the report
+        form stays within budget.
+        test_contact_form_post_budget: Submitting the contact form runs
+        a single insert.
+    """
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.grow_comments(COMMENT_COUNTS[-1])
+
+    def test_add_comment_budget(self):
+        url = reverse("add_comment", args=[self.exercise.pk])
+        self.assertQueryBudget("add_comment_get", self.client.get, url)
+        response = self.assertQueryBudget(
+            "add_comment_post", self.client.post, url, {"body": "Hello"}
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_edit_comment_budget(self):
+        url = reverse(
+            "edit_comment", args=[self.exercise.pk, self.comment.pk]
+        )
+        self.assertQueryBudget("edit_comment_get", self.client.get, url)
+        response = self.assertQueryBudget(
+            "edit_comment_post", self.client.post, url, {"body": "Edited"}
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_delete_comment_budget(self):
+        url = reverse(
+            "delete_comment", args=[self.exercise.pk, self.comment.pk]
+        )
+        response = self.assertQueryBudget(
+            "delete_comment", self.client.post, url
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(
+            Comment.objects.filter(pk=self.comment.pk).exists()
+        )
+
+    def test_report_comment_budget(self):
+        url = reverse("report_comment", args=[self.comment.pk])
+        self.assertQueryBudget("report_comment_get", self.client.get, url)
+        response = self.assertQueryBudget(
+            "report_comment_post",
+            self.client.post,
+            url,
+            {"reason": "Spam", "comment_text": self.comment.body},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_contact_form_post_budget(self):
+        self.client.logout()
+        response = self.assertQueryBudget(
+            "contact_form_post",
+            self.client.post,
+            reverse("contact_form"),
+            {
+                "name": "Test Name",
+                "email": "test@example.com",
+                "message": "This is a test message.",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
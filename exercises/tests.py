@@ -1,8 +1,59 @@
-from django.test import TestCase, Client
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    AsyncClient,
+    Client,
+    RequestFactory,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.db import OperationalError, connection, connections
 from django.urls import reverse
+from html import unescape
+from io import StringIO
+import csv
+import json
+import subprocess
+import sys
+import unittest
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import re
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from cloudinary import CloudinaryImage
 from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from django.utils.functional import empty
+from datetime import timedelta
 from .models import Exercise, Comment, ContactMessage, CommentReport
 from .forms import CommentForm, ContactMessageForm, ReportCommentForm
+from .context_processors import LazyContactForm
+from .middleware import AnonymousPageCacheMiddleware
+from exercise_blog.cache_backends import parse_cache_url
+from .images import image_url, clear_image_url_cache
+from .templatetags.webp_filters import webp, picture
+from .throttle import TokenBucket, client_ip
+from .spool import Spool, flush_contact_messages
+from .export import export_blocks
+from .cache import get_exercise_version
+from .metrics import (
+    HISTOGRAMS,
+    Registry,
+    exporter,
+    pool_stats,
+    query_stats,
+    registry,
+)
+from .management.commands.bench_connections import read_pool_stats
+from .querylog import fingerprint
+from . import routers
+from .routers import PIN_COOKIE, RequestRouting
 
 #
 # Model Tests
@@ -97,8 +148,8 @@ class ContactMessageModelTest(TestCase):
         )
         self.assertEqual(
             str(contact_message),
-            f"Message from {contact_message.name} at
-            {contact_message.created_at}",
+            f"Message from {contact_message.name} at "
+            f"{contact_message.created_at}",
         )
 
     def test_invalid_email(self):
@@ -231,6 +282,657 @@ class ReportCommentFormTest(TestCase):
         self.assertIn("reason", form.errors)
 
 
+class ContactSpoolTest(TestCase):
+    """
+    Tests for the write-behind queue of contact form submissions.
+
+    Methods:
+        setUp: Points CONTACT_MESSAGE_SPOOL_DIR at a fresh directory.
+        test_form_is_queued_then_stored: Ensures a submission is queued
+        by the view and stored by the worker with its original time.
+        test_failed_flush_requeues: Ensures a batch whose INSERT fails
+        goes back on the queue.
+        test_unreadable_records_set_aside: Ensures records that cannot
+        be parsed or stored are moved to failed/ and logged, and the
+        rest of the batch is stored.
+        test_ten_thousand_submissions: Ensures 10,000 submissions, with
+        duplicates and a crashed worker's batch redelivered, are stored
+        once each in a few bulk INSERTs.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        settings_override = override_settings(
+            CONTACT_MESSAGE_SPOOL_DIR=self.path
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.spool = Spool(self.path)
+
+    def test_form_is_queued_then_stored(self):
+        response = self.client.post(
+            reverse("contact_form"),
+            {"name": "A", "email": "a@example.com", "message": "Hello"},
+        )
+        self.assertRedirects(response, reverse("home"))
+        self.assertFalse(ContactMessage.objects.exists())
+        self.assertEqual(len(self.spool), 1)
+
+        sent_at = timezone.now() - timedelta(minutes=5)
+        self.spool.put(
+            {
+                "name": "B", "email": "b@example.com", "message": "Hi",
+                "created_at": sent_at.isoformat(),
+            }
+        )
+        call_command("run_contact_worker", "--once", stdout=StringIO())
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(
+            ContactMessage.objects.get(name="B").created_at, sent_at
+        )
+        self.assertIsNotNone(ContactMessage.objects.get(name="A").dedup_key)
+
+    def test_failed_flush_requeues(self):
+        self.spool.put(
+            {
+                "name": "A", "email": "a@example.com", "message": "Hi",
+                "created_at": timezone.now().isoformat(),
+            }
+        )
+        with mock.patch.object(
+            ContactMessage.objects, "bulk_create", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                flush_contact_messages(self.spool, 10)
+        self.assertEqual(len(self.spool), 1)
+
+    def test_unreadable_records_set_aside(self):
+        sent_at = timezone.now().isoformat()
+        self.spool.put(
+            {
+                "name": "A", "email": "a@example.com", "message": "Hi",
+                "created_at": sent_at,
+            }
+        )
+        self.spool.put({"name": "B", "email": "b@example.com"})
+        self.spool.put(
+            {
+                "name": "C", "email": "c@example.com", "message": "Hi",
+                "created_at": "yesterday",
+            }
+        )
+        with open(
+            os.path.join(self.path, "new", "99999999999999999999-x.json"),
+            "w",
+        ) as f:
+            f.write('{"name": "trunc')
+
+        with self.assertLogs("exercises.spool", "ERROR") as logs:
+            call_command("run_contact_worker", "--once", stdout=StringIO())
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(
+            list(ContactMessage.objects.values_list("name", flat=True)),
+            ["A"],
+        )
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(os.listdir(os.path.join(self.path, "claimed")), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.path, "failed"))), 3)
+
+        # Nothing is left to retry on the next pass.
+        self.assertEqual(flush_contact_messages(self.spool, 10), 0)
+
+    def test_ten_thousand_submissions(self):
+        sent_at = timezone.now().replace(second=0).isoformat()
+        for i in range(10000):
+            # Every tenth submission repeats an earlier one.
+            n = i - 1 if i % 10 == 9 else i
+            self.spool.put(
+                {
+                    "name": f"Visitor {n}",
+                    "email": f"visitor{n}@example.com",
+                    "message": f"Message {n}",
+                    "created_at": sent_at,
+                }
+            )
+        # A worker that claimed a batch and died before storing it.
+        self.spool.claim(1000)
+        self.assertEqual(len(self.spool), 9000)
+        self.assertEqual(self.spool.recover(older_than=-1), 1000)
+
+        with CaptureQueriesContext(connection) as captured:
+            call_command(
+                "run_contact_worker", "--once", "--batch-size", "1000",
+                stdout=StringIO(),
+            )
+        inserts = [
+            query for query in captured.captured_queries
+            if query["sql"].startswith("INSERT")
+        ]
+        self.assertEqual(ContactMessage.objects.count(), 9000)
+        self.assertEqual(len(self.spool), 0)
+        self.assertEqual(os.listdir(os.path.join(self.path, "claimed")), [])
+        self.assertLessEqual(len(inserts), 100)
+
+
+class ExportTest(TestCase):
+    """
+    Tests for the streaming CSV/NDJSON exports of contact messages and
+    comment reports.
+
+    Methods:
+        setUp: Logs in a superuser and creates three contact messages
+        and a comment report.
+        export_action: Runs an export action over every row.
+        test_csv_action: Ensures contact messages download as CSV.
+        test_ndjson_action: Ensures reports download as NDJSON with the
+        reporter's username and the comment's text.
+        test_action_streams_under_asgi: Ensures the download is handed
+        to an ASGI server through an async iterator.
+        test_command_filters_by_date: Ensures the export command only
+        writes rows in the requested range.
+        test_csv_neutralises_formulas: Ensures cells a spreadsheet would
+        run as formulas are quoted in CSV and left alone in NDJSON.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", password="password", email="a@example.com"
+        )
+        self.client.force_login(self.user)
+        self.start = timezone.now() - timedelta(days=3)
+        for day in range(3):
+            ContactMessage.objects.create(
+                name=f"Visitor {day}",
+                email=f"visitor{day}@example.com",
+                message=f'Line one\nLine "two" {day}',
+                created_at=self.start + timedelta(days=day),
+            )
+        exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.user, status=1,
+        )
+        comment = Comment.objects.create(
+            exercise=exercise, user=self.user, body="Rude comment"
+        )
+        CommentReport.objects.create(
+            user=self.user, comment=comment, reason="Rude"
+        )
+
+    def export_action(self, model, action, client=None):
+        return (client or self.client).post(
+            reverse(f"admin:exercises_{model}_changelist"),
+            {"action": action, "select_across": "1", "index": "0",
+             "_selected_action": ["1"]},
+        )
+
+    def test_csv_action(self):
+        response = self.export_action("contactmessage", "export_csv")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn("contactmessage.csv", response["Content-Disposition"])
+        rows = list(csv.reader(
+            b"".join(response.streaming_content).decode().splitlines(True)
+        ))
+        self.assertEqual(
+            rows[0], ["id", "name", "email", "message", "created_at"]
+        )
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][3], 'Line one\nLine "two" 0')
+
+    def test_ndjson_action(self):
+        response = self.export_action("commentreport", "export_ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        report = json.loads(lines[0])
+        self.assertEqual(report["user__username"], "admin")
+        self.assertEqual(report["comment__body"], "Rude comment")
+
+    async def test_action_streams_under_asgi(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        response = await self.export_action(
+            "contactmessage", "export_ndjson", client
+        )
+        self.assertTrue(response.is_async)
+        lines = b"".join(
+            [block async for block in response.streaming_content]
+        ).splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_command_filters_by_date(self):
+        out = StringIO()
+        call_command(
+            "export_rows", "contactmessage", "--format", "ndjson",
+            "--since", (self.start + timedelta(hours=12)).isoformat(),
+            stdout=out,
+        )
+        names = [
+            json.loads(line)["name"] for line in out.getvalue().splitlines()
+        ]
+        self.assertEqual(names, ["Visitor 1", "Visitor 2"])
+
+    def test_csv_neutralises_formulas(self):
+        ContactMessage.objects.all().delete()
+        payloads = [
+            '=HYPERLINK("http://evil.example","x")', "+1", "-1", "@SUM(A1)",
+            "\tTabbed", "\rReturn", "Plain = text",
+        ]
+        for i, payload in enumerate(payloads):
+            ContactMessage.objects.create(
+                name=payload, email=f"v{i}@example.com", message=payload,
+            )
+        csv_rows = list(csv.reader(
+            b"".join(
+                export_blocks(ContactMessage.objects.all(), "csv")
+            ).decode().splitlines(True)
+        ))[1:]
+        self.assertEqual(
+            [row[1] for row in csv_rows],
+            ["'" + payload for payload in payloads[:-1]] + ["Plain = text"],
+        )
+        self.assertEqual(
+            [row[3] for row in csv_rows], [row[1] for row in csv_rows]
+        )
+
+        ndjson = b"".join(
+            export_blocks(ContactMessage.objects.all(), "ndjson")
+        ).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["message"] for line in ndjson], payloads
+        )
+
+
+def resident_memory():
+    # Current, not peak, resident set size, so that growth during the
+    # export shows even if the process was larger at some earlier point.
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+@unittest.skipUnless(
+    os.path.exists("/proc/self/statm"), "Needs /proc to read RSS."
+)
+class ExportMemoryTest(TestCase):
+    """
+    Exports a million contact messages and checks the process does not
+    grow with them.
+
+    Methods:
+        setUpTestData: Inserts a million rows with one INSERT ... SELECT.
+        test_memory_stays_flat: Ensures resident memory grows by less
+        than 32 MiB over the whole export, where loading the rows would
+        take several hundred.
+    """
+    ROWS = 1000000
+
+    @classmethod
+    def setUpTestData(cls):
+        table = connection.ops.quote_name(ContactMessage._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "WITH RECURSIVE n(i) AS ("
+                "SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s) "
+                f"INSERT INTO {table} (name, email, message, created_at) "
+                "SELECT 'Visitor ' || i, 'visitor' || i || '@example.com', "
+                "'Message number ' || i, %s FROM n",
+                [cls.ROWS, timezone.now()],
+            )
+
+    def test_memory_stays_flat(self):
+        baseline = peak = resident_memory()
+        lines = 0
+        for number, block in enumerate(
+            export_blocks(ContactMessage.objects.all(), "csv")
+        ):
+            lines += block.count(b"\n")
+            if number % 16 == 0:
+                peak = max(peak, resident_memory())
+        self.assertEqual(lines, self.ROWS + 1)
+        self.assertLess(peak - baseline, 32 * 1024 * 1024)
+
+
+class SeedCommandTest(TestCase):
+    """
+    Tests for the seed_bullfit dataset generator.
+
+    Methods:
+        seed: Runs the command for a small dataset.
+        snapshot: Returns the seeded comments in a form that does not
+        depend on primary keys.
+        test_counts_and_derived_data: Ensures the requested rows are
+        created with their timestamps, counters and search index.
+        test_same_seed_same_data: Ensures a seed always produces the
+        same dataset, and a different seed a different one.
+        test_refuses_to_seed_twice: Ensures seeded users are not
+        duplicated.
+    """
+    def seed(self, seed=1):
+        call_command(
+            "seed_bullfit", users=20, exercises=10, comments=300,
+            reports=15, contact_messages=5, seed=seed, batch_size=64,
+            stdout=StringIO(),
+        )
+
+    def snapshot(self):
+        return list(
+            Comment.objects.order_by("created_on", "body").values_list(
+                "exercise__title", "user__username", "body", "created_on",
+                "approved",
+            )
+        )
+
+    def test_counts_and_derived_data(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Exercise.objects.count(), 10)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertEqual(CommentReport.objects.count(), 15)
+        self.assertEqual(ContactMessage.objects.count(), 5)
+        self.assertFalse(
+            ContactMessage.objects.filter(dedup_key=None).exists()
+        )
+        self.assertLess(
+            Comment.objects.latest("created_on").created_on.year, 2025
+        )
+        self.assertEqual(Exercise.objects.recount_comments(), 0)
+        exercise = Exercise.objects.order_by("-comment_count").first()
+        self.assertIn("<ol><li>", exercise.detailed_description1)
+        self.assertTrue(str(exercise.image).startswith("bullfit/seed/"))
+        # A few exercises draw most of the comments.
+        self.assertGreater(exercise.comment_count, 300 / 10)
+        # bulk_create() skips the signal, so the index is built after.
+        word = exercise.title.split()[0]
+        self.assertIn(exercise, Exercise.objects.search(word))
+
+    def test_same_seed_same_data(self):
+        self.seed()
+        first = self.snapshot()
+        User.objects.all().delete()
+        ContactMessage.objects.all().delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+        User.objects.all().delete()
+        ContactMessage.objects.all().delete()
+        self.seed(seed=2)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_refuses_to_seed_twice(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.assertEqual(User.objects.count(), 20)
+
+
+class BenchRequestsTest(TestCase):
+    """
+    Tests for the bench_requests latency benchmark.
+
+    Methods:
+        setUp: Seeds a small dataset.
+        bench: Runs the benchmark with a handful of requests per route.
+        test_reports_every_route_as_json: Ensures each route is measured
+        for both kinds of visitor and nothing is left behind.
+        test_baseline_regressions_fail: Ensures extra queries or slower
+        responses than the baseline fail the run.
+    """
+    def setUp(self):
+        call_command(
+            "seed_bullfit", users=10, exercises=8, comments=100,
+            reports=5, contact_messages=2, stdout=StringIO(),
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, "bench.json")
+
+    def bench(self, *args):
+        call_command(
+            "bench_requests", "--requests", "3", "--warmup", "1",
+            "--alloc-samples", "1", "--output", self.output, *args,
+            stdout=StringIO(),
+        )
+        with open(self.output) as file:
+            return json.load(file)
+
+    def test_reports_every_route_as_json(self):
+        routes = self.bench()["routes"]
+        for who in ("anonymous", "authenticated"):
+            for key in (
+                "home_page_1:GET", "exercise_detail:GET",
+                "add_comment:POST", "edit_comment:GET",
+                "delete_comment:POST", "report_comment:POST",
+                "contact_form:POST",
+            ):
+                result = routes[f"{who}:{key}"]
+                self.assertLessEqual(result["p50"], result["p99"])
+                self.assertEqual(sum(result["status"].values()), 3)
+        detail = routes["authenticated:exercise_detail:GET"]
+        self.assertEqual(detail["status"], {"200": 3})
+        self.assertGreater(detail["queries"], 0)
+        self.assertGreater(detail["bytes"], 0)
+        self.assertGreater(detail["peak_alloc_kib"], 0)
+        self.assertEqual(
+            routes["anonymous:add_comment:POST"]["status"], {"302": 3}
+        )
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertEqual(ContactMessage.objects.count(), 2)
+
+    def test_baseline_regressions_fail(self):
+        report = self.bench()
+        report["routes"]["authenticated:exercise_detail:GET"]["queries"] -= 1
+        report["routes"]["anonymous:login:GET"]["p50"] = 0.001
+        with open(self.output, "w") as file:
+            json.dump(report, file)
+        with self.assertRaisesMessage(CommandError, "queries") as caught:
+            self.bench("--baseline", self.output, "--min-delta-ms", "0")
+        self.assertIn("anonymous:login:GET: p50", str(caught.exception))
+
+
+class ContactFormProcessorTest(TestCase):
+    """
+    Tests for the lazy contact_form context processor.
+
+    Methods:
+        test_form_is_not_built_unless_used: Ensures rendering a page
+        that never touches contact_form does not build the form.
+        test_lazy_form_renders_like_a_form: Ensures the lazy value still
+        renders and exposes fields when a template uses it.
+    """
+    def test_form_is_not_built_unless_used(self):
+        response = self.client.get(reverse("home"))
+        self.assertIs(response.context["contact_form"]._wrapped, empty)
+
+    def test_lazy_form_renders_like_a_form(self):
+        form = LazyContactForm()
+        self.assertHTMLEqual(str(form), str(ContactMessageForm()))
+        self.assertIn('name="email"', str(form["email"]))
+        self.assertIsInstance(form._wrapped, ContactMessageForm)
+
+
+class ImageUrlServiceTest(TestCase):
+    """
+    Tests for the memoised Cloudinary image URL service.
+
+    Methods:
+        setUp: Empties the per-process LRU and the Django cache.
+        test_matches_cloudinary_output: Ensures the service builds the
+        same URL as CloudinaryImage.build_url.
+        test_urls_are_built_once: Ensures repeated lookups, including
+        from a fresh process LRU, reuse the cached URL.
+        test_key_covers_every_argument: Ensures different sizes, formats
+        and crops get different URLs.
+        test_webp_tag_accepts_resource_and_url: Ensures the webp tag
+        gives the same URL for a resource and its delivery URL.
+    """
+    def setUp(self):
+        clear_image_url_cache()
+        cache.clear()
+
+    def test_matches_cloudinary_output(self):
+        self.assertEqual(
+            image_url("sample", format="webp", width=250),
+            CloudinaryImage("sample").build_url(
+                format="webp", width=250, crop="fit"
+            ),
+        )
+        self.assertEqual(image_url(None), "")
+
+    def test_urls_are_built_once(self):
+        with mock.patch.object(
+            CloudinaryImage, "build_url", autospec=True, return_value="url"
+        ) as build_url:
+            for _ in range(3):
+                self.assertEqual(image_url("sample", width=250), "url")
+            clear_image_url_cache()
+            self.assertEqual(image_url("sample", width=250), "url")
+        self.assertEqual(build_url.call_count, 1)
+
+    def test_key_covers_every_argument(self):
+        urls = {
+            image_url("sample", width=250),
+            image_url("sample", width=500),
+            image_url("sample", width=250, height=250),
+            image_url("sample", format="jpg", width=250),
+            image_url("sample", width=250, crop="fill"),
+            image_url("other", width=250),
+        }
+        self.assertEqual(len(urls), 6)
+
+    def test_webp_tag_accepts_resource_and_url(self):
+        image = CloudinaryImage("sample")
+        self.assertEqual(webp(image, 250), webp(image.url, 250))
+        self.assertEqual(webp("", 250), "")
+
+
+@override_settings(
+    RESPONSIVE_IMAGE_WIDTHS=(640, 320),
+    RESPONSIVE_IMAGE_FORMATS=("avif", "webp", "jpg"),
+    RESPONSIVE_IMAGE_RATIO="4:3",
+)
+class PictureTagTest(TestCase):
+    """
+    Tests for the responsive picture template tag.
+
+    Methods:
+        test_sources_cover_formats_and_ladder: Ensures AVIF and WebP
+        sources and a JPEG fallback are emitted for every width.
+        test_img_has_explicit_dimensions: Ensures the img carries the
+        largest width and the height implied by the ratio.
+        test_overrides_and_escaping: Ensures ratio and widths can be
+        overridden per use and alt text is escaped.
+        test_missing_image_renders_nothing: Ensures an empty image
+        renders an empty string.
+    """
+    def test_sources_cover_formats_and_ladder(self):
+        html = picture(CloudinaryImage("sample"), alt="Squat")
+        self.assertIn('<source type="image/avif"', html)
+        self.assertIn('<source type="image/webp"', html)
+        self.assertEqual(html.count("<source"), 2)
+        self.assertIn(image_url(
+            "sample", format="avif", width=320, height=240, crop="fill"
+        ) + " 320w", html)
+        self.assertIn(image_url(
+            "sample", format="jpg", width=640, height=480, crop="fill"
+        ) + " 640w", html)
+
+    def test_img_has_explicit_dimensions(self):
+        html = picture(CloudinaryImage("sample"))
+        self.assertIn('width="640" height="480"', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_overrides_and_escaping(self):
+        html = picture(
+            CloudinaryImage("sample"), alt='"Bench" <press>', ratio="1:1",
+            widths="200,100", loading="eager",
+        )
+        self.assertIn('width="200" height="200"', html)
+        self.assertIn(" 100w", html)
+        self.assertNotIn(" 320w", html)
+        self.assertIn('alt="&quot;Bench&quot; &lt;press&gt;"', html)
+        self.assertIn('loading="eager"', html)
+
+    def test_missing_image_renders_nothing(self):
+        self.assertEqual(picture(None), "")
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "exercise_blog.cache_backends.TieredCache",
+            "OPTIONS": {"SHARED": "shared", "LOCAL_TIMEOUT": 60},
+        },
+        "shared": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "tiered-test",
+        },
+    }
+)
+class TieredCacheTest(TestCase):
+    """
+    Tests for the two-tier cache backend and the CACHE_URL parser.
+
+    Methods:
+        setUp: Clears both tiers.
+        test_reads_fill_the_local_tier: Ensures shared values are kept
+        in memory after the first read.
+        test_writes_reach_both_tiers: Ensures set, incr and delete
+        update the shared cache as well as memory.
+        test_add_uses_the_shared_tier: Ensures add() cannot be fooled by
+        a value only this process has seen.
+        test_parse_cache_url: Ensures each supported scheme maps to its
+        backend and location.
+    """
+    def setUp(self):
+        self.tiered = caches["default"]
+        self.shared = caches["shared"]
+        self.tiered.clear()
+
+    def test_reads_fill_the_local_tier(self):
+        self.shared.set("key", "value")
+        self.assertEqual(self.tiered.get("key"), "value")
+        self.shared.delete("key")
+        self.assertEqual(self.tiered.get("key"), "value")
+        self.assertEqual(
+            self.tiered.get_many(["key", "nope"]), {"key": "value"}
+        )
+
+    def test_writes_reach_both_tiers(self):
+        self.tiered.set_many({"a": 1, "b": 2})
+        self.assertEqual(self.shared.get_many(["a", "b"]), {"a": 1, "b": 2})
+        self.assertEqual(self.tiered.incr("a"), 2)
+        self.assertEqual(self.shared.get("a"), 2)
+        self.assertEqual(self.tiered.get("a"), 2)
+        self.tiered.delete("b")
+        self.assertIsNone(self.shared.get("b"))
+        self.assertIsNone(self.tiered.get("b"))
+
+    def test_add_uses_the_shared_tier(self):
+        self.tiered.set("lock", 1)
+        self.shared.delete("lock")
+        self.assertTrue(self.tiered.add("lock", 2))
+        self.assertFalse(self.tiered.add("lock", 3))
+        self.assertEqual(self.tiered.get("lock"), 2)
+
+    def test_parse_cache_url(self):
+        self.assertEqual(
+            parse_cache_url("redis://cache:6379/1"),
+            {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": "redis://cache:6379/1",
+            },
+        )
+        self.assertEqual(
+            parse_cache_url("memcached://a:11211,b:11211")["LOCATION"],
+            ["a:11211", "b:11211"],
+        )
+        self.assertEqual(
+            parse_cache_url("file:///tmp/bullfit")["LOCATION"],
+            "/tmp/bullfit",
+        )
+        self.assertEqual(parse_cache_url("locmem://x")["LOCATION"], "x")
+        with self.assertRaises(ValueError):
+            parse_cache_url("ftp://nope")
+
+
 #
 # View Tests
 #
@@ -245,6 +947,8 @@ class ExerciseViewTest(TestCase):
         exercise list view response and content.
         test_exercise_detail_view: Validates the
         exercise detail view response and content.
+        test_draft_exercises_are_not_public: Ensures drafts are left out
+        of the list and detail views but stay visible to the admin.
         test_add_comment_view: Tests adding a comment as an authenticated user.
         test_add_comment_view_unauthenticated: Tests adding a
         comment when the user is not authenticated.
@@ -286,6 +990,21 @@ class ExerciseViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Test Exercise")
 
+    def test_draft_exercises_are_not_public(self):
+        draft = Exercise.objects.create(
+            title="Draft Exercise",
+            description="This is a draft.",
+            author=self.user,
+        )
+        response = self.client.get(reverse("home"))
+        self.assertNotContains(response, "Draft Exercise")
+        response = self.client.get(
+            reverse("exercise_detail", args=[draft.pk])
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn(draft, Exercise.published.all())
+        self.assertIn(draft, Exercise.objects.all())
+
     def test_add_comment_view(self):
         self.client.login(username="testuser", password="password")
         response = self.client.post(
@@ -423,6 +1142,1844 @@ class ExerciseViewTest(TestCase):
         self.assertContains(response, "This field is required.")
 
 
+class CommentCounterTest(TestCase):
+    """
+    Tests for the denormalised comment counters on Exercise.
+
+    Methods:
+        setUp: Creates a test client, user and exercise and logs in.
+        counts: Returns the stored (comment_count,
+        approved_comment_count) of the exercise.
+        test_add_and_delete_comment_update_counts: Ensures the views
+        keep comment_count in step.
+        test_admin_approval_updates_counts: Ensures approving and
+        deleting through CommentAdmin adjusts approved_comment_count.
+        test_exercise_save_does_not_overwrite_counts: Ensures saving a
+        stale Exercise instance keeps the stored counters.
+        test_reconcile_command_repairs_drift: Ensures the management
+        command recounts drifted exercises.
+        test_counts_render_without_queries: Ensures the list and detail
+        pages show the counts with no extra queries.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise",
+            description="This is a test exercise.",
+            author=self.user,
+            status=1,
+        )
+        self.client.force_login(self.user)
+
+    def counts(self):
+        self.exercise.refresh_from_db()
+        return (
+            self.exercise.comment_count,
+            self.exercise.approved_comment_count,
+        )
+
+    def test_add_and_delete_comment_update_counts(self):
+        self.client.post(
+            reverse("add_comment", args=[self.exercise.pk]),
+            {"body": "A comment"},
+        )
+        self.assertEqual(self.counts(), (1, 0))
+        comment = Comment.objects.get()
+        self.client.post(
+            reverse("delete_comment", args=[self.exercise.pk, comment.pk])
+        )
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_admin_approval_updates_counts(self):
+        self.client.post(
+            reverse("add_comment", args=[self.exercise.pk]),
+            {"body": "A comment"},
+        )
+        comment = Comment.objects.get()
+        change_url = reverse(
+            "admin:exercises_comment_change", args=[comment.pk]
+        )
+        data = {
+            "exercise": self.exercise.pk,
+            "user": self.user.pk,
+            "body": comment.body,
+            "approved": "on",
+        }
+        response = self.client.post(change_url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), (1, 1))
+
+        response = self.client.post(
+            reverse("admin:exercises_comment_changelist"),
+            {
+                "action": "delete_selected",
+                "_selected_action": [comment.pk],
+                "post": "yes",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_exercise_save_does_not_overwrite_counts(self):
+        stale = Exercise.objects.get(pk=self.exercise.pk)
+        Exercise.objects.filter(pk=self.exercise.pk).adjust_comment_counts(
+            comments=2, approved=1
+        )
+        stale.title = "Renamed"
+        stale.save()
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertEqual(self.exercise.title, "Renamed")
+
+    def test_reconcile_command_repairs_drift(self):
+        Comment.objects.bulk_create(
+            Comment(
+                exercise=self.exercise,
+                user=self.user,
+                body="Imported",
+                approved=bool(i % 2),
+            )
+            for i in range(5)
+        )
+        self.assertEqual(self.counts(), (0, 0))
+        out = StringIO()
+        call_command("reconcile_comment_counts", batch_size=1, stdout=out)
+        self.assertEqual(self.counts(), (5, 2))
+        self.assertIn("corrected 1", out.getvalue())
+
+    def test_counts_render_without_queries(self):
+        self.client.logout()
+        Exercise.objects.filter(pk=self.exercise.pk).adjust_comment_counts(
+            comments=3, approved=2
+        )
+        # The page itself, its COUNT(*) and the ETag lookup.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("home"))
+        self.assertContains(response, "2 comments")
+        response = self.client.get(
+            reverse("exercise_detail", args=[self.exercise.pk])
+        )
+        # Anonymous visitors only see the approved comments.
+        self.assertContains(response, "Comments (2)")
+
+
+class ExerciseFragmentCacheTest(TestCase):
+    """
+    Tests for the cached exercise body and comment list fragments.
+
+    Methods:
+        setUp: Clears the cache and creates two users, an exercise and
+        a comment by the first user.
+        detail: Fetches the exercise detail page.
+        test_repeat_visit_is_served_from_cache: Ensures a second visit
+        does not query the comments.
+        test_owner_controls_are_per_viewer: Ensures the shared fragment
+        only shows Edit/Delete to the comment's author.
+        test_comment_changes_invalidate_fragments: Ensures adding,
+        unapproving, approving and deleting comments refreshes the list.
+        test_exercise_changes_invalidate_fragments: Ensures editing the
+        exercise refreshes its body.
+        test_invalidated_on_commit: Ensures the cache version only moves
+        on once the change is committed.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.other_user = User.objects.create_user(
+            username="otheruser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise",
+            description="This is a test exercise.",
+            detailed_description1="Original body",
+            author=self.user,
+            status=1,
+        )
+        self.comment = Comment.objects.create(
+            exercise=self.exercise,
+            user=self.user,
+            body="First comment",
+            approved=True,
+        )
+        self.edit_url = reverse(
+            "edit_comment", args=[self.exercise.pk, self.comment.pk]
+        )
+
+    def detail(self):
+        return self.client.get(
+            reverse("exercise_detail", args=[self.exercise.pk])
+        )
+
+    def test_repeat_visit_is_served_from_cache(self):
+        self.detail()
+        # The ETag lookup and the exercise itself.
+        with self.assertNumQueries(2):
+            response = self.detail()
+        self.assertContains(response, "First comment")
+        self.assertContains(response, "Original body")
+
+    def test_owner_controls_are_per_viewer(self):
+        self.assertNotContains(self.detail(), self.edit_url)
+        self.client.force_login(self.other_user)
+        self.assertNotContains(self.detail(), self.edit_url)
+        self.client.force_login(self.user)
+        self.assertContains(self.detail(), self.edit_url)
+
+    def test_comment_changes_invalidate_fragments(self):
+        self.assertContains(self.detail(), "First comment")
+        self.comment.approved = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.save()
+        self.assertNotContains(self.detail(), "First comment")
+        self.comment.approved = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.save()
+        self.assertContains(self.detail(), "First comment")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                exercise=self.exercise,
+                user=self.other_user,
+                body="Second",
+                approved=True,
+            )
+        self.assertContains(self.detail(), "Second")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.delete()
+        self.assertNotContains(self.detail(), "First comment")
+
+    def test_exercise_changes_invalidate_fragments(self):
+        self.detail()
+        self.exercise.detailed_description1 = "Updated body"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.save()
+        response = self.detail()
+        self.assertContains(response, "Updated body")
+        self.assertNotContains(response, "Original body")
+
+    def test_invalidated_on_commit(self):
+        version = get_exercise_version(self.exercise.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.title = "Renamed"
+            self.exercise.save()
+            Comment.objects.create(
+                exercise=self.exercise,
+                user=self.other_user,
+                body="Second",
+                approved=True,
+            )
+            # Readers of the old rows must not get to the new version.
+            self.assertEqual(get_exercise_version(self.exercise.pk), version)
+        self.assertNotEqual(get_exercise_version(self.exercise.pk), version)
+
+
+@override_settings(EXERCISE_COMMENTS_PER_PAGE=4)
+class CommentPagingTest(TestCase):
+    """
+    Tests for the first page of comments on the exercise page and the
+    exercise_comments endpoint that serves the rest.
+
+    Methods:
+        setUp: Creates two users and an exercise with ten approved
+        comments that share a timestamp, and a pending one.
+        next_url: Returns the "load more" URL in a page, or None.
+        bodies: Returns the approved comments listed in a page.
+        test_first_page_is_limited: Ensures the exercise page only
+        ships the first page, oldest first.
+        test_pages_walk_the_thread: Ensures following the cursors lists
+        every approved comment once, in order.
+        test_pending_comments_are_only_shown_to_their_author: Ensures
+        an unapproved comment is shown to its author and nobody else.
+        test_invalid_cursor_is_not_found: Ensures a tampered cursor or
+        an unpublished exercise returns 404.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.other_user = User.objects.create_user(
+            username="otheruser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.user, status=1,
+        )
+        Comment.objects.bulk_create(
+            Comment(
+                exercise=self.exercise, user=self.other_user,
+                body=f"Approved {i:02d}", approved=True,
+            )
+            for i in range(10)
+        )
+        # Ties on created_on must be broken by the id.
+        Comment.objects.update(created_on=timezone.now())
+        self.pending = Comment.objects.create(
+            exercise=self.exercise, user=self.user, body="Pending mine"
+        )
+        Exercise.objects.recount_comments()
+
+    def next_url(self, response):
+        match = re.search(
+            r'data-next-url="([^"]+)"', response.content.decode()
+        )
+        return unescape(match.group(1)) if match else None
+
+    def bodies(self, response):
+        return re.findall(r"Approved \d\d", response.content.decode())
+
+    def test_first_page_is_limited(self):
+        response = self.client.get(
+            reverse("exercise_detail", args=[self.exercise.pk])
+        )
+        self.assertEqual(
+            self.bodies(response), [f"Approved {i:02d}" for i in range(4)]
+        )
+        self.assertTrue(
+            self.next_url(response).startswith(
+                reverse("exercise_comments", args=[self.exercise.pk])
+            )
+        )
+
+    def test_pages_walk_the_thread(self):
+        seen = []
+        url = reverse("exercise_comments", args=[self.exercise.pk])
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += self.bodies(response)
+            url = self.next_url(response)
+        self.assertEqual(seen, [f"Approved {i:02d}" for i in range(10)])
+
+    def test_pending_comments_are_only_shown_to_their_author(self):
+        url = reverse("exercise_detail", args=[self.exercise.pk])
+        self.assertNotContains(self.client.get(url), "Pending mine")
+        self.client.force_login(self.other_user)
+        self.assertNotContains(self.client.get(url), "Pending mine")
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertContains(response, "Pending mine")
+        self.assertContains(
+            response,
+            reverse("edit_comment", args=[self.exercise.pk, self.pending.pk]),
+        )
+
+    def test_invalid_cursor_is_not_found(self):
+        url = reverse("exercise_comments", args=[self.exercise.pk])
+        response = self.client.get(url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+        Exercise.objects.filter(pk=self.exercise.pk).update(status=0)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ConditionalGetTest(TestCase):
+    """
+    Tests for ETag/Last-Modified revalidation of the exercise pages.
+
+    Methods:
+        setUp: Creates two users and a published exercise.
+        revalidate: Fetches a URL, then fetches it again with the
+        validators of the first response.
+        test_detail_revalidates_with_304: Ensures a repeat visit gets an
+        empty 304 without rendering.
+        test_detail_changes_with_content: Ensures editing the exercise
+        or approving a comment changes the validators.
+        test_validators_are_per_viewer: Ensures one user's ETag is not
+        valid for another and signed in pages are private.
+        test_pending_messages_force_render: Ensures pages with messages
+        to show are never answered with 304.
+        test_list_revalidates_and_tracks_changes: Ensures the list page
+        is revalidated and changes when an exercise is published.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.other_user = User.objects.create_user(
+            username="otheruser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise",
+            description="Test",
+            author=self.user,
+            status=1,
+        )
+        self.url = reverse("exercise_detail", args=[self.exercise.pk])
+
+    def revalidate(self, url, first=None):
+        first = first or self.client.get(url)
+        return first, self.client.get(
+            url,
+            HTTP_IF_NONE_MATCH=first["ETag"],
+            HTTP_IF_MODIFIED_SINCE=first["Last-Modified"],
+        )
+
+    def test_detail_revalidates_with_304(self):
+        self.client.get(self.url)  # sets the CSRF cookie
+        first, second = self.revalidate(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("no-cache", first["Cache-Control"])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b"")
+        self.assertEqual(second["ETag"], first["ETag"])
+        with self.assertNumQueries(1):
+            self.revalidate(self.url, first)
+
+    def test_detail_changes_with_content(self):
+        self.client.get(self.url)
+        first = self.client.get(self.url)
+        Exercise.objects.filter(pk=self.exercise.pk).update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+        Comment.objects.bulk_create(
+            [Comment(exercise=self.exercise, user=self.user, body="Hi",
+                     approved=True)]
+        )
+        _, second = self.revalidate(self.url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+        self.exercise.title = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.save()
+        _, third = self.revalidate(self.url, second)
+        self.assertEqual(third.status_code, 200)
+        self.assertContains(third, "Renamed")
+
+    def test_validators_are_per_viewer(self):
+        self.client.login(username="testuser", password="password")
+        self.client.get(self.url)
+        first = self.client.get(self.url)
+        self.assertIn("private", first["Cache-Control"])
+
+        self.client.login(username="otheruser", password="password")
+        _, second = self.revalidate(self.url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+    def test_pending_messages_force_render(self):
+        self.client.login(username="testuser", password="password")
+        self.client.get(self.url)
+        first = self.client.get(self.url)
+        self.client.post(
+            reverse("add_comment", args=[self.exercise.pk]),
+            {"body": "New comment"},
+        )
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+        self.assertContains(response, "awaiting approval")
+
+    def test_list_revalidates_and_tracks_changes(self):
+        home = reverse("home")
+        self.client.get(home)
+        first, second = self.revalidate(home)
+        self.assertEqual(second.status_code, 304)
+
+        Exercise.objects.create(
+            title="Another", description="Test", author=self.user, status=1
+        )
+        _, third = self.revalidate(home, first)
+        self.assertEqual(third.status_code, 200)
+        self.assertContains(third, "Another")
+
+
+@override_settings(ANONYMOUS_PAGE_CACHE_TIMEOUT=60)
+class AnonymousPageCacheTest(TestCase):
+    """
+    Tests for the anonymous full-page cache middleware.
+
+    Methods:
+        setUp: Clears the cache and creates a user and an exercise.
+        test_repeat_visit_skips_the_database: Ensures a cached page is
+        served without queries or cookies.
+        test_signals_purge_pages: Ensures comment and exercise changes
+        purge the detail and home pages.
+        test_key_uses_path_and_page: Ensures pages are keyed on the
+        page parameter but not on unrelated ones.
+        test_personal_requests_bypass_cache: Ensures signed in visitors
+        and visitors with messages are never served cached pages.
+        test_revalidation_of_cached_page: Ensures a cached page still
+        answers If-None-Match with 304.
+        test_concurrent_miss_serves_stale_copy: Ensures a request that
+        finds another rendering the page gets the previous copy.
+        test_concurrent_miss_waits_without_stale_copy: Ensures such a
+        request waits for the fresh copy instead of rendering.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise",
+            description="Test",
+            detailed_description1="Original body",
+            author=self.user,
+            status=1,
+        )
+        self.url = reverse("exercise_detail", args=[self.exercise.pk])
+
+    def test_repeat_visit_skips_the_database(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first["X-Page-Cache"], "miss")
+        self.assertFalse(first.cookies)
+        self.assertContains(first, "to leave a comment")
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second["X-Page-Cache"], "hit")
+        self.assertEqual(second.content, first.content)
+
+    def test_signals_purge_pages(self):
+        self.client.get(self.url)
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(
+                exercise=self.exercise, user=self.user,
+                body="Fresh comment", approved=True,
+            )
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "Fresh comment")
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response["X-Page-Cache"], "miss")
+
+        self.exercise.title = "Renamed Exercise"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.save()
+        self.assertContains(self.client.get(self.url), "Renamed Exercise")
+        self.assertContains(self.client.get(reverse("home")), "Renamed")
+
+    def test_key_uses_path_and_page(self):
+        home = reverse("home")
+        self.client.get(home, {"page": 1})
+        response = self.client.get(home, {"page": 1, "utm_source": "x"})
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        response = self.client.get(home)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+
+    def test_personal_requests_bypass_cache(self):
+        self.client.get(self.url)
+        self.client.login(username="testuser", password="password")
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header("X-Page-Cache"))
+        self.assertContains(response, "Leave a Comment")
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+
+        anonymous = Client()
+        anonymous.cookies["messages"] = "pending"
+        response = anonymous.get(self.url)
+        self.assertFalse(response.has_header("X-Page-Cache"))
+
+    def test_revalidation_of_cached_page(self):
+        first = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+
+    def hold_render_lock(self):
+        middleware = AnonymousPageCacheMiddleware(None)
+        request = RequestFactory().get(self.url)
+        key, _ = middleware.cache_keys(request)
+        cache.add(f"{key}:lock", 1)
+
+    def test_concurrent_miss_serves_stale_copy(self):
+        self.client.get(self.url)
+        self.exercise.detailed_description1 = "Updated body"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exercise.save()
+        self.hold_render_lock()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response["X-Page-Cache"], "stale")
+        self.assertContains(response, "Original body")
+
+    @mock.patch("exercises.middleware.WAIT_TIMEOUT", 0.1)
+    def test_concurrent_miss_waits_without_stale_copy(self):
+        self.hold_render_lock()
+        with mock.patch("exercises.middleware.time.sleep") as sleep:
+            response = self.client.get(self.url)
+        self.assertTrue(sleep.called)
+        self.assertFalse(response.has_header("X-Page-Cache"))
+        self.assertContains(response, "Original body")
+
+
+@override_settings(EXERCISE_LIST_CURSOR_PAGINATION=True)
+class ExerciseListCursorPaginationTest(TestCase):
+    """
+    Tests for the keyset (cursor) mode of the exercise list.
+
+    Methods:
+        setUp: Creates a test user and fourteen exercises, two of which
+        share a title so the id tie-breaker is exercised.
+        collect_titles: Follows NEXT links from a URL and returns the
+        titles of every exercise seen.
+        test_first_page_skips_count: Ensures the first cursor page runs
+        a single page query and no COUNT(*).
+        test_next_links_walk_every_exercise: Ensures following NEXT
+        links lists each exercise exactly once, in title order.
+        test_previous_link_returns_to_previous_page: Ensures PREV goes
+        back to the exercises of the page before.
+        test_legacy_page_number_still_resolves: Ensures ?page=N links
+        keep working and hand over to cursors.
+        test_invalid_cursor_returns_404: Ensures a tampered token is
+        rejected.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        titles = [f"Exercise {i:02d}" for i in range(12)]
+        titles += ["Exercise 05", "Exercise 05"]
+        for title in titles:
+            Exercise.objects.create(
+                title=title, description="Test", author=self.user, status=1
+            )
+        self.expected = list(
+            Exercise.objects.order_by("title", "id").values_list(
+                "title", flat=True
+            )
+        )
+
+    def collect_titles(self, url):
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.context["page_obj"]
+            titles += [exercise.title for exercise in page]
+            url = (
+                reverse("home") + "?cursor=" + page.next_cursor
+                if page.has_next()
+                else None
+            )
+        return titles
+
+    def test_first_page_skips_count(self):
+        # The page itself and the ETag lookup.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("home"))
+        self.assertEqual(len(response.context["exercises"]), 6)
+        self.assertTrue(response.context["is_paginated"])
+        self.assertContains(response, "?cursor=")
+
+    def test_next_links_walk_every_exercise(self):
+        self.assertEqual(self.collect_titles(reverse("home")), self.expected)
+
+    def test_previous_link_returns_to_previous_page(self):
+        first = self.client.get(reverse("home")).context["page_obj"]
+        second = self.client.get(
+            reverse("home"), {"cursor": first.next_cursor}
+        ).context["page_obj"]
+        back = self.client.get(
+            reverse("home"), {"cursor": second.previous_cursor}
+        ).context["page_obj"]
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+
+    def test_legacy_page_number_still_resolves(self):
+        response = self.client.get(reverse("home"), {"page": 2})
+        self.assertEqual(response.status_code, 200)
+        page = response.context["page_obj"]
+        self.assertEqual(
+            [exercise.title for exercise in page], self.expected[6:12]
+        )
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+        self.assertEqual(
+            self.collect_titles(reverse("home") + "?page=2"),
+            self.expected[6:],
+        )
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse("home"), {"cursor": "nonsense"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExerciseSummaryTest(TestCase):
+    """
+    Tests for the summary projection used by listings and the admin.
+
+    Methods:
+        setUp: Creates a superuser and an exercise with long HTML
+        descriptions.
+        test_list_defers_descriptions: Ensures the public list loads
+        neither detailed description.
+        test_admin_changelist_shows_previews: Ensures the changelist
+        shows short plain-text previews cut in SQL.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", password="password", email="a@example.com"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Deadlift",
+            description="Hinge",
+            detailed_description1="<p>" + "Brace your core. " * 500 + "</p>",
+            detailed_description2="<p>Short</p>",
+            author=self.user,
+            status=1,
+        )
+
+    def test_list_defers_descriptions(self):
+        response = self.client.get(reverse("home"))
+        exercise = response.context["exercises"][0]
+        self.assertEqual(
+            exercise.get_deferred_fields(),
+            {
+                "author_id",
+                "detailed_description1",
+                "detailed_description2",
+                "top_row_image",
+                "bottom_row_image",
+                "search_vector",
+            },
+        )
+        self.assertContains(response, "Deadlift")
+
+    def test_admin_changelist_shows_previews(self):
+        self.client.login(username="admin", password="password")
+        response = self.client.get(
+            reverse("admin:exercises_exercise_changelist")
+        )
+        row = response.context["cl"].result_list[0]
+        self.assertIn("detailed_description1", row.get_deferred_fields())
+        self.assertEqual(len(row.detailed_description1_preview), 101)
+        self.assertContains(response, "Brace your core. Brace")
+        self.assertContains(response, "\u2026")
+        self.assertNotContains(response, "&lt;p&gt;")
+        self.assertNotContains(response, "Brace your core. " * 10)
+
+
+class ExerciseSearchTest(TestCase):
+    """
+    Tests for full-text search (the FTS5 fallback under SQLite).
+
+    Methods:
+        setUp: Creates a staff user, filler exercises and three
+        exercises mentioning squats in different fields.
+        titles: Returns the titles of a search's results, in order.
+        test_title_matches_rank_first: Ensures title matches outrank
+        description and body matches.
+        test_html_is_stripped: Ensures body text is searchable but its
+        markup and entities are not.
+        test_index_follows_edits_and_deletes: Ensures the signal keeps
+        the index current.
+        test_search_view_lists_published_matches: Ensures /search/ only
+        shows published exercises.
+        test_query_syntax_is_not_interpreted: Ensures FTS5 operators in
+        user input are treated as plain words.
+        test_admin_search_uses_index: Ensures the admin changelist
+        search goes through the index.
+        test_rebuild_command_indexes_bulk_created_rows: Ensures
+        rebuild_search_index picks up rows created without signals.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", password="password", email="a@example.com"
+        )
+        for i in range(10):
+            Exercise.objects.create(
+                title=f"Filler {i}", description="Other", author=self.user
+            )
+        self.body_match = Exercise.objects.create(
+            title="Goblet hold",
+            description="Hold a kettlebell",
+            detailed_description1="<p>Then <strong>squat</strong>&nbsp;down"
+            "</p>",
+            author=self.user,
+            status=1,
+        )
+        self.description_match = Exercise.objects.create(
+            title="Lunge",
+            description="Pairs well with squats",
+            author=self.user,
+            status=1,
+        )
+        self.title_match = Exercise.objects.create(
+            title="Back Squat",
+            description="Legs",
+            author=self.user,
+            status=1,
+        )
+
+    def titles(self, text, queryset=None):
+        queryset = Exercise.objects if queryset is None else queryset
+        return [exercise.title for exercise in queryset.search(text)]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(
+            self.titles("squat"), ["Back Squat", "Lunge", "Goblet hold"]
+        )
+
+    def test_html_is_stripped(self):
+        self.assertEqual(self.titles("down"), ["Goblet hold"])
+        self.assertEqual(self.titles("strong"), [])
+        self.assertEqual(self.titles("nbsp"), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.title_match.title = "Front Raise"
+        self.title_match.save()
+        self.assertEqual(self.titles("raise"), ["Front Raise"])
+        self.assertNotIn("Front Raise", self.titles("squat"))
+        self.title_match.delete()
+        self.assertEqual(self.titles("raise"), [])
+
+    def test_search_view_lists_published_matches(self):
+        self.description_match.status = 0
+        self.description_match.save()
+        response = self.client.get(reverse("search"), {"q": "squat"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [exercise.title for exercise in response.context["exercises"]],
+            ["Back Squat", "Goblet hold"],
+        )
+        self.assertEqual(response.context["query"], "squat")
+
+        response = self.client.get(reverse("search"))
+        self.assertEqual(len(response.context["exercises"]), 0)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.titles('"back (squat*'), ["Back Squat"])
+        self.assertEqual(self.titles("NEAR("), [])
+
+    def test_admin_search_uses_index(self):
+        self.client.login(username="admin", password="password")
+        with self.assertNumQueries(5) as queries:
+            response = self.client.get(
+                reverse("admin:exercises_exercise_changelist"), {"q": "down"}
+            )
+        results = response.context["cl"].result_list
+        self.assertEqual([result.title for result in results], ["Goblet hold"])
+        sql = " ".join(query["sql"] for query in queries.captured_queries)
+        self.assertIn("MATCH", sql)
+        self.assertNotIn("LIKE", sql)
+
+    def test_rebuild_command_indexes_bulk_created_rows(self):
+        Exercise.objects.bulk_create(
+            [Exercise(title="Deadlift", description="Hinge", author=self.user)]
+        )
+        self.assertEqual(self.titles("deadlift"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.titles("deadlift"), ["Deadlift"])
+        self.assertEqual(
+            self.titles("squat"), ["Back Squat", "Lunge", "Goblet hold"]
+        )
+
+
+class CommentReportThrottleTest(TestCase):
+    """
+    Tests for deduplicated comment reports and the report rate limit.
+
+    Methods:
+        setUp: Clears the cache and creates a user, an exercise and a
+        comment, and logs the user in.
+        report: Posts a report on the comment.
+        test_reporting_again_keeps_one_row: Ensures a repeat report
+        updates the reason instead of adding a row.
+        test_user_bucket_returns_429: Ensures reports beyond the burst
+        are refused with a JSON 429 and a Retry-After header.
+        test_bucket_refills: Ensures tokens are earned back over time.
+        test_client_ip_honours_num_proxies: Ensures X-Forwarded-For is
+        only trusted as far as the configured proxies.
+    """
+    def setUp(self):
+        cache.clear()
+        caches["shared"].clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.user, status=1,
+        )
+        self.comment = Comment.objects.create(
+            exercise=self.exercise, user=self.user, body="Comment"
+        )
+        self.client.force_login(self.user)
+
+    def report(self, reason="Spam"):
+        return self.client.post(
+            reverse("report_comment", args=[self.comment.pk]),
+            {"reason": reason, "comment_text": self.comment.body},
+        )
+
+    def test_reporting_again_keeps_one_row(self):
+        self.assertEqual(self.report("Spam").status_code, 200)
+        self.assertEqual(self.report("Abusive").status_code, 200)
+        report = CommentReport.objects.get()
+        self.assertEqual(report.reason, "Abusive")
+
+    @override_settings(
+        THROTTLE_RATES={"report_comment": {"user": (2, 60)}}
+    )
+    def test_user_bucket_returns_429(self):
+        self.assertEqual(self.report().status_code, 200)
+        self.assertEqual(self.report().status_code, 200)
+        response = self.report()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "60")
+        self.assertEqual(response.json()["retry_after"], 60)
+        self.assertIn("too quickly", response.json()["message"])
+
+    @override_settings(THROTTLE_CACHE_ALIAS="shared")
+    def test_bucket_refills(self):
+        bucket = TokenBucket("test", capacity=2, refill=10)
+        with mock.patch("exercises.throttle.time.time") as now:
+            now.return_value = 1000.0
+            self.assertEqual(bucket.consume("a"), 0)
+            self.assertEqual(bucket.consume("a"), 0)
+            self.assertEqual(bucket.consume("a"), 10)
+            self.assertEqual(bucket.consume("b"), 0)
+            now.return_value = 1004.0
+            self.assertAlmostEqual(bucket.consume("a"), 6)
+            now.return_value = 1010.0
+            self.assertEqual(bucket.consume("a"), 0)
+
+    def test_client_ip_honours_num_proxies(self):
+        request = RequestFactory().get(
+            "/",
+            REMOTE_ADDR="10.0.0.1",
+            HTTP_X_FORWARDED_FOR="6.6.6.6, 1.2.3.4",
+        )
+        self.assertEqual(client_ip(request), "10.0.0.1")
+        with override_settings(NUM_PROXIES=1):
+            self.assertEqual(client_ip(request), "1.2.3.4")
+
+
+@override_settings(
+    THROTTLE_RATES={"report_comment": {"user": (3, 60), "ip": (10, 60)}}
+)
+class CommentReportConcurrencyTest(TransactionTestCase):
+    """
+    Fires parallel reports from one user at one comment.
+
+    Methods:
+        setUp: Clears the cache and creates a user, an exercise and a
+        comment.
+        test_parallel_reports: Ensures twenty simultaneous reports
+        leave one row, and that only the burst allowed by the throttle
+        reaches the database.
+    """
+    def setUp(self):
+        cache.clear()
+        caches["shared"].clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.user, status=1,
+        )
+        self.comment = Comment.objects.create(
+            exercise=exercise, user=self.user, body="Comment"
+        )
+
+    def test_parallel_reports(self):
+        client = Client()
+        client.force_login(self.user)
+        cookies = client.cookies
+        url = reverse("report_comment", args=[self.comment.pk])
+        start = threading.Barrier(20)
+
+        def report(i):
+            thread_client = Client()
+            thread_client.cookies = cookies
+            start.wait()
+            try:
+                with CaptureQueriesContext(connection) as captured:
+                    response = thread_client.post(
+                        url, {"reason": f"Spam {i}", "comment_text": "x"}
+                    )
+                writes = [
+                    query for query in captured.captured_queries
+                    if "exercises_commentreport" in query["sql"]
+                ]
+                return response.status_code, len(writes)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(report, range(20)))
+
+        statuses = [status for status, _ in results]
+        self.assertEqual(CommentReport.objects.count(), 1)
+        self.assertLessEqual(statuses.count(200), 3)
+        self.assertGreaterEqual(statuses.count(200), 1)
+        self.assertEqual(statuses.count(200) + statuses.count(429), 20)
+        self.assertLessEqual(sum(writes for _, writes in results), 3)
+
+
+class AsyncViewTest(TestCase):
+    """
+    Tests for the async views and middleware as served over ASGI.
+
+    AsyncClient runs the middleware stack in async mode, so any query
+    made from the event loop fails these tests.
+
+    Methods:
+        setUp: Clears the cache and creates a user, an exercise and a
+        comment, and an async client.
+        test_exercise_detail: Ensures the detail page renders for
+        anonymous and signed-in visitors and revalidates with 304.
+        test_report_comment: Ensures a report is filed and a missing
+        comment is a 404.
+        test_contact_form: Ensures a contact message is saved and the
+        form renders for a signed-in user.
+        test_page_cache: Ensures the page cache serves hits on the
+        event loop.
+        test_static_files_stream_async: Ensures WhiteNoise files are
+        read in blocks rather than buffered.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.user, status=1,
+        )
+        self.comment = Comment.objects.create(
+            exercise=self.exercise, user=self.user, body="Pending mine"
+        )
+        self.client = AsyncClient()
+        self.url = reverse("exercise_detail", args=[self.exercise.pk])
+
+    async def test_exercise_detail(self):
+        response = await self.client.get(self.url)
+        self.assertContains(response, "Test Exercise")
+        self.assertNotContains(response, "Pending mine")
+        revalidated = await self.client.get(
+            self.url, headers={"if-none-match": response["ETag"]}
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+        await sync_to_async(self.client.force_login)(self.user)
+        response = await self.client.get(self.url)
+        self.assertContains(response, "Pending mine")
+        self.assertIn("private", response["Cache-Control"])
+
+    async def test_report_comment(self):
+        await sync_to_async(self.client.force_login)(self.user)
+        response = await self.client.post(
+            reverse("report_comment", args=[self.comment.pk]),
+            {"reason": "Spam", "comment_text": "x"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            await CommentReport.objects.filter(user=self.user).aexists()
+        )
+        response = await self.client.get(
+            reverse("report_comment", args=[self.comment.pk + 1])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_contact_form(self):
+        response = await self.client.post(
+            reverse("contact_form"),
+            {"name": "A", "email": "a@example.com", "message": "Hi"},
+        )
+        self.assertRedirects(
+            response, reverse("home"), fetch_redirect_response=False
+        )
+        self.assertEqual(await ContactMessage.objects.acount(), 1)
+
+        # Rendering reads the signed-in visitor's session for messages.
+        await sync_to_async(self.client.force_login)(self.user)
+        response = await self.client.get(reverse("contact_form"))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ANONYMOUS_PAGE_CACHE_TIMEOUT=60)
+    async def test_page_cache(self):
+        first = await self.client.get(self.url)
+        second = await self.client.get(self.url)
+        self.assertEqual(first["X-Page-Cache"], "miss")
+        self.assertEqual(second["X-Page-Cache"], "hit")
+        self.assertEqual(first.content, second.content)
+
+    async def test_static_files_stream_async(self):
+        response = await self.client.get("/static/js/comments.js")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b"".join([block async for block in response])
+        self.assertEqual(len(content), int(response["Content-Length"]))
+
+
+class MetricsTest(TestCase):
+    """
+    Tests for the request metrics and the /metrics endpoint.
+
+    Methods:
+        setUp: Clears the cache and creates a staff member, an exercise
+        and an approved comment.
+        observed: Returns the count, sum and bucket counts recorded for
+        a histogram, view and method.
+        test_records_view_histograms: Ensures a request is recorded under
+        its view with its queries and size.
+        test_async_view_queries_counted: Ensures queries that async views
+        run in threads are counted.
+        test_cached_page_keeps_view_name: Ensures pages served from the
+        page cache are recorded under their view.
+        test_endpoint_is_staff_only: Ensures only staff can read the
+        metrics, in the Prometheus text format.
+        test_merges_worker_files: Ensures /metrics adds up the files
+        that every process writes to METRICS_DIR.
+        test_worker_files_removed: Ensures a worker's file is removed at
+        exit, and the file of a worker that died is dropped by readers.
+        test_threads_record_without_loss: Ensures observations from
+        concurrent threads all count.
+    """
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username="staff", password="password", is_staff=True
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.staff, status=1,
+        )
+        Comment.objects.create(
+            exercise=self.exercise, user=self.staff, body="Hi",
+            approved=True,
+        )
+
+    def observed(self, histogram, view, method="GET"):
+        series = registry.collect().get((histogram, view, method))
+        if series is None:
+            return 0, 0, []
+        return sum(series[:-1]), series[-1], series[:-1]
+
+    def test_records_view_histograms(self):
+        before = self.observed("duration", "home")[0]
+        response = self.client.get(reverse("home"))
+        self.assertEqual(self.observed("duration", "home")[0], before + 1)
+        self.assertGreaterEqual(self.observed("queries", "home")[1], 1)
+        self.assertGreaterEqual(
+            self.observed("response_size", "home")[1], len(response.content)
+        )
+
+    async def test_async_view_queries_counted(self):
+        before = self.observed("queries", "exercise_detail")[1]
+        response = await AsyncClient().get(
+            reverse("exercise_detail", args=[self.exercise.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(
+            self.observed("queries", "exercise_detail")[1], before + 2
+        )
+        self.assertGreater(
+            self.observed("db_duration", "exercise_detail")[1], 0
+        )
+
+    @override_settings(ANONYMOUS_PAGE_CACHE_TIMEOUT=60)
+    def test_cached_page_keeps_view_name(self):
+        url = reverse("exercise_detail", args=[self.exercise.pk])
+        self.client.get(url)
+        before = self.observed("duration", "exercise_detail")[0]
+        response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertEqual(
+            self.observed("duration", "exercise_detail")[0], before + 1
+        )
+
+    def test_endpoint_is_staff_only(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(
+            User.objects.create_user(username="member", password="x")
+        )
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.staff)
+        self.client.get(reverse("home"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn(
+            "# TYPE bullfit_request_duration_seconds histogram", body
+        )
+        count = self.observed("duration", "home")[0]
+        self.assertIn(
+            'bullfit_request_duration_seconds_bucket{view="home",'
+            f'method="GET",le="+Inf"}} {count}',
+            body,
+        )
+        self.assertIn(
+            f'bullfit_request_queries_count{{view="home",method="GET"}} '
+            f"{count}",
+            body,
+        )
+
+    def test_merges_worker_files(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        bounds = len(HISTOGRAMS["duration"][2])
+        other_worker = {
+            "histograms": [
+                [["duration", "home", "GET"], [0] * bounds + [5, 2.5]]
+            ],
+            "queries": [],
+        }
+        # A live process stands in for the other worker.
+        name = f"{os.getppid()}-other.json"
+        with open(os.path.join(directory.name, name), "w") as f:
+            json.dump(other_worker, f)
+
+        self.client.force_login(self.staff)
+        with override_settings(METRICS_DIR=directory.name):
+            self.client.get(reverse("home"))
+            own = self.observed("duration", "home")[0]
+            body = self.client.get(reverse("metrics")).content.decode()
+            files = os.listdir(directory.name)
+        self.assertIn(
+            'bullfit_request_duration_seconds_count{view="home",'
+            f'method="GET"}} {own + 5}',
+            body,
+        )
+        self.assertEqual(len(files), 2)
+
+    def test_worker_files_removed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        dead_file = os.path.join(directory.name, f"{dead.pid}-dead.json")
+        bounds = len(HISTOGRAMS["duration"][2])
+        with open(dead_file, "w") as f:
+            json.dump(
+                {
+                    "histograms": [
+                        [["duration", "home", "GET"], [0] * bounds + [5, 1]]
+                    ],
+                    "queries": [],
+                },
+                f,
+            )
+
+        self.client.force_login(self.staff)
+        with override_settings(METRICS_DIR=directory.name):
+            self.client.get(reverse("home"))
+            own = self.observed("duration", "home")[0]
+            body = self.client.get(reverse("metrics")).content.decode()
+            self.assertFalse(os.path.exists(dead_file))
+            self.assertIn(
+                'bullfit_request_duration_seconds_count{view="home",'
+                f'method="GET"}} {own}',
+                body,
+            )
+
+            # As at exit: the file goes and is not written again.
+            current = exporter()
+            current.remove()
+            current.write()
+            self.assertEqual(os.listdir(directory.name), [])
+
+    def test_threads_record_without_loss(self):
+        registry = Registry()
+
+        def work(_):
+            for _ in range(1000):
+                registry.observe("home", "GET", (None, None, 1, None))
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(8)))
+        collected = registry.collect()
+        series = collected[("queries", "home", "GET")]
+        self.assertEqual(sum(series[:-1]), 8000)
+        self.assertEqual(series[-1], 8000)
+        self.assertEqual(sum(collected[("duration", "home", "GET")]), 0)
+
+
+class MetricsShardTest(TransactionTestCase):
+    """
+    Tests for the statistics of requests served by ASGIHandler, which
+    runs the queries of each request in a new thread.
+
+    Methods:
+        setUp: Clears the cache and creates a user and an exercise.
+        get: Serves a GET through ASGIHandler and returns its status.
+        detail_queries: Returns the queries counted for the detail page.
+        test_thread_shards_stay_bounded: Ensures the shards of request
+        threads that have exited are folded away with their counts.
+    """
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=user, status=1,
+        )
+
+    def get(self, path):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", b"testserver")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(ASGIHandler())(scope, receive, send)
+        return messages[0]["status"]
+
+    def detail_queries(self):
+        return sum(
+            count
+            for (view, _), (count, _, _) in query_stats.collect().items()
+            if view == "exercise_detail"
+        )
+
+    def test_thread_shards_stay_bounded(self):
+        url = reverse("exercise_detail", args=[self.exercise.pk])
+        self.assertEqual(self.get(url), 200)
+        stats = (registry, query_stats, pool_stats)
+        for shards in stats:
+            shards.snapshot()
+        before = [len(shards.shards) for shards in stats]
+        queries = self.detail_queries()
+        checkouts = pool_stats.collect()[("default", "checkouts")]
+
+        for _ in range(20):
+            self.assertEqual(self.get(url), 200)
+        for shards, count in zip(stats, before):
+            shards.snapshot()
+            # Allows for the threads of the last request still exiting.
+            self.assertLessEqual(len(shards.shards), count + 2)
+        self.assertGreaterEqual(
+            pool_stats.collect()[("default", "checkouts")], checkouts + 20
+        )
+        self.assertGreaterEqual(self.detail_queries(), queries + 20)
+
+
+class QueryLogTest(TestCase):
+    """
+    Tests for the query fingerprints, the slow query log and the
+    top_queries command.
+
+    Methods:
+        setUp: Creates a user, an exercise and an approved comment.
+        test_fingerprint_strips_literals: Ensures queries that differ
+        only in their parameters share a fingerprint.
+        test_queries_attributed_to_view: Ensures queries are counted
+        under the view that ran them.
+        test_slow_query_logged_with_app_stack: Ensures a slow query is
+        logged with the line in exercises/views.py that ran it.
+        test_top_queries_command: Ensures the command lists the most
+        expensive fingerprints from METRICS_DIR.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Test Exercise", description="Test",
+            author=self.user, status=1,
+        )
+        self.comment = Comment.objects.create(
+            exercise=self.exercise, user=self.user, body="Hi",
+            approved=True,
+        )
+
+    def test_fingerprint_strips_literals(self):
+        self.assertEqual(
+            fingerprint(
+                "SELECT * FROM t WHERE a = 'it''s' AND b = 12.5\n"
+                "  AND c IN (%s, %s, %s) LIMIT 21"
+            ),
+            "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...) LIMIT ?",
+        )
+        self.assertEqual(
+            fingerprint('INSERT INTO "t" ("a") VALUES (%s), (%s), (%s)'),
+            fingerprint('INSERT INTO "t" ("a") VALUES (%s)'),
+        )
+        self.assertIn(
+            '"exercises_comment"',
+            fingerprint(str(Comment.objects.filter(pk=1).query)),
+        )
+        self.assertEqual(
+            fingerprint(str(Comment.objects.filter(pk=1).query)),
+            fingerprint(str(Comment.objects.filter(pk=2).query)),
+        )
+
+    def test_queries_attributed_to_view(self):
+        self.client.force_login(self.user)
+        before = query_stats.collect()
+        response = self.client.get(
+            reverse("edit_comment", args=[self.exercise.pk, self.comment.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        after = query_stats.collect()
+        counted = {
+            normalised: stats[0] - before.get((view, normalised), [0])[0]
+            for (view, normalised), stats in after.items()
+            if view == "edit_comment"
+        }
+        comment_lookups = [
+            normalised
+            for normalised, count in counted.items()
+            if count and 'FROM "exercises_comment"' in normalised
+        ]
+        self.assertEqual(len(comment_lookups), 1)
+        self.assertIn('"exercises_comment"."id" = ?', comment_lookups[0])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_query_logged_with_app_stack(self):
+        with self.assertLogs("exercises.slow_queries", "WARNING") as logs:
+            self.client.get(
+                reverse("exercise_comments", args=[self.exercise.pk])
+            )
+        output = "\n".join(logs.output)
+        self.assertIn("in exercise_comments [", output)
+        self.assertIn('exercises/views.py", line', output)
+        self.assertNotIn("querylog.py", output)
+
+    def test_top_queries_command(self):
+        with self.assertRaises(CommandError):
+            call_command("top_queries", stdout=StringIO())
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        other_worker = {
+            "histograms": [],
+            "queries": [
+                [["home", "SELECT ? FROM slow_table"], [3, 9.0, 5.0]],
+            ],
+        }
+        # A live process stands in for the other worker.
+        name = f"{os.getppid()}-other.json"
+        with open(os.path.join(directory.name, name), "w") as f:
+            json.dump(other_worker, f)
+        out = StringIO()
+        with override_settings(METRICS_DIR=directory.name):
+            self.client.get(reverse("home"))
+            call_command("top_queries", "--limit", "2", stdout=out)
+            by_view = StringIO()
+            call_command(
+                "top_queries", "--view", "home", "--sort", "count",
+                stdout=by_view,
+            )
+        lines = out.getvalue().splitlines()
+        self.assertIn("home", lines[1])
+        self.assertIn("9000.0", lines[1])
+        self.assertEqual(lines[2].strip(), "SELECT ? FROM slow_table")
+        self.assertEqual(len(lines), 5)
+        self.assertNotIn("<no request>", by_view.getvalue())
+
+
+class ConnectionPoolTest(TestCase):
+    """
+    Tests for the database connection statistics and bench_connections.
+
+    Methods:
+        wrapper: Returns an instrumented connection to a file database
+        of its own, with the given CONN_MAX_AGE.
+        request: Runs one query the way a request does, between the
+        request_started and request_finished checks.
+        stats: Returns the connection statistics recorded for an alias.
+        test_connection_per_request: Ensures every request waits for a
+        new connection when CONN_MAX_AGE is 0.
+        test_persistent_connection_reused: Ensures a persistent
+        connection is opened once and checked out by every request.
+        test_endpoint_reports_pool: Ensures /metrics includes the
+        connection statistics.
+        test_bench_connections: Ensures the benchmark adds up the
+        statistics of every worker and needs a route to request.
+    """
+    def wrapper(self, alias, max_age):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = type(connections["default"])(
+            {
+                **connection.settings_dict,
+                "NAME": os.path.join(directory.name, "pool.sqlite3"),
+                "CONN_MAX_AGE": max_age,
+            },
+            alias,
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def request(self, wrapper):
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.execute("SELECT 2")
+        wrapper.close_if_unusable_or_obsolete()
+
+    def stats(self, alias):
+        collected = pool_stats.collect()
+        return {
+            stat: collected.get((alias, stat), 0)
+            for stat in ("checkouts", "checked_out", "connects", "closes")
+        }
+
+    def test_connection_per_request(self):
+        wrapper = self.wrapper("per_request", 0)
+        for _ in range(3):
+            self.request(wrapper)
+        self.assertEqual(
+            self.stats("per_request"),
+            {"checkouts": 3, "checked_out": 0, "connects": 3, "closes": 3},
+        )
+        self.assertGreater(
+            pool_stats.collect()[("per_request", "connect_seconds")], 0
+        )
+
+    def test_persistent_connection_reused(self):
+        wrapper = self.wrapper("persistent", None)
+        for _ in range(3):
+            self.request(wrapper)
+        self.assertEqual(
+            self.stats("persistent"),
+            {"checkouts": 3, "checked_out": 0, "connects": 1, "closes": 0},
+        )
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.assertEqual(self.stats("persistent")["checked_out"], 1)
+
+    def test_endpoint_reports_pool(self):
+        self.client.force_login(
+            User.objects.create_user(
+                username="staff", password="x", is_staff=True
+            )
+        )
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn("# TYPE bullfit_db_checkouts_total counter", body)
+        self.assertIn(
+            "# TYPE bullfit_db_connections_checked_out gauge", body
+        )
+        self.assertRegex(
+            body, r'bullfit_db_connects_total\{alias="default"\} \d+'
+        )
+
+    def test_bench_connections(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for worker, connects in (("1-a", 1), ("2-b", 2)):
+            with open(
+                os.path.join(directory.name, f"{worker}.json"), "w"
+            ) as f:
+                json.dump(
+                    {
+                        "histograms": [],
+                        "queries": [],
+                        "pool": [
+                            [["default", "checkouts"], 10],
+                            [["default", "connects"], connects],
+                            [["default", "connect_seconds"], 0.5],
+                        ],
+                    },
+                    f,
+                )
+        self.assertEqual(
+            read_pool_stats(directory.name),
+            {
+                "checkouts": 20,
+                "connects": 3,
+                "connect_seconds": 1.0,
+                "closes": 0,
+            },
+        )
+        with self.assertRaisesMessage(CommandError, "--path"):
+            call_command("bench_connections", stdout=StringIO())
+
+
+@override_settings(
+    DATABASE_ROUTERS=["exercises.routers.ReplicaRouter"],
+    DATABASE_REPLICAS=["replica"],
+)
+class ReplicaRouterTest(TestCase):
+    """
+    Tests for the read replica router, with a second SQLite database as
+    the replica. The exercise has a different title in each, so a page
+    shows which database it was read from.
+
+    Methods:
+        setUp: Clears the cache and the replicas marked down, and creates
+        the user and exercise in both databases.
+        test_public_pages_read_from_replica: Ensures anonymous GETs of
+        the public pages read from the replica.
+        test_reads_own_writes: Ensures a user redirected after adding a
+        comment reads it back from the primary.
+        test_falls_back_to_primary: Ensures an unreachable replica is
+        skipped, and not retried by every request.
+        test_round_robin: Ensures requests take the replicas in turn.
+        test_replica_pages_cached_briefly: Ensures what is read from a
+        replica is only cached for REPLICA_CACHE_TIMEOUT.
+    """
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        routers._down_until.clear()
+        self.user = User.objects.create_user(
+            username="testuser", password="password"
+        )
+        self.exercise = Exercise.objects.create(
+            title="Primary Title", description="Test",
+            author=self.user, status=1,
+        )
+        replica_user = User.objects.using("replica").create(
+            pk=self.user.pk, username="testuser"
+        )
+        Exercise.objects.using("replica").create(
+            pk=self.exercise.pk, title="Replica Title", description="Test",
+            author=replica_user, status=1,
+        )
+        self.detail_url = reverse("exercise_detail", args=[self.exercise.pk])
+
+    def test_public_pages_read_from_replica(self):
+        self.assertContains(self.client.get(self.detail_url), "Replica Title")
+        self.assertContains(self.client.get(reverse("home")), "Replica Title")
+        self.assertContains(
+            self.client.get(reverse("search") + "?q=title"), "Replica Title"
+        )
+
+    def test_reads_own_writes(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("add_comment", args=[self.exercise.pk]),
+            {"body": "My pending comment"},
+        )
+        self.assertRedirects(
+            response, self.detail_url, fetch_redirect_response=False
+        )
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "Primary Title")
+        self.assertContains(response, "My pending comment")
+
+        # Once the pin expires, the public pages go back to the replica.
+        self.client.cookies.pop(PIN_COOKIE)
+        cache.clear()  # The body fragment is cached from the primary.
+        self.assertContains(self.client.get(self.detail_url), "Replica Title")
+
+    def test_falls_back_to_primary(self):
+        with mock.patch.object(
+            connections["replica"],
+            "ensure_connection",
+            side_effect=OperationalError("unable to open database file"),
+        ) as ensure_connection, self.assertLogs(
+            "exercises.routers", "WARNING"
+        ):
+            for _ in range(2):
+                self.assertContains(
+                    self.client.get(self.detail_url), "Primary Title"
+                )
+        self.assertEqual(ensure_connection.call_count, 1)
+
+    def test_round_robin(self):
+        with override_settings(DATABASE_REPLICAS=["replica", "default"]):
+            picked = [routers.pick_replica() for _ in range(4)]
+        self.assertEqual(picked[0], picked[2])
+        self.assertEqual(picked[1], picked[3])
+        self.assertEqual(set(picked), {"replica", "default"})
+
+    def test_replica_pages_cached_briefly(self):
+        routing = RequestRouting()
+        token = routers.current_routing.set(routing)
+        self.addCleanup(routers.current_routing.reset, token)
+        self.assertEqual(routers.cache_timeout(3600), 3600)
+        routing.replica = "replica"
+        self.assertEqual(routers.cache_timeout(3600), 60)
+        self.assertEqual(routers.cache_timeout(10), 10)
+
+
+class CommentModerationTest(TestCase):
+    """
+    Tests for the set-based moderation actions and queue in the admin.
+
+    Methods:
+        setUp: Creates a superuser, two exercises and a mix of pending
+        and approved comments, one of them reported.
+        changelist_action: Posts an admin action for the given comments.
+        test_bulk_approve_is_one_update: Ensures approving updates every
+        comment in one statement and refreshes the counters.
+        test_bulk_unapprove: Ensures approval can be withdrawn in bulk.
+        test_bulk_delete_is_set_based: Ensures deleting removes comments
+        and their reports with one DELETE each.
+        test_bulk_actions_invalidate_on_commit: Ensures the exercises'
+        cache versions only move on once the change is committed.
+        test_changelist_joins_relations: Ensures the changelist query
+        count does not grow with the number of comments.
+        test_queue_has_fixed_query_cost: Ensures the moderation queue
+        costs the same with 1 or 40 pending comments.
+        test_queue_actions: Ensures approve/delete posted from the queue
+        are applied and unknown actions or bad ids are rejected.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", password="password", email="a@example.com"
+        )
+        self.client.login(username="admin", password="password")
+        self.exercises = [
+            Exercise.objects.create(
+                title=f"Exercise {i}", description="Test",
+                author=self.user, status=1,
+            )
+            for i in range(2)
+        ]
+        self.pending = [
+            Comment.objects.create(
+                exercise=self.exercises[i % 2], user=self.user,
+                body=f"Pending {i}",
+            )
+            for i in range(4)
+        ]
+        self.approved = Comment.objects.create(
+            exercise=self.exercises[0], user=self.user, body="Approved",
+            approved=True,
+        )
+        CommentReport.objects.create(
+            user=self.user, comment=self.pending[0], reason="Spam"
+        )
+        Exercise.objects.recount_comments()
+
+    def changelist_action(self, action, comments):
+        return self.client.post(
+            reverse("admin:exercises_comment_changelist"),
+            {
+                "action": action,
+                "_selected_action": [comment.pk for comment in comments],
+                "post": "yes",
+            },
+        )
+
+    def counters(self):
+        return list(
+            Exercise.objects.order_by("pk").values_list(
+                "comment_count", "approved_comment_count"
+            )
+        )
+
+    def test_bulk_approve_is_one_update(self):
+        with CaptureQueriesContext(connection) as context:
+            self.changelist_action("approve_comments", self.pending)
+        updates = [
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "exercises_comment"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(Comment.objects.filter(approved=False).exists())
+        self.assertEqual(self.counters(), [(3, 3), (2, 2)])
+
+    def test_bulk_unapprove(self):
+        self.changelist_action("unapprove_comments", [self.approved])
+        self.approved.refresh_from_db()
+        self.assertFalse(self.approved.approved)
+        self.assertEqual(self.counters(), [(3, 0), (2, 0)])
+
+    def test_bulk_delete_is_set_based(self):
+        with CaptureQueriesContext(connection) as context:
+            self.changelist_action("delete_selected", self.pending)
+        deletes = [
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith("DELETE")
+        ]
+        self.assertEqual(len(deletes), 2)
+        self.assertEqual(list(Comment.objects.all()), [self.approved])
+        self.assertFalse(CommentReport.objects.exists())
+        self.assertEqual(self.counters(), [(1, 1), (0, 0)])
+
+    def test_bulk_actions_invalidate_on_commit(self):
+        pks = [exercise.pk for exercise in self.exercises]
+
+        def versions():
+            return [get_exercise_version(pk) for pk in pks]
+
+        before = versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.filter(pk=self.pending[0].pk).set_approved(True)
+            Comment.objects.filter(pk=self.pending[1].pk).bulk_delete()
+            self.assertEqual(versions(), before)
+        after = versions()
+        self.assertNotEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+
+    def test_changelist_joins_relations(self):
+        url = reverse("admin:exercises_comment_changelist")
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        for i in range(20):
+            Comment.objects.create(
+                exercise=self.exercises[1], user=self.user, body=f"More {i}"
+            )
+        with self.assertNumQueries(len(few)):
+            self.client.get(url)
+
+    def test_queue_has_fixed_query_cost(self):
+        url = reverse("admin:exercises_comment_moderation")
+        Comment.objects.filter(
+            pk__in=[comment.pk for comment in self.pending[1:]]
+        ).delete()
+        with CaptureQueriesContext(connection) as one:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["comments"]), 1)
+        for i in range(40):
+            Comment.objects.create(
+                exercise=self.exercises[i % 2], user=self.user,
+                body=f"Queued {i}",
+            )
+        with self.assertNumQueries(len(one)):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["comments"]), 41)
+        self.assertContains(response, "js/moderation.js")
+
+    def test_queue_actions(self):
+        url = reverse("admin:exercises_comment_moderation")
+        response = self.client.post(
+            url, {"action": "approve", "comment": [self.pending[1].pk]}
+        )
+        self.assertRedirects(response, url)
+        self.pending[1].refresh_from_db()
+        self.assertTrue(self.pending[1].approved)
+
+        self.client.post(
+            url, {"action": "delete", "comment": [self.pending[2].pk]}
+        )
+        self.assertFalse(
+            Comment.objects.filter(pk=self.pending[2].pk).exists()
+        )
+        self.assertEqual(self.counters(), [(2, 1), (2, 1)])
+
+        response = self.client.post(url, {"action": "nope"})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            url, {"action": "approve", "comment": [self.pending[3].pk, "x"]}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.pending[3].refresh_from_db()
+        self.assertFalse(self.pending[3].approved)
+
+
 #
 # URL Tests
 #
@@ -0,0 +1,132 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# How long a bucket may stay locked by a request that died holding it,
+# and how long another request waits for it before giving up.
+LOCK_TIMEOUT = 1
+LOCK_WAIT = 0.2
+LOCK_INTERVAL = 0.005
+
+
+class TokenBucket:
+    """
+    A token bucket kept in the cache, shared by every worker.
+
+    Each identity starts with `capacity` tokens and gets one back every
+    `refill` seconds, up to `capacity`. A request spends one token, so
+    short bursts pass while a sustained rate is held to one request per
+    `refill` seconds.
+
+    The read-modify-write of a bucket runs under a lock taken with
+    cache.add(), which the cache backends make atomic. A request that
+    cannot take the lock in time is refused rather than let through, so
+    a flood of parallel requests from one identity cannot overspend.
+
+    Attributes:
+        scope: Names the bucket family in cache keys, e.g. "report:ip".
+        capacity: The largest burst allowed.
+        refill: Seconds it takes to earn back one token.
+    """
+
+    def __init__(self, scope, capacity, refill):
+        self.scope = scope
+        self.capacity = capacity
+        self.refill = refill
+
+    @property
+    def cache(self):
+        # The throttle must see every worker's spending at once, so it
+        # skips the per-process tier of the default cache.
+        return caches[getattr(settings, "THROTTLE_CACHE_ALIAS", "default")]
+
+    def key(self, identity):
+        digest = hashlib.md5(str(identity).encode()).hexdigest()
+        return f"throttle:{self.scope}:{digest}"
+
+    def consume(self, identity):
+        """
+        Spends a token for an identity.
+
+        Args:
+            identity: The user, address or other value being limited.
+
+        Returns:
+            float: 0 if the request may proceed, otherwise the number of
+            seconds until it would be allowed.
+        """
+        key = self.key(identity)
+        lock_key = f"{key}:lock"
+        deadline = time.monotonic() + LOCK_WAIT
+        while not self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return self.refill
+            time.sleep(LOCK_INTERVAL)
+
+        try:
+            now = time.time()
+            tokens, updated = self.cache.get(key, (self.capacity, now))
+            tokens = min(
+                self.capacity, tokens + (now - updated) / self.refill
+            )
+            if tokens < 1:
+                return (1 - tokens) * self.refill
+            # A bucket left alone for capacity * refill seconds is full
+            # again, which is what a missing key means.
+            self.cache.set(
+                key,
+                (tokens - 1, now),
+                math.ceil(self.capacity * self.refill),
+            )
+            return 0
+        finally:
+            self.cache.delete(lock_key)
+
+
+def client_ip(request):
+    """
+    Returns the address a request came from.
+
+    Behind NUM_PROXIES reverse proxies (Heroku's router is one), the
+    address is read from that many entries from the right of
+    X-Forwarded-For, as entries further left are supplied by the client.
+    """
+    proxies = getattr(settings, "NUM_PROXIES", 0)
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+    if proxies and forwarded:
+        addresses = [address.strip() for address in forwarded.split(",")]
+        return addresses[-min(proxies, len(addresses))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def throttle(request, name):
+    """
+    Spends a token from each of the buckets configured for an action.
+
+    THROTTLE_RATES[name] maps "user" and/or "ip" to a (capacity,
+    refill) pair. The user bucket is only used for signed-in users.
+
+    Args:
+        request: The request being limited.
+        name: The action, e.g. "report_comment".
+
+    Returns:
+        int: 0 if the request may proceed, otherwise the whole number
+        of seconds to put in the Retry-After header.
+    """
+    rates = getattr(settings, "THROTTLE_RATES", {}).get(name, {})
+    identities = {"ip": client_ip(request)}
+    if request.user.is_authenticated:
+        identities["user"] = request.user.pk
+
+    for kind, (capacity, refill) in rates.items():
+        if kind not in identities:
+            continue
+        bucket = TokenBucket(f"{name}:{kind}", capacity, refill)
+        wait = bucket.consume(identities[kind])
+        if wait:
+            return max(1, math.ceil(wait))
+    return 0
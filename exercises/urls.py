@@ -8,9 +8,15 @@ from django.contrib.auth import views as auth_views
 
 urlpatterns = [
     path("", views.ExerciseListView.as_view(), name="home"),
+    path("search/", views.ExerciseSearchView.as_view(), name="search"),
     path(
         "exercise/<int:pk>/", views.exercise_detail, name="exercise_detail"
     ),
+    path(
+        "exercise/<int:pk>/comments/",
+        views.exercise_comments,
+        name="exercise_comments",
+    ),
     path(
         "exercise/<int:pk>/comment/edit/<int:comment_id>/",
         views.edit_comment,
@@ -35,6 +41,7 @@ urlpatterns = [
         name="report_comment",
     ),
     path("accounts/login/", auth_views.LoginView.as_view(), name="login"),
+    path("metrics", views.metrics, name="metrics"),
 ]
 handler404 = "exercises.views.custom_404_view"
 
@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login as auth_login
@@ -9,45 +10,184 @@ from django.views import generic
 from django.views.generic.edit import FormView
 from django.urls import reverse_lazy
 from .forms import ContactMessageForm, ReportCommentForm
-from django.db import models
-from django.http import JsonResponse
+from django.db import models, transaction
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse, Http404
 from django.template.loader import render_to_string
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.conf import settings
+from .pagination import CursorPaginator, InvalidCursor
+from .spool import contact_spool, enqueue_contact_message
+from .throttle import throttle
+from .metrics import (
+    CONTENT_TYPE,
+    collect_all,
+    collect_pool_stats,
+    render as render_metrics,
+)
+from .cache import (
+    fill_owner_controls,
+    get_comment_page,
+    get_exercise_fragments,
+)
+from .conditional import (
+    conditional_page,
+    exercise_etag,
+    exercise_last_modified,
+    exercise_list_etag,
+    exercise_list_last_modified,
+)
+from django.utils.decorators import method_decorator
 
 
+@method_decorator(
+    conditional_page(exercise_list_etag, exercise_list_last_modified),
+    name="dispatch",
+)
 class ExerciseListView(generic.ListView):
     model = Exercise
     template_name = "exercises/exercise_list.html"
     context_object_name = "exercises"
     paginate_by = 6
 
+    def get_queryset(self):
+        # Ordered by title, with the id as a tie-breaker so that offset
+        # and cursor pages list the exercises in the same order.
+        return Exercise.published.summaries().order_by("title", "id")
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates by keyset when EXERCISE_LIST_CURSOR_PAGINATION is on.
+
+        Cursor pages seek on (title, id) and skip the COUNT(*) that the
+        offset paginator runs. Legacy ?page=N links still resolve through
+        the offset paginator, but the PREV/NEXT links they render carry
+        cursors, so following them moves onto the cheaper path.
+        """
+        if not getattr(settings, "EXERCISE_LIST_CURSOR_PAGINATION", False):
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size)
+        cursor = self.request.GET.get("cursor")
+
+        if cursor is None and self.request.GET.get("page"):
+            offset_paginator, offset_page, object_list, is_paginated = (
+                super().paginate_queryset(queryset, page_size)
+            )
+            page = paginator.page_for(
+                list(object_list),
+                offset_page.has_next(),
+                offset_page.has_previous(),
+            )
+        else:
+            try:
+                page = paginator.page(cursor)
+            except InvalidCursor:
+                raise Http404("Invalid cursor.")
+
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class ExerciseSearchView(generic.ListView):
+    """
+    Lists the published exercises matching ?q=, most relevant first.
+    """
+    template_name = "exercises/search_results.html"
+    context_object_name = "exercises"
+    paginate_by = 6
+
+    def get_queryset(self):
+        self.query = self.request.GET.get("q", "").strip()
+        if not self.query:
+            return Exercise.published.none()
+        return Exercise.published.summaries().search(self.query)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["contact_form"] = (
-            ContactMessageForm()
-        )  # Use 'contact_form' to avoid confusion
+        context["query"] = self.query
         return context
 
-    def get_queryset(self):
-        return Exercise.objects.order_by("title")  # Ordered by title
 
+async def _auser(request):
+    """
+    Returns request.user, loading it (and the session) in a thread so an
+    async view never queries the database from the event loop.
+    """
+    user = request.user
+    await sync_to_async(lambda: user.is_authenticated)()
+    return user
 
-def exercise_detail(request, pk):
-    exercise = get_object_or_404(Exercise, pk=pk)
-    comments = exercise.comments.all()
+
+async def _aget_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise Http404(
+            f"No {queryset.model._meta.object_name} matches the given query."
+        )
+
+
+@conditional_page(exercise_etag, exercise_last_modified)
+async def exercise_detail(request, pk):
+    exercise = await _aget_or_404(Exercise.published, pk=pk)
+    # The body and first page of comments come from the shared fragment
+    # cache; only the viewer's own pending comments and Edit/Delete
+    # buttons are added per request. Later pages load from
+    # exercise_comments as the reader scrolls.
+    fragments = await sync_to_async(get_exercise_fragments)(exercise)
     comment_form = CommentForm()
-    comment_count = comments.count()
+    user = await _auser(request)
+
+    pending_comments = []
+    if user.is_authenticated:
+        pending_comments = [
+            comment
+            async for comment in exercise.comments.filter(
+                user=user, approved=False
+            ).select_related("user")
+        ]
+    pending = (
+        render_to_string(
+            "exercises/comment_list.html", {"comments": pending_comments}
+        )
+        if pending_comments
+        else ""
+    )
 
     context = {
         "exercise": exercise,
-        "comments": comments,
-        "comment_count": comment_count,
+        "exercise_body": fragments["body"],
+        "comment_list": fill_owner_controls(
+            pending + fragments["comments"], exercise.pk, user
+        ),
+        # Counts the comments the list shows: the approved ones and the
+        # viewer's own awaiting approval.
+        "comment_count": (
+            exercise.approved_comment_count + len(pending_comments)
+        ),
         "comment_form": comment_form,
     }
 
     return render(request, "exercises/exercise_detail.html", context)
 
 
+def exercise_comments(request, pk):
+    """
+    Returns the next page of an exercise's approved comments as an HTML
+    fragment, for comments.js to append below the ones already shown.
+
+    The page is chosen by the ?cursor= token in the previous page's
+    "load more" link.
+    """
+    exercise = get_object_or_404(
+        Exercise.published.only("pk"), pk=pk
+    )
+    try:
+        html = get_comment_page(exercise, request.GET.get("cursor"))
+    except InvalidCursor:
+        raise Http404("Invalid cursor.")
+    return HttpResponse(fill_owner_controls(html, exercise.pk, request.user))
+
+
 @login_required
 def edit_comment(request, pk, comment_id):
     exercise = get_object_or_404(Exercise, pk=pk)
@@ -81,7 +221,11 @@ def add_comment(request, pk):
             comment = form.save(commit=False)
             comment.exercise = exercise
             comment.user = request.user
-            comment.save()
+            with transaction.atomic():
+                comment.save()
+                Exercise.objects.filter(pk=exercise.pk).adjust_comment_counts(
+                    comments=1, approved=int(comment.approved)
+                )
             messages.success(
                 request,
                 "Your comment has been added and is awaiting approval.",
@@ -101,8 +245,14 @@ def delete_comment(request, pk, comment_id):
     exercise = get_object_or_404(Exercise, pk=pk)
     comment = get_object_or_404(Comment, id=comment_id)
 
-    if comment.user == request.user:
-        comment.delete()
+    if comment.user_id == request.user.id:
+        with transaction.atomic():
+            comment.delete()
+            Exercise.objects.filter(
+                pk=comment.exercise_id
+            ).adjust_comment_counts(
+                comments=-1, approved=-int(comment.approved)
+            )
         messages.add_message(request, messages.SUCCESS, "Comment deleted!")
     else:
         messages.add_message(
@@ -113,11 +263,20 @@ def delete_comment(request, pk, comment_id):
     return redirect("exercise_detail", pk=pk)
 
 
-def contact_form(request):
+async def contact_form(request):
+    # Loads the session up front; the messages context processor would
+    # otherwise read it from the event loop while rendering.
+    await _auser(request)
     if request.method == "POST":
         form = ContactMessageForm(request.POST)
         if form.is_valid():
-            form.save()
+            # With a spool configured the message is queued and stored
+            # in batches by the contact worker; otherwise saved here.
+            spool = contact_spool()
+            if spool is not None:
+                await sync_to_async(enqueue_contact_message)(spool, form)
+            else:
+                await form.instance.asave()
             messages.success(
                 request,
                 "Thank you for your message. We will get back to you soon!",
@@ -134,9 +293,10 @@ def contact_form(request):
     return render(request, "exercises/contact_form.html", {"form": form})
 
 
-def report_comment(request, comment_id):
+async def report_comment(request, comment_id):
+    user = await _auser(request)
 
-    if not request.user.is_authenticated:
+    if not user.is_authenticated:
         if request.headers.get("x-requested-with") == "XMLHttpRequest":
             return JsonResponse(
                 {"redirect_url": "/accounts/login/"}, status=403
@@ -144,19 +304,34 @@ def report_comment(request, comment_id):
 
         return redirect("login")
 
-    comment = get_object_or_404(Comment, id=comment_id)
+    # Reports are rate limited per user and per address before anything
+    # touches the database.
+    if request.method == "POST":
+        retry_after = await sync_to_async(throttle)(
+            request, "report_comment"
+        )
+        if retry_after:
+            return JsonResponse(
+                {
+                    "message": "You are reporting comments too quickly. "
+                    "Please try again later.",
+                    "retry_after": retry_after,
+                },
+                status=429,
+                headers={"Retry-After": str(retry_after)},
+            )
+
+    comment = await _aget_or_404(Comment.objects, id=comment_id)
 
     # Handle POST request for submitting the report
 
     if request.method == "POST":
         form = ReportCommentForm(request.POST)
         if form.is_valid():
-            # Create the comment report
+            # Create the comment report, or update this user's earlier one
 
-            CommentReport.objects.create(
-                user=request.user,
-                comment=comment,
-                reason=form.cleaned_data["reason"],
+            await CommentReport.objects.afile(
+                user, comment, form.cleaned_data["reason"]
             )
             return JsonResponse(
                 {"message": "Comment reported successfully!"}
@@ -183,5 +358,18 @@ def report_comment(request, comment_id):
     )
 
 
+def metrics(request):
+    """
+    Serves the request and database connection metrics of every worker
+    in the Prometheus text format, to staff only.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(
+        render_metrics(collect_all(), collect_pool_stats()),
+        content_type=CONTENT_TYPE,
+    )
+
+
 def custom_404_view(request, exception):
     return render(request, "exercises/404.html", status=404)
@@ -1,22 +1,69 @@
+/* jshint esversion: 6 */
 document.addEventListener('DOMContentLoaded', function() {
-    var deleteButtons = document.querySelectorAll('.btn-delete');
-    var deleteConfirmButton = document.getElementById('deleteConfirm');
+    // The exercise page ships the first page of comments only; the rest
+    // are fetched a page at a time as the reader scrolls to the end.
+    const section = document.querySelector('.comment-section');
 
-    deleteButtons.forEach(function(button) {
-        button.addEventListener('click', function() {
-            var commentId = button.getAttribute('data-comment_id');
-            var exercisePk = button.getAttribute('data-exercise_pk');
-            var url = "{% url 'delete_comment' 'EXERCISE_PK' 'COMMENT_ID' %}".replace('EXERCISE_PK', exercisePk).replace('COMMENT_ID', commentId);
+    function loadMore(sentinel) {
+        if (sentinel.dataset.loading) {
+            return;
+        }
+        sentinel.dataset.loading = 'true';
+        fetch(sentinel.dataset.nextUrl, {
+            headers: {'X-Requested-With': 'XMLHttpRequest'},
+            credentials: 'same-origin'
+        })
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error('Failed to load comments: ' + response.status);
+                }
+                return response.text();
+            })
+            .then(function(html) {
+                // The fragment ends with its own sentinel if there is more.
+                sentinel.insertAdjacentHTML('beforebegin', html);
+                sentinel.remove();
+                watch();
+            })
+            .catch(function(error) {
+                console.error(error);
+                delete sentinel.dataset.loading;
+            });
+    }
+
+    const observer = 'IntersectionObserver' in window ?
+        new IntersectionObserver(function(entries) {
+            entries.forEach(function(entry) {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    loadMore(entry.target);
+                }
+            });
+        }, {rootMargin: '400px'}) : null;
 
-            deleteConfirmButton.setAttribute('href', url);
+    function watch() {
+        const sentinel = section && section.querySelector('.comments-more');
+        if (sentinel && observer) {
+            observer.observe(sentinel);
+        }
+    }
+
+    if (section) {
+        // Without JavaScript the link opens the next page on its own.
+        section.addEventListener('click', function(event) {
+            const link = event.target.closest('.comments-more-link');
+            if (link) {
+                event.preventDefault();
+                loadMore(link.closest('.comments-more'));
+            }
         });
-    });
-});
+        watch();
+    }
 
     // Check for messages and display the message modal
     const messageModal = document.getElementById('messageModal');
-    const messages = messageModal.getAttribute('data-messages');
-    
+    const messages = messageModal && messageModal.getAttribute('data-messages');
+
     if (messages) {
         const parsedMessages = JSON.parse(messages);
         const messageBody = messageModal.querySelector('.modal-body');
@@ -24,4 +71,4 @@ document.addEventListener('DOMContentLoaded', function() {
         const modal = new bootstrap.Modal(messageModal);
         modal.show();
     }
-
+});
@@ -0,0 +1,84 @@
+/* jshint esversion: 6 */
+// Keyboard shortcuts for the comment moderation queue in the admin.
+// j/k move between comments, x toggles the highlighted one, and a/d
+// approve or delete the selection (or the highlighted comment if
+// nothing is selected) by submitting the queue form.
+(function () {
+    document.addEventListener('DOMContentLoaded', function () {
+        const form = document.getElementById('moderation-form');
+        if (!form) {
+            return;
+        }
+        const rows = Array.from(form.querySelectorAll('.moderation-row'));
+        let current = 0;
+
+        // Highlight a row and move keyboard focus onto it.
+        function focusRow(index) {
+            if (!rows.length) {
+                return;
+            }
+            current = Math.max(0, Math.min(index, rows.length - 1));
+            rows.forEach(function (row, i) {
+                row.classList.toggle('selected', i === current);
+            });
+            rows[current].focus();
+        }
+
+        // Submit the form with the chosen action. If no checkbox is
+        // ticked, the highlighted comment is the one acted on.
+        function submit(action) {
+            const boxes = form.querySelectorAll('input[name="comment"]');
+            const anyChecked = Array.from(boxes).some(function (box) {
+                return box.checked;
+            });
+            if (!anyChecked) {
+                rows[current].querySelector('input[name="comment"]').checked = true;
+            }
+            if (action === 'delete' && !window.confirm('Delete the selected comments?')) {
+                return;
+            }
+            const button = form.querySelector('button[value="' + action + '"]');
+            if (button) {
+                form.requestSubmit(button);
+            }
+        }
+
+        rows.forEach(function (row, i) {
+            row.addEventListener('click', function () {
+                focusRow(i);
+            });
+        });
+
+        document.addEventListener('keydown', function (event) {
+            // Leave shortcuts alone while typing or using modifiers.
+            if (event.ctrlKey || event.metaKey || event.altKey ||
+                    event.target.matches('input[type="text"], textarea')) {
+                return;
+            }
+            switch (event.key) {
+                case 'j':
+                    focusRow(current + 1);
+                    break;
+                case 'k':
+                    focusRow(current - 1);
+                    break;
+                case 'x': {
+                    const box = rows[current].querySelector('input[name="comment"]');
+                    box.checked = !box.checked;
+                    break;
+                }
+                case 'a':
+                    submit('approve');
+                    break;
+                case 'd':
+                    submit('delete');
+                    break;
+                default:
+                    return;
+            }
+            event.preventDefault();
+        });
+
+        focusRow(0);
+    });
+})();
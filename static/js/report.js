@@ -82,6 +82,14 @@
                 console.error("Report comment form submission failed:", status, error);
                 $('#reportModal .modal-body').html('<p>There was an error with your submission.</p>'); // Show an error message
 
+                // The server rate limits reports; say when to try again
+                if (xhr.status === 429) {
+                    const response = xhr.responseJSON || {};
+                    const $notice = $('<p></p>').text(response.message || 'You are reporting comments too quickly. Please try again later.');
+                    $('#reportModal .modal-body').empty().append($notice);
+                    return;
+                }
+
                 // Handle permission errors similarly to the form loading logic
                 if (xhr.status === 403) {
                     try {